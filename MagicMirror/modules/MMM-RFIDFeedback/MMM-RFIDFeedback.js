@@ -2,6 +2,7 @@ Module.register("MMM-RFIDFeedback", {
   defaults: {
     duration: 10000,
     endpoint: "http://localhost:8000/feedback",
+    streamEndpoint: "http://localhost:8000/feedback/stream",
     updateInterval: 10000
   },
 
@@ -12,10 +13,45 @@ Module.register("MMM-RFIDFeedback", {
     this.message = null;
     this.hideTimer = null;
 
-    this.getFeedback();  // 初回実行
-    setInterval(() => {
-      this.getFeedback();  // 一定間隔で更新
-    }, this.config.updateInterval);
+    // サーバからのプッシュ（SSE）で受け取る。非対応環境のみポーリング
+    if (typeof EventSource !== "undefined" && this.config.streamEndpoint) {
+      this.subscribe();
+    } else {
+      this.getFeedback();  // 初回実行
+      setInterval(() => {
+        this.getFeedback();  // 一定間隔で更新
+      }, this.config.updateInterval);
+    }
+  },
+
+  subscribe: function () {
+    const source = new EventSource(this.config.streamEndpoint);
+    source.addEventListener("feedback", (event) => {
+      try {
+        const data = JSON.parse(event.data);
+        console.log("[subscribe] 受信データ:", data);
+        if (data && data.message) {
+          this.showMessage(data.message);
+        }
+      } catch (error) {
+        console.error("[受信エラー] フィードバック解析中に例外発生:", error);
+      }
+    });
+    source.onerror = () => {
+      // EventSource は自動で再接続する
+      console.warn("[subscribe] ストリーム切断、再接続待ち");
+    };
+  },
+
+  showMessage: function (message) {
+    this.message = message;
+    this.updateDom();
+
+    if (this.hideTimer) clearTimeout(this.hideTimer);
+    this.hideTimer = setTimeout(() => {
+      this.message = null;
+      this.updateDom();
+    }, this.config.duration);
   },
 
   getDom: function () {
@@ -50,15 +86,8 @@ Module.register("MMM-RFIDFeedback", {
       .then(data => {
         console.log("[getFeedback] 取得データ:", data);
         if (data && data.message) {
-          this.message = data.message;
-          console.log("[getFeedback] メッセージ更新:", this.message);
-          this.updateDom();
-
-          if (this.hideTimer) clearTimeout(this.hideTimer);
-          this.hideTimer = setTimeout(() => {
-            this.message = null;
-            this.updateDom();
-          }, this.config.duration);
+          console.log("[getFeedback] メッセージ更新:", data.message);
+          this.showMessage(data.message);
         }
       })
       .catch(error => {
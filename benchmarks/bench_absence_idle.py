@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+リーダー待機中（誰もタグを触っていない状態）のCPU使用量ベンチマーク。
+
+登録タグ 10k 件の state（旧方式は dict、新方式は PresenceStore）を用意し、HID入力が来ないパイプを相手に
+- 旧方式: select を0.2秒ごとに起こし、1秒ごとに state 全件をスイープ
+- 新方式: AbsenceTimers の次の期限（無ければ統計表示など）まで眠る
+をそれぞれ --seconds 秒回して、プロセスCPU時間と起床回数を比べる。
+あわせて、スイープ1回あたりのコストも測る。
+
+    python benchmarks/bench_absence_idle.py --tags 10000 --seconds 5
+"""
+import argparse
+import os
+import select
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import client_input_server as reader  # noqa: E402
+from presence import AbsenceTimers, PresenceStore  # noqa: E402
+
+LEGACY_SWEEP_INTERVAL = 1.0
+
+
+def make_state(n):
+    state = {}
+    tags_meta = {}
+    now = time.time()
+    for i in range(n):
+        tid = f"E218{i:019d}"
+        tags_meta[tid] = {"name": f"item{i}", "category": "リップ"}
+        # 一度は検出されて、今は離席中のタグ
+        state[tid] = {"name": f"item{i}", "category": "リップ", "is_present": False,
+                      "last_seen": now - 3600, "absent_since": now - 3590, "session_logged": True}
+    return state, tags_meta
+
+
+def make_store(n):
+    store = PresenceStore()
+    now = time.monotonic()
+    for i in range(n):
+        idx = store.upsert(f"E218{i:019d}", f"item{i}", "リップ")
+        store.observe(idx, now - 3600)
+        store.mark_absent(idx, now - 3590)
+    return store
+
+
+def legacy_sweep(state, tags_meta, now):
+    for tid, st in state.items():
+        if tid not in tags_meta:
+            continue
+        if st["last_seen"] is None:
+            continue
+        if st["is_present"] and (now - st["last_seen"] > reader.ABSENCE_THRESHOLD):
+            st["is_present"] = False
+
+
+def legacy_idle(fd, state, tags_meta, seconds):
+    wakeups = 0
+    last_sweep = 0.0
+    end = time.time() + seconds
+    while time.time() < end:
+        now = time.time()
+        if now - last_sweep >= LEGACY_SWEEP_INTERVAL:
+            legacy_sweep(state, tags_meta, now)
+            last_sweep = now
+        select.select([fd], [], [], 0.2)
+        wakeups += 1
+    return wakeups
+
+
+def timer_idle(fd, store, timers, seconds):
+    wakeups = 0
+    end = time.monotonic() + seconds
+    last_stats = time.monotonic()
+    while True:
+        now = time.monotonic()
+        if now >= end:
+            return wakeups
+        wake_at = min(d for d in (timers.next_deadline(), last_stats + reader.STATS_INTERVAL, end)
+                      if d is not None)
+        select.select([fd], [], [], max(0.0, wake_at - now))
+        wakeups += 1
+        reader.sweep_absence(store, timers, time.monotonic())
+
+
+def measure(label, fn, seconds):
+    cpu0 = time.process_time()
+    wall0 = time.perf_counter()
+    wakeups = fn()
+    cpu = time.process_time() - cpu0
+    wall = time.perf_counter() - wall0
+    print(f"{label:28s} cpu={cpu * 1000:9.2f} ms  ({cpu / wall * 100:6.3f}% of one core)  wakeups={wakeups}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tags", type=int, default=10000)
+    ap.add_argument("--seconds", type=float, default=5.0)
+    args = ap.parse_args()
+
+    state, tags_meta = make_state(args.tags)
+    store = make_store(args.tags)
+    timers = AbsenceTimers()
+    r, w = os.pipe()
+
+    print(f"registered tags={args.tags}, idle for {args.seconds}s each")
+    measure("legacy (0.2s select + sweep)", lambda: legacy_idle(r, state, tags_meta, args.seconds), args.seconds)
+    measure("timer heap (sleep to deadline)", lambda: timer_idle(r, store, timers, args.seconds), args.seconds)
+
+    # スイープ1回のコスト
+    n = 200
+    t0 = time.perf_counter()
+    for _ in range(n):
+        legacy_sweep(state, tags_meta, time.time())
+    legacy_cost = (time.perf_counter() - t0) / n
+    t0 = time.perf_counter()
+    for _ in range(n):
+        reader.sweep_absence(store, timers, time.monotonic())
+    timer_cost = (time.perf_counter() - t0) / n
+    print(f"per-sweep cost: legacy={legacy_cost * 1e6:9.1f} us  timer heap={timer_cost * 1e6:9.2f} us")
+    os.close(r)
+    os.close(w)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+接続プールの効果を測るベンチマーク。
+
+/usage-event (POST) と /tags (GET) を複数スレッドから叩き、
+従来方式（毎回 connect/close, rollback journal）と
+プール方式（持続接続, WAL）の requests/sec を比較する。
+
+    python benchmarks/bench_db_pool.py --seconds 5 --threads 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+TMP_DIR = tempfile.mkdtemp(prefix="rfid_bench_")
+os.environ["RFID_DB_PATH"] = str(Path(TMP_DIR) / "bench.db")
+
+import server  # noqa: E402
+from db import ConnectionPool  # noqa: E402
+
+TAG = "E2180119A350066551F1460"
+
+
+def run(client_factory, method, path, payload, seconds, threads):
+    counts = [0] * threads
+    stop = time.perf_counter() + seconds
+
+    def worker(i):
+        client = client_factory()
+        n = 0
+        while time.perf_counter() < stop:
+            if method == "POST":
+                r = client.post(path, json=payload)
+            else:
+                r = client.get(path)
+            assert r.status_code == 200, r.status_code
+            n += 1
+        counts[i] = n
+
+    ts = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return sum(counts) / seconds
+
+
+def setup_db(path: Path, wal: bool):
+    for suffix in ("", "-wal", "-shm"):
+        p = Path(str(path) + suffix)
+        if p.exists():
+            p.unlink()
+    import sqlite3
+    conn = sqlite3.connect(str(path))
+    if not wal:
+        conn.execute("PRAGMA journal_mode=DELETE")
+    server._create_tables(conn)
+    for i in range(50):
+        conn.execute(
+            "INSERT INTO tags (tag_id, name, category, created_at) VALUES (?, ?, ?, ?)",
+            (f"E218{i:019d}", f"item{i}", "リップ", "2026-01-01 00:00:00"),
+        )
+    conn.commit()
+    conn.close()
+
+
+class LegacyPool(ConnectionPool):
+    """ベースライン: 毎回 sqlite3.connect し、PRAGMAも設定しない（旧実装相当）"""
+
+    def __init__(self, path):
+        super().__init__(path, persistent=False)
+
+    def _acquire(self):
+        import sqlite3
+        return sqlite3.connect(str(self.path))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seconds", type=float, default=3.0)
+    ap.add_argument("--threads", type=int, default=4)
+    args = ap.parse_args()
+
+    db_path = Path(os.environ["RFID_DB_PATH"])
+    payload = {"tag_id": TAG, "name": "bench", "category": "リップ", "event_type": "absent_start"}
+
+    results = {}
+    for label, wal, make_pool in (
+        ("before (connect/close, DELETE journal)", False, lambda: LegacyPool(db_path)),
+        ("after  (pool, WAL)", True, lambda: ConnectionPool(db_path)),
+    ):
+        setup_db(db_path, wal)
+        server.pool = make_pool()
+        server.app.testing = True
+        client_factory = server.app.test_client
+        results[label] = (
+            run(client_factory, "POST", "/usage-event", payload, args.seconds, args.threads),
+            run(client_factory, "GET", "/tags", None, args.seconds, args.threads),
+        )
+        server.pool.close_all()
+
+    print(f"threads={args.threads} seconds={args.seconds}")
+    print(f"{'mode':42s} {'/usage-event rps':>18s} {'/tags rps':>12s}")
+    for label, (ev, tg) in results.items():
+        print(f"{label:42s} {ev:18.1f} {tg:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
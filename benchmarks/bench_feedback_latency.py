@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+褒めメッセージの配信遅延ベンチマーク（POST /feedback → SSE購読者が受信するまで）。
+
+サーバをこのプロセス内で起動し、N本の /feedback/stream を張った状態で
+/feedback に M 回POSTして、各購読者の受信までの時間を集計する。
+比較として、旧方式（5秒ポーリング）の期待遅延も表示する。
+
+    python benchmarks/bench_feedback_latency.py --subscribers 50 --messages 20
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("RFID_DB_PATH", str(Path(tempfile.mkdtemp(prefix="rfid_bench_")) / "bench.db"))
+
+import requests  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+import server  # noqa: E402
+
+POLL_INTERVAL = 5.0
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+def subscriber(url, sent_at, latencies, ready, stop):
+    with requests.get(url, stream=True, timeout=(3, 30)) as r:
+        ready.release()
+        for line in r.iter_lines(decode_unicode=True):
+            if stop.is_set():
+                return
+            if not line or not line.startswith("data: "):
+                continue
+            received = time.perf_counter()
+            seq = json.loads(line[len("data: "):])["seq"]
+            if seq in sent_at:
+                latencies.append(received - sent_at[seq])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--subscribers", type=int, default=20)
+    ap.add_argument("--messages", type=int, default=20)
+    ap.add_argument("--gap", type=float, default=0.05, help="POST間隔（秒）")
+    args = ap.parse_args()
+
+    server.init_db()
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{httpd.server_port}"
+
+    sent_at = {}
+    latencies = []
+    ready = threading.Semaphore(0)
+    stop = threading.Event()
+    for _ in range(args.subscribers):
+        threading.Thread(
+            target=subscriber,
+            args=(f"{base}/feedback/stream", sent_at, latencies, ready, stop),
+            daemon=True,
+        ).start()
+    for _ in range(args.subscribers):
+        ready.acquire()
+    while server.feedback.subscribers < args.subscribers:
+        time.sleep(0.01)
+
+    session = requests.Session()
+    for i in range(args.messages):
+        seq = server.feedback.seq + 1
+        sent_at[seq] = time.perf_counter()
+        session.post(f"{base}/feedback", json={"message": f"bench {i}", "image": ""}, timeout=3)
+        time.sleep(args.gap)
+
+    deadline = time.time() + 5
+    expected = args.subscribers * args.messages
+    while len(latencies) < expected and time.time() < deadline:
+        time.sleep(0.05)
+    stop.set()
+
+    ms = [v * 1000 for v in latencies]
+    print(f"subscribers={args.subscribers} messages={args.messages} received={len(ms)}/{expected}")
+    if ms:
+        print(f"SSE    p50={percentile(ms, 50):8.2f} ms  p99={percentile(ms, 99):8.2f} ms  max={max(ms):8.2f} ms")
+    print(f"polling({POLL_INTERVAL:.0f}s) expected mean={POLL_INTERVAL / 2 * 1000:8.0f} ms  worst={POLL_INTERVAL * 1000:8.0f} ms")
+    if ms:
+        print(f"mean SSE latency: {statistics.mean(ms):.2f} ms")
+    httpd.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+HIDデコーダのスループットベンチマーク。
+
+合成したHIDレポート列（1文字ごとに押下+離しレポート、最後にEnter）をパイプに流し、
+- 旧方式: select 1回ごとに os.read(fd, 8) で1レポートだけ処理
+- 新方式: HidTagDecoder.drain() で読めるだけ読んで一括デコード
+のタグ/秒と、1タグあたりのループ回数を比べる。
+
+    python benchmarks/bench_hid_decoder.py --tags 20000
+"""
+import argparse
+import os
+import random
+import select
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from hid_decoder import KEY_ENTER, KEYMAP, HidTagDecoder  # noqa: E402
+
+CODE_OF = {ch: code for code, ch in KEYMAP.items()}
+
+
+def make_tag(rng):
+    prefix = rng.choice(("E218", "E280"))
+    length = rng.choice((22, 23))
+    return prefix + "".join(rng.choice("0123456789ABCDEF") for _ in range(length - len(prefix)))
+
+
+def encode(tags):
+    out = bytearray()
+    up = bytes(8)
+    for tag in tags:
+        for ch in tag:
+            out += bytes((0, 0, CODE_OF[ch], 0, 0, 0, 0, 0)) + up
+        out += bytes((0, 0, KEY_ENTER, 0, 0, 0, 0, 0)) + up
+    return bytes(out)
+
+
+def legacy_loop(fd, expected):
+    """旧 read_one_tag_from_fd 相当（1ループ1レポート）"""
+    buf = ""
+    tags = []
+    loops = 0
+    while len(tags) < expected:
+        loops += 1
+        rlist, _, _ = select.select([fd], [], [], 0.2)
+        if not rlist:
+            continue
+        try:
+            data = os.read(fd, 8)
+        except BlockingIOError:
+            continue
+        if not data or len(data) < 3:
+            continue
+        keycode = data[2]
+        if keycode in KEYMAP:
+            buf += KEYMAP[keycode].upper()
+        elif keycode == 0x28:
+            tags.append(buf.strip().upper())
+            buf = ""
+    return tags, loops
+
+
+def decoder_loop(fd, expected):
+    decoder = HidTagDecoder()
+    tags = []
+    loops = 0
+    while len(tags) < expected:
+        loops += 1
+        rlist, _, _ = select.select([fd], [], [], 0.2)
+        if not rlist:
+            continue
+        try:
+            tags.extend(decoder.drain(fd))
+        except OSError:
+            break       # 書き込み側が閉じた
+    return tags, loops
+
+
+def run(label, loop, stream, expected):
+    r, w = os.pipe()
+    os.set_blocking(r, False)
+
+    def writer():
+        view = memoryview(stream)
+        while len(view):
+            n = os.write(w, view[:65536])
+            view = view[n:]
+        os.close(w)
+
+    t0 = time.perf_counter()
+    th = threading.Thread(target=writer)
+    th.start()
+    tags, loops = loop(r, expected)
+    elapsed = time.perf_counter() - t0
+    th.join()
+    os.close(r)
+    print(f"{label:34s} {len(tags) / elapsed:12.0f} tags/s  {loops / len(tags):8.3f} loops/tag")
+    return tags
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tags", type=int, default=20000)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    tags = [make_tag(rng) for _ in range(args.tags)]
+    stream = encode(tags)
+    print(f"tags={len(tags)} reports={len(stream) // 8} bytes={len(stream)}")
+
+    # 旧方式は押下レポートだけを見る（離しレポートは読み捨て）
+    old = run("legacy (8 bytes per select)", legacy_loop, stream, len(tags))
+    new = run("HidTagDecoder.drain", decoder_loop, stream, len(tags))
+    assert old == tags, "legacy decode mismatch"
+    assert new == tags, "decoder mismatch"
+
+    # 同一データをメモリ上で直接デコード（I/Oを除いた上限）
+    decoder = HidTagDecoder(buffer_reports=4096)
+    t0 = time.perf_counter()
+    out = decoder.feed(stream)
+    elapsed = time.perf_counter() - t0
+    assert out == tags
+    print(f"{'HidTagDecoder.feed (no I/O)':34s} {len(out) / elapsed:12.0f} tags/s  {len(stream) / 8 / elapsed:12.0f} reports/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+登録タグの在席状態のメモリ使用量ベンチマーク。
+
+- 旧方式: tags_meta[tag_id] = {name, category} と state[tag_id] = 6キーの dict
+- 新方式: PresenceStore（添字 + 並列配列、名前・カテゴリは intern）
+をそれぞれ --tags 件作り、tracemalloc で確保量を比べる。
+あわせて、検出→離席の遷移1回あたりの時間も測る。
+
+    python benchmarks/bench_presence_memory.py --tags 50000
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from presence import PresenceStore  # noqa: E402
+
+CATEGORIES = ("リップ", "ファンデーション", "アイシャドウ", "チーク", "マスカラ")
+
+
+def rows(n):
+    # サーバのJSONから毎回新しい文字列として届くのを模す
+    for i in range(n):
+        yield f"E218{i:019d}", f"item{i}", "".join(CATEGORIES[i % len(CATEGORIES)])
+
+
+def build_legacy(n):
+    tags_meta = {}
+    state = {}
+    for tid, name, category in rows(n):
+        tags_meta[tid] = {"name": name, "category": category}
+        state[tid] = {"name": name, "category": category, "is_present": False,
+                      "last_seen": None, "absent_since": None, "session_logged": False}
+    # 一度は検出された状態（float が確保される）
+    now = time.monotonic()
+    for st in state.values():
+        st["last_seen"] = now + 0.0
+        st["absent_since"] = now + 1.0
+    return tags_meta, state
+
+
+def build_store(n):
+    store = PresenceStore()
+    now = time.monotonic()
+    for tid, name, category in rows(n):
+        idx = store.upsert(tid, name, category)
+        store.observe(idx, now)
+        store.mark_absent(idx, now + 1.0)
+    return store
+
+
+def measure(label, fn, n):
+    tracemalloc.start()
+    obj = fn(n)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:24s} {current / 2**20:8.2f} MiB  ({current / n:7.1f} B/tag, peak {peak / 2**20:.2f} MiB)")
+    return obj
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tags", type=int, default=50000)
+    ap.add_argument("--ops", type=int, default=200000)
+    args = ap.parse_args()
+
+    print(f"registered tags={args.tags}")
+    _, state = measure("legacy dicts", build_legacy, args.tags)
+    store = measure("PresenceStore", build_store, args.tags)
+
+    # 遷移のコスト（検出して在席 → 離席）
+    tids = list(state)
+    n = args.ops
+    t0 = time.perf_counter()
+    for i in range(n):
+        st = state[tids[i % len(tids)]]
+        st["is_present"] = True
+        st["absent_since"] = None
+        st["last_seen"] = float(i)
+        st["is_present"] = False
+        st["absent_since"] = float(i)
+    legacy = (time.perf_counter() - t0) / n
+    t0 = time.perf_counter()
+    for i in range(n):
+        idx = store.get(tids[i % len(tids)])
+        store.observe(idx, float(i))
+        store.mark_absent(idx, float(i))
+    slotted = (time.perf_counter() - t0) / n
+    print(f"transition cost: legacy={legacy * 1e9:7.0f} ns  PresenceStore={slotted * 1e9:7.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
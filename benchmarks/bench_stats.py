@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+/stats（ロールアップ）のベンチマーク。
+
+履歴の長さ（usage_event の行数）を変えた合成DBを作り、
+- 直近30日のタグ別集計: usage_event を直接集計 vs ロールアップから
+- 新しく入った1000行の足し込み（refresh）
+の所要時間を比べる。ロールアップ側は履歴が伸びても変わらないことを確認する。
+
+    python benchmarks/bench_stats.py --rows 100000 1000000
+"""
+import argparse
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import rollups  # noqa: E402
+from schema import migrate  # noqa: E402
+
+EVENT_TYPES = ("absent_start", "present_return", "lip_trigger")
+N_TAGS = 500
+DAY_MS = 86400 * 1000
+
+SQL_RAW_BY_TAG = """
+    SELECT e.tag_id, t.name, t.category,
+           SUM(e.event_type = 'present_return'),
+           SUM(CASE WHEN e.event_type = 'present_return' THEN e.duration_sec ELSE 0 END),
+           SUM(e.event_type = 'absent_start'),
+           SUM(e.event_type = 'lip_trigger')
+    FROM usage_event e LEFT JOIN tags t ON t.tag_id = e.tag_id
+    WHERE e.ts_ms >= ?
+    GROUP BY e.tag_id
+"""
+
+
+def insert_events(conn, rng, n, now_ms, span_days):
+    def events():
+        for _ in range(n):
+            et = EVENT_TYPES[rng.randrange(3)]
+            yield (f"E218{rng.randrange(N_TAGS):019X}", et, now_ms - rng.randrange(span_days * DAY_MS),
+                   rng.randrange(600) if et == "present_return" else None)
+    conn.executemany("INSERT INTO usage_event (tag_id, event_type, ts_ms, duration_sec) VALUES (?, ?, ?, ?)",
+                     events())
+    conn.commit()
+
+
+def timed(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    ap.add_argument("--days-per-100k", type=int, default=30, help="履歴の長さ（10万行あたりの日数）")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    tmp = Path(tempfile.mkdtemp(prefix="rfid_bench_"))
+    try:
+        print(f"{'history':>10s} {'days':>5s} {'raw 30d':>10s} {'rollup 30d':>11s} {'refresh 1k':>11s}")
+        for rows in args.rows:
+            rng = random.Random(args.seed)
+            span_days = max(30, rows * args.days_per_100k // 100_000)
+            conn = sqlite3.connect(tmp / f"stats_{rows}.db")
+            conn.execute("PRAGMA journal_mode=WAL")
+            migrate(conn)
+            conn.executemany("INSERT INTO tags VALUES (?, ?, 'リップ', '2025-01-01 00:00:00')",
+                             [(f"E218{i:019X}", f"item{i}") for i in range(N_TAGS)])
+            now_ms = int(time.time() * 1000)
+            insert_events(conn, rng, rows, now_ms, span_days)
+            rollups.refresh(conn)
+            conn.execute("ANALYZE")
+
+            since_ms = now_ms - 30 * DAY_MS
+            day_to = time.strftime("%Y-%m-%d")
+            day_from = time.strftime("%Y-%m-%d", time.localtime(since_ms / 1000))
+            raw = timed(lambda: conn.execute(SQL_RAW_BY_TAG, (since_ms,)).fetchall())
+            rolled = timed(lambda: rollups.stats_by_tag(conn, day_from, day_to))
+
+            def add_and_refresh():
+                insert_events(conn, rng, 1000, now_ms, 1)
+                rollups.refresh(conn)
+            refresh = timed(add_and_refresh)
+            print(f"{rows:10d} {span_days:5d} {raw * 1000:8.1f}ms {rolled * 1000:9.2f}ms {refresh * 1000:9.2f}ms")
+            conn.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
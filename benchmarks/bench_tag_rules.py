@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+tag_rules のマイクロベンチマーク。
+
+リーダーが実際に受け取る形の入力（登録済みタグの繰り返し）で
+従来の normalize + is_valid / 新しい normalize + is_valid / canonical_tag（LRU）を比べる。
+入口ごとに同じタグを受理するかどうかの性質テストは test_tag_rules.py（pytest）にある。
+
+    python benchmarks/bench_tag_rules.py --reads 200000
+"""
+import argparse
+import random
+import re
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import tag_rules  # noqa: E402
+
+# ---- 共通化する前のサーバの実装 ----
+LEGACY_PREFIXES = ("E218", "E280")
+LEGACY_LENGTHS = {22, 23}
+LEGACY_ALLOWED_RE = re.compile(r"^[0-9A-F]+$")
+
+
+def legacy_normalize(tag):
+    if tag is None:
+        return ""
+    t = tag.strip().upper()
+    t = "".join(ch for ch in t if ch.isalnum()).upper()
+    return t
+
+
+def legacy_is_valid(tag):
+    if not tag:
+        return False
+    if not tag.startswith(LEGACY_PREFIXES):
+        return False
+    if len(tag) not in LEGACY_LENGTHS:
+        return False
+    if not LEGACY_ALLOWED_RE.match(tag):
+        return False
+    return True
+
+
+HEX = "0123456789ABCDEF"
+
+
+def bench(number, seed):
+    rng = random.Random(seed)
+    # 登録済み 50 タグを繰り返し読む（リーダーの実際の入力に近い）
+    tags = [rng.choice(LEGACY_PREFIXES) + "".join(rng.choice(HEX) for _ in range(19)) for _ in range(50)]
+    reads = [rng.choice(tags) for _ in range(number)]
+
+    def legacy():
+        for raw in reads:
+            legacy_is_valid(legacy_normalize(raw))
+
+    def new():
+        normalize, valid = tag_rules.normalize_tag, tag_rules.is_valid_tag
+        for raw in reads:
+            valid(normalize(raw))
+
+    def memo():
+        canonical = tag_rules.canonical_tag
+        for raw in reads:
+            canonical(raw)
+
+    print(f"{'':32s} {'ns/tag':>8s}")
+    for label, fn in (("legacy normalize + is_valid", legacy), ("translate + fullmatch", new),
+                      ("canonical_tag (LRU)", memo)):
+        best = min(timeit.repeat(fn, number=1, repeat=5))
+        print(f"{label:32s} {best / number * 1e9:8.0f}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--reads", type=int, default=200000)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    bench(args.reads, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+usage_event の集計クエリのベンチマーク。
+
+旧スキーマ（TEXT timestamp, name/category を毎行に複製, 副インデックスなし）で
+--rows 件の合成DBを作り、schema.migrate() で v2 に移行したコピーと
+同じ意味のクエリ（タグ別・日別・カテゴリ別）の所要時間を比べる。
+移行そのものにかかった時間とファイルサイズも表示する。
+
+    python benchmarks/bench_usage_queries.py --rows 2000000
+"""
+import argparse
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from schema import migrate  # noqa: E402
+
+CATEGORIES = ("リップ", "パウダー", "アイシャドウ", "アイライン", "チーク",
+              "マスカラ", "ファンデーション", "下地", "コンシーラー", "ハイライト")
+EVENT_TYPES = ("absent_start", "present_return", "lip_trigger")
+DAYS = 365
+
+LEGACY_DDL = (
+    "CREATE TABLE tags (tag_id TEXT PRIMARY KEY, name TEXT NOT NULL, category TEXT NOT NULL, created_at TEXT NOT NULL)",
+    """CREATE TABLE usage_event (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, tag_id TEXT NOT NULL, name TEXT NOT NULL,
+        category TEXT NOT NULL, event_type TEXT NOT NULL, timestamp TEXT NOT NULL,
+        duration_sec INTEGER, event_key TEXT)""",
+    "CREATE UNIQUE INDEX idx_usage_event_key ON usage_event(event_key)",
+)
+
+
+def build_legacy(path, rows, n_tags, seed):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    for ddl in LEGACY_DDL:
+        conn.execute(ddl)
+    tags = [(f"E218{i:019X}", f"item{i}", CATEGORIES[i % len(CATEGORIES)]) for i in range(n_tags)]
+    conn.executemany("INSERT INTO tags VALUES (?, ?, ?, '2025-01-01 00:00:00')", tags)
+
+    start = datetime.now() - timedelta(days=DAYS)
+    span = DAYS * 86400
+
+    def events():
+        for _ in range(rows):
+            tid, name, category = tags[rng.randrange(n_tags)]
+            et = EVENT_TYPES[rng.randrange(3)]
+            ts = (start + timedelta(seconds=rng.randrange(span))).strftime("%Y-%m-%d %H:%M:%S")
+            yield tid, name, category, et, ts, rng.randrange(600) if et == "present_return" else None
+
+    conn.executemany(
+        "INSERT INTO usage_event (tag_id, name, category, event_type, timestamp, duration_sec) "
+        "VALUES (?, ?, ?, ?, ?, ?)", events())
+    conn.commit()
+    conn.close()
+    return tags
+
+
+def best_of(conn, sql, params, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=2_000_000)
+    ap.add_argument("--tags", type=int, default=2000)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    tmp = Path(tempfile.mkdtemp(prefix="rfid_bench_"))
+    legacy_path = tmp / "legacy.db"
+    new_path = tmp / "v2.db"
+    try:
+        t0 = time.perf_counter()
+        tags = build_legacy(legacy_path, args.rows, args.tags, args.seed)
+        print(f"built legacy db: rows={args.rows} tags={args.tags} ({time.perf_counter() - t0:.1f}s)")
+
+        shutil.copy(legacy_path, new_path)
+        conn = sqlite3.connect(new_path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        t0 = time.perf_counter()
+        migrate(conn)
+        conn.execute("VACUUM")
+        print(f"migrate to v2: {time.perf_counter() - t0:.1f}s  "
+              f"size {legacy_path.stat().st_size / 2**20:.0f} MiB -> {new_path.stat().st_size / 2**20:.0f} MiB")
+        conn.execute("ANALYZE")
+
+        legacy = sqlite3.connect(legacy_path)
+        tag = tags[0][0]
+        since = datetime.now() - timedelta(days=30)
+        since_text = since.strftime("%Y-%m-%d %H:%M:%S")
+        since_ms = int(since.timestamp() * 1000)
+
+        cases = (
+            ("events of one tag (30d)",
+             "SELECT event_type, COUNT(*) FROM usage_event WHERE tag_id = ? AND timestamp >= ? GROUP BY event_type",
+             (tag, since_text),
+             "SELECT event_type, COUNT(*) FROM usage_event WHERE tag_id = ? AND ts_ms >= ? GROUP BY event_type",
+             (tag, since_ms)),
+            ("lip_trigger per day (30d)",
+             "SELECT substr(timestamp, 1, 10) AS d, COUNT(*) FROM usage_event "
+             "WHERE event_type = 'lip_trigger' AND timestamp >= ? GROUP BY d",
+             (since_text,),
+             "SELECT date(ts_ms / 1000, 'unixepoch', 'localtime') AS d, COUNT(*) FROM usage_event "
+             "WHERE event_type = 'lip_trigger' AND ts_ms >= ? GROUP BY d",
+             (since_ms,)),
+            ("returns per category (30d)",
+             "SELECT category, COUNT(*) FROM usage_event "
+             "WHERE event_type = 'present_return' AND timestamp >= ? GROUP BY category",
+             (since_text,),
+             "SELECT t.category, COUNT(*) FROM usage_event e JOIN tags t ON t.tag_id = e.tag_id "
+             "WHERE e.event_type = 'present_return' AND e.ts_ms >= ? GROUP BY t.category",
+             (since_ms,)),
+        )
+        print(f"{'query':28s} {'legacy':>10s} {'v2':>10s} {'speedup':>8s}")
+        for label, old_sql, old_params, new_sql, new_params in cases:
+            old = best_of(legacy, old_sql, old_params, args.repeat)
+            new = best_of(conn, new_sql, new_params, args.repeat)
+            print(f"{label:28s} {old * 1000:8.1f}ms {new * 1000:8.1f}ms {old / new:7.1f}x")
+        legacy.close()
+        conn.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
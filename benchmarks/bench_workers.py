@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+ワーカープロセス数によるスループットの伸びのベンチマーク（wsgi.py の本番モード）。
+
+--workers ごとにサーバを起動し（一時DB）、クライアントプロセス × スレッドから
+keep-alive で次の混合負荷を --seconds 秒かける:
+    60% POST /usage-events/batch（10件）/ 25% GET /tags（ETag付き）/
+    10% GET /feedback / 5% POST /feedback
+req/s と p50/p99 をワーカー数ごとに表示する。各回の終わりに、新しい接続（別のワーカーに
+当たりうる）から /feedback と /tags を読み、直前の書き込みがどのワーカーからも
+同じように見えるかも確かめる。
+
+サーバは gunicorn（gthread, --preload）があればそれを、無ければ同じ構成の
+prefork（親で create_app → 待ち受けソケットを共有して fork、各ワーカーはスレッド）で起動する。
+コア数より多いワーカーでは伸びないので、結果は os.cpu_count() と合わせて見る。
+
+    python benchmarks/bench_workers.py --workers 1 2 4 --seconds 10
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+import requests  # noqa: E402
+
+N_TAGS = 200
+BATCH_EVENTS = 10
+THREADS_PER_WORKER = 8
+SERVER_START_TIMEOUT = 30
+MIX = (("batch", 0.60), ("tags", 0.25), ("get_feedback", 0.10), ("post_feedback", 0.05))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+def tag_id(i):
+    return f"E218{i:019X}"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# ======================
+# サーバ
+# ======================
+def serve_prefork(port, workers):
+    """gunicorn が無いときの代わり: 親で初期化してからソケットを共有して fork する"""
+    import logsetup
+    import server
+    from werkzeug.serving import make_server
+
+    logsetup.setup()
+    server.create_app()
+    sock = socket.create_server(("127.0.0.1", port), backlog=1024)
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            httpd = make_server("127.0.0.1", port, server.app, threaded=True, fd=sock.fileno())
+            httpd.serve_forever()
+            os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, stop)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+
+def start_server(kind, workers, port, db_path, log_path):
+    env = {**os.environ, "RFID_DB_PATH": str(db_path), "RFID_RETENTION_DAYS": "0"}
+    if kind == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "-w", str(workers), "-k", "gthread",
+               "--threads", str(THREADS_PER_WORKER), "--preload", "-b", f"127.0.0.1:{port}", "wsgi:app"]
+    else:
+        cmd = [sys.executable, __file__, "--serve-prefork", str(workers), "--port", str(port)]
+    log = open(log_path, "w")
+    proc = subprocess.Popen(cmd, cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while True:
+        try:
+            requests.get(f"{base}/feedback", timeout=1)
+            return proc, base
+        except requests.ConnectionError:
+            if time.monotonic() > deadline or proc.poll() is not None:
+                proc.kill()
+                sys.exit(f"server did not start (see {log_path})")
+            time.sleep(0.1)
+
+
+# ======================
+# クライアント
+# ======================
+def client_thread(base, seconds, seed, latencies, counts):
+    rng = random.Random(seed)
+    session = requests.Session()
+    etag = None
+    kinds = [k for k, _ in MIX]
+    weights = [w for _, w in MIX]
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        kind = rng.choices(kinds, weights)[0]
+        t0 = time.perf_counter()
+        try:
+            if kind == "batch":
+                events = [{
+                    "tag_id": tag_id(rng.randrange(N_TAGS)), "name": "x", "category": "リップ",
+                    "event_type": rng.choice(("absent_start", "present_return", "lip_trigger")),
+                    "ts_ms": int(time.time() * 1000), "duration_sec": rng.randrange(600),
+                    "event_key": uuid.uuid4().hex,
+                } for _ in range(BATCH_EVENTS)]
+                r = session.post(f"{base}/usage-events/batch", json={"events": events}, timeout=30)
+            elif kind == "tags":
+                r = session.get(f"{base}/tags", headers={"If-None-Match": etag} if etag else {}, timeout=30)
+                etag = r.headers.get("ETag", etag)
+            elif kind == "get_feedback":
+                r = session.get(f"{base}/feedback", timeout=30)
+            else:
+                r = session.post(f"{base}/feedback", json={"message": f"m{rng.random()}", "image": ""},
+                                 timeout=30)
+            ok = r.status_code < 500
+        except requests.RequestException:
+            ok = False
+        latencies[kind].append(time.perf_counter() - t0)
+        counts["ok" if ok else "error"] += 1
+
+
+def client_process(base, seconds, threads, seed, results):
+    latencies = defaultdict(list)
+    counts = defaultdict(int)
+    workers = [threading.Thread(target=client_thread, args=(base, seconds, seed * 100 + i, latencies, counts))
+               for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    results.put((dict(latencies), dict(counts)))
+
+
+def check_consistency(base, probes):
+    """書き込み直後に新しい接続から読み、全員が同じ結果を見るか（戻り値: 問題のリスト）"""
+    problems = []
+    message = f"consistency-{uuid.uuid4().hex[:8]}"
+    requests.post(f"{base}/feedback", json={"message": message, "image": ""}, timeout=10)
+    time.sleep(0.3)     # 他のワーカーのウォッチャー（0.1秒間隔）が追いつくまで
+    seen = {requests.get(f"{base}/feedback", timeout=10).json()["message"] for _ in range(probes)}
+    if seen != {message}:
+        problems.append(f"/feedback: expected {message!r}, got {sorted(seen)}")
+
+    new_tag = tag_id(N_TAGS + random.randrange(1 << 20))
+    requests.post(f"{base}/register", json={"tag_id": new_tag, "name": "probe", "category": "リップ"}, timeout=10)
+    etags = set()
+    missing = 0
+    for _ in range(probes):
+        r = requests.get(f"{base}/tags", timeout=10)
+        etags.add(r.headers.get("ETag"))
+        missing += new_tag not in {t["tag_id"] for t in r.json()}
+    if missing:
+        problems.append(f"/tags: new tag missing in {missing}/{probes} responses")
+    if len(etags) != 1:
+        problems.append(f"/tags: {len(etags)} different ETags")
+    return problems
+
+
+def run(kind, workers, args, tmp):
+    db_path = tmp / f"w{workers}.db"
+    port = free_port()
+    proc, base = start_server(kind, workers, port, db_path, tmp / f"w{workers}.log")
+    try:
+        session = requests.Session()
+        for i in range(N_TAGS):
+            session.post(f"{base}/register", json={"tag_id": tag_id(i), "name": f"item{i}", "category": "リップ"},
+                         timeout=10)
+
+        ctx = multiprocessing.get_context("fork")
+        results = ctx.Queue()
+        clients = [ctx.Process(target=client_process, args=(base, args.seconds, args.threads, args.seed + c, results))
+                   for c in range(args.clients)]
+        t0 = time.monotonic()
+        for p in clients:
+            p.start()
+        latencies = defaultdict(list)
+        counts = defaultdict(int)
+        for _ in clients:
+            lat, cnt = results.get()
+            for k, v in lat.items():
+                latencies[k].extend(v)
+            for k, v in cnt.items():
+                counts[k] += v
+        wall = time.monotonic() - t0
+        for p in clients:
+            p.join()
+        problems = check_consistency(base, probes=4 * workers)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    everything = [v for values in latencies.values() for v in values]
+    return {
+        "workers": workers,
+        "rps": counts["ok"] / wall,
+        "errors": counts["error"],
+        "p50_ms": percentile(everything, 50) * 1000,
+        "p99_ms": percentile(everything, 99) * 1000,
+        "p99_by_kind_ms": {k: percentile(v, 99) * 1000 for k, v in sorted(latencies.items())},
+        "problems": problems,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--clients", type=int, default=4, help="クライアントのプロセス数")
+    ap.add_argument("--threads", type=int, default=8, help="クライアント1プロセスあたりのスレッド数")
+    ap.add_argument("--server", choices=("auto", "gunicorn", "prefork"), default="auto")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", help="結果をJSONで保存するパス")
+    ap.add_argument("--serve-prefork", type=int, help=argparse.SUPPRESS)
+    ap.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.serve_prefork:
+        serve_prefork(args.port, args.serve_prefork)
+        return
+
+    kind = args.server
+    if kind == "auto":
+        kind = "gunicorn" if importlib.util.find_spec("gunicorn") else "prefork"
+    print(f"server={kind}, cpu_count={os.cpu_count()}, clients={args.clients}×{args.threads} threads, "
+          f"{args.seconds:.0f}s per run")
+
+    tmp = Path(tempfile.mkdtemp(prefix="rfid_bench_"))
+    rows = []
+    try:
+        print(f"{'workers':>7s} {'req/s':>8s} {'scale':>6s} {'p50 ms':>8s} {'p99 ms':>8s} "
+              f"{'batch p99':>10s} {'tags p99':>9s} {'errors':>7s}  consistency")
+        for workers in args.workers:
+            r = run(kind, workers, args, tmp)
+            rows.append(r)
+            scale = r["rps"] / rows[0]["rps"] if rows[0]["rps"] else 0
+            by_kind = r["p99_by_kind_ms"]
+            print(f"{workers:7d} {r['rps']:8.0f} {scale:5.2f}x {r['p50_ms']:8.1f} {r['p99_ms']:8.1f} "
+                  f"{by_kind.get('batch', 0):10.1f} {by_kind.get('tags', 0):9.1f} {r['errors']:7d}  "
+                  f"{'ok' if not r['problems'] else '; '.join(r['problems'])}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({"server": kind, "cpu_count": os.cpu_count(), "runs": rows}, indent=2))
+    sys.exit(1 if any(r["problems"] for r in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+"""
+エンドツーエンドの負荷試験（1台のLinuxでオフライン実行）。
+
+server.py を別プロセスで起動し（一時DB）、N台の仮想リーダーをそれぞれ別プロセスで動かす。
+仮想リーダーは client_input_server.run_loop（handle_detection / sweep_absence）・Uplink・TagSync を
+そのまま使い、HIDデバイスと時計だけを差し替える。
+- FakeReaderSource: 棚に置かれた化粧品のタグを read_interval ごとに読み、ときどき持ち出して
+  （平均 --mean-idle 秒ごと、平均 --mean-use 秒間）戻す。読み取りはキーボードのHIDレポートに
+  変換して HidTagDecoder に通す。一部は読み損じ（--miss）や文字落ち（--garble）にする
+- FakeClock: 仮想時間を --speed 倍で進める（離席判定・CSVのflushも仮想時間で動く）
+あわせてダッシュボード相当のクライアント（--dashboards）が /stats と /tags を叩く。
+
+報告する項目:
+- エンドポイントごとのリクエスト数・req/s・p50/p99（クライアント側で計測）
+- 受理された usage_event の件数と毎秒件数、Outbox に残った件数
+- DBの増分（本体 + WAL）と1イベントあたりのバイト数
+- リーダー1台あたりのCPU使用率と1検出あたりのCPU時間、サーバのCPU使用率
+
+    python benchmarks/loadgen.py --readers 8 --items 8 --duration 600 --speed 60
+    python benchmarks/loadgen.py --json result.json                 # 結果を保存
+    python benchmarks/loadgen.py --compare result.json --tolerance 0.2   # 20%以上悪化したら終了コード1
+"""
+import argparse
+import heapq
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import urlsplit
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+import requests  # noqa: E402
+
+CATEGORIES = ("リップ", "ファンデーション", "アイシャドウ", "チーク")
+DASHBOARD_INTERVAL = 1.0    # ダッシュボード1つあたりのリクエスト間隔（実時間・秒）
+MIN_STEP = 0.01             # poll(0) でも仮想時間をこれだけは進める（空回り防止）
+SERVER_START_TIMEOUT = 30
+MIN_COMPARE_SAMPLES = 20    # これより少ないエンドポイントの p99 は比較しない（ぶれが大きい）
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+def station_tag(station, item):
+    return f"E218{station:04X}{item:015X}"
+
+
+def record_latency(latencies):
+    """requests のレスポンスフック: (METHOD path) ごとに応答時間（秒）を貯める"""
+    def hook(r, *args, **kwargs):
+        latencies[f"{r.request.method} {urlsplit(r.url).path}"].append(r.elapsed.total_seconds())
+    return hook
+
+
+# ======================
+# サーバ（別プロセス）
+# ======================
+def serve(port):
+    import logsetup
+    import server
+    from werkzeug.serving import make_server
+
+    logsetup.setup()
+    server.init_db()
+    httpd = make_server("127.0.0.1", port, server.app, threaded=True)
+    httpd.serve_forever()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_cpu(pid):
+    """/proc/<pid>/stat の utime + stime（秒）"""
+    fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def db_size(db_path):
+    """WALを本体に書き戻してからのサイズ（本体 + WAL）"""
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return sum(p.stat().st_size for p in (db_path, Path(f"{db_path}-wal")) if p.exists())
+
+
+# ======================
+# 仮想リーダー
+# ======================
+class FakeClock:
+    """仮想時間。advance_to() は実時間で (差分 / speed) 秒待ってから進める（speed=0 なら待たない）"""
+
+    def __init__(self, speed):
+        self.speed = speed
+        self.now = 0.0
+        self._real_start = time.monotonic()
+
+    def __call__(self):
+        return self.now
+
+    def advance_to(self, t):
+        if t <= self.now:
+            return
+        self.now = t
+        if self.speed > 0:
+            delay = self._real_start + t / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+
+def hid_reports(tag):
+    """タグ文字列 + Enter をキー押下/離しのHIDレポート列に変換する"""
+    from hid_decoder import KEY_ENTER, KEYMAP
+
+    codes = {ch: code for code, ch in KEYMAP.items()}
+    out = bytearray()
+    for code in [codes[ch] for ch in tag] + [KEY_ENTER]:
+        out += bytes((0, 0, code, 0, 0, 0, 0, 0)) + bytes(8)
+    return bytes(out)
+
+
+class FakeReaderSource:
+    """
+    ReaderHub の代わり（poll(timeout) -> [(path, tag)]）。
+    タグごとの「次に読める時刻」をヒープで持ち、仮想時計を次の読み取りまで進める。
+    duration 秒（仮想）を過ぎたら stop をセットする。
+    """
+
+    PATH = "/dev/hidraw-fake"
+
+    def __init__(self, clock, stop, tags, rng, duration, read_interval, mean_idle, mean_use, miss, garble):
+        from hid_decoder import HidTagDecoder
+
+        self.clock = clock
+        self.stop = stop
+        self.rng = rng
+        self.duration = duration
+        self.read_interval = read_interval
+        self.mean_idle = mean_idle
+        self.mean_use = mean_use
+        self.miss = miss
+        self.garble = garble
+        self.decoder = HidTagDecoder()
+        self.reports = [hid_reports(tag) for tag in tags]
+        self.pickup_at = [rng.expovariate(1 / mean_idle) for _ in tags]
+        self.heap = [(rng.uniform(0, read_interval), i) for i in range(len(tags))]
+        heapq.heapify(self.heap)
+        self.reads = 0
+        self.pickups = 0
+
+    def _schedule(self, i, t):
+        nxt = t + self.read_interval * self.rng.uniform(0.8, 1.2)
+        if nxt >= self.pickup_at[i]:
+            # 持ち出し: 戻ってくるまで読めない
+            nxt = self.pickup_at[i] + self.rng.expovariate(1 / self.mean_use)
+            self.pickup_at[i] = nxt + self.rng.expovariate(1 / self.mean_idle)
+            self.pickups += 1
+        heapq.heappush(self.heap, (nxt, i))
+
+    def poll(self, timeout):
+        deadline = min(self.clock() + max(timeout, MIN_STEP), self.duration)
+        if self.heap[0][0] > deadline:
+            self.clock.advance_to(deadline)
+            if deadline >= self.duration:
+                self.stop.set()
+            return []
+
+        t = max(self.clock(), self.heap[0][0])
+        self.clock.advance_to(t)
+        data = bytearray()
+        while self.heap and self.heap[0][0] <= t:
+            _, i = heapq.heappop(self.heap)
+            self._schedule(i, t)
+            r = self.rng.random()
+            if r < self.miss:
+                continue
+            report = self.reports[i]
+            if r < self.miss + self.garble:
+                cut = 16 * self.rng.randrange(len(report) // 16 - 1)
+                report = report[:cut] + report[cut + 16:]
+            data += report
+            self.reads += 1
+        return [(self.PATH, tag) for tag in self.decoder.feed(data)]
+
+
+def run_reader(station, args, base, work_dir, results):
+    """仮想リーダー1台（子プロセス）。結果は results キューに dict で返す"""
+    work_dir = Path(work_dir)
+    sys.stdout = open(work_dir / "reader.log", "w", buffering=1)
+
+    import client_input_server as reader
+    import logsetup
+    from csv_sink import CsvSink
+    from presence import AbsenceTimers, PresenceStore
+    from uplink import TagSync, Uplink
+
+    logsetup.setup(stream=sys.stdout)
+    rng = random.Random(args.seed * 1000 + station)
+    clock = FakeClock(args.speed)
+    stop = threading.Event()
+    tags = [station_tag(station, i) for i in range(args.items)]
+
+    # CSV は作業ディレクトリへ、flush は仮想時間で
+    reader.csv_detected = CsvSink(work_dir / "detect.csv", ["timestamp", "tag_id", "name", "category"], clock=clock)
+    reader.csv_used = CsvSink(work_dir / "used.csv", ["timestamp", "name", "category"], clock=clock)
+    reader.csv_used_all = CsvSink(work_dir / "durations.csv", ["timestamp", "name", "duration(sec)"], clock=clock)
+    reader.CSV_SINKS = (reader.csv_detected, reader.csv_used, reader.csv_used_all)
+    reader.ENABLE_CSV = not args.no_csv
+    reader.SERVER = base
+    reader.ensure_csv_headers()
+
+    latencies = defaultdict(list)
+    hook = record_latency(latencies)
+    reader.uplink = Uplink(base, work_dir / "outbox.db").start()
+    tag_sync = TagSync(base, reader.CHECK_INTERVAL)
+    reader.uplink._session.hooks["response"].append(hook)
+    tag_sync._session.hooks["response"].append(hook)
+    tag_sync.start()
+
+    store = PresenceStore()
+    timers = AbsenceTimers()
+    full, changes = tag_sync.results.get(timeout=SERVER_START_TIMEOUT)
+    reader.apply_tag_changes(store, timers, full, changes)
+
+    source = FakeReaderSource(clock, stop, tags, rng, args.duration, args.read_interval,
+                              args.mean_idle, args.mean_use, args.miss, args.garble)
+    t0 = time.monotonic()
+    usage0 = resource.getrusage(resource.RUSAGE_SELF)
+    reader.run_loop(source, store, timers, tag_sync, clock=clock, stop=stop)
+    loop_wall = time.monotonic() - t0
+    usage1 = resource.getrusage(resource.RUSAGE_SELF)
+
+    tag_sync.stop()
+    reader.close_csv()
+    reader.uplink.stop(timeout=60)
+    stats = reader.uplink.stats()
+    results.put({
+        "station": station,
+        "wall": loop_wall,
+        "cpu": (usage1.ru_utime - usage0.ru_utime) + (usage1.ru_stime - usage0.ru_stime),
+        "reads": source.reads,
+        "pickups": source.pickups,
+        "uplink": stats,
+        "latencies": dict(latencies),
+    })
+
+
+# ======================
+# ダッシュボード（このプロセスのスレッド）
+# ======================
+def dashboard(base, latencies, stop, seed):
+    rng = random.Random(seed)
+    session = requests.Session()
+    session.hooks["response"].append(record_latency(latencies))
+    etag = None
+    while not stop.wait(DASHBOARD_INTERVAL * rng.uniform(0.5, 1.5)):
+        day = time.strftime("%Y-%m-%d")
+        try:
+            session.get(f"{base}/stats/tags", timeout=10)
+            session.get(f"{base}/stats/daily", params={"category": rng.choice(CATEGORIES)}, timeout=10)
+            session.get(f"{base}/stats/hourly", params={"day": day}, timeout=10)
+            r = session.get(f"{base}/tags", headers={"If-None-Match": etag} if etag else {}, timeout=10)
+            etag = r.headers.get("ETag", etag)
+        except requests.RequestException as e:
+            print(f"⚠ dashboard: {e}")
+
+
+# ======================
+# 集計と比較
+# ======================
+def summarize(args, readers, dash_latencies, wall, db_before, db_after, events, server_cpu):
+    latencies = defaultdict(list)
+    for res in readers:
+        for key, values in res["latencies"].items():
+            latencies[key].extend(values)
+    for key, values in dash_latencies.items():
+        latencies[key].extend(values)
+
+    endpoints = {
+        key: {"requests": len(v), "rps": len(v) / wall,
+              "p50_ms": percentile(v, 50) * 1000, "p99_ms": percentile(v, 99) * 1000,
+              "max_ms": max(v) * 1000}
+        for key, v in sorted(latencies.items()) if v
+    }
+    cpu = [res["cpu"] / res["wall"] for res in readers]
+    reads = sum(res["reads"] for res in readers)
+    return {
+        "config": {k: getattr(args, k) for k in ("readers", "items", "duration", "speed", "read_interval",
+                                                  "mean_idle", "mean_use", "dashboards", "seed")},
+        "wall_sec": wall,
+        "endpoints": endpoints,
+        "events": {
+            "accepted": events,
+            "per_sec": events / wall,
+            "sent": sum(res["uplink"]["sent_events"] for res in readers),
+            "duplicate": sum(res["uplink"]["duplicate_events"] for res in readers),
+            "rejected": sum(res["uplink"]["rejected_events"] for res in readers),
+            "outbox_left": sum(res["uplink"]["outbox"] for res in readers),
+            "pickups": sum(res["pickups"] for res in readers),
+        },
+        "db": {"before": db_before, "after": db_after, "growth": db_after - db_before,
+               "bytes_per_event": (db_after - db_before) / events if events else None},
+        "reader_cpu": {"mean_pct": 100 * sum(cpu) / len(cpu), "max_pct": 100 * max(cpu),
+                       "reads": reads,
+                       "us_per_read": 1e6 * sum(res["cpu"] for res in readers) / reads if reads else None},
+        "server_cpu_pct": 100 * server_cpu / wall,
+    }
+
+
+def print_report(r):
+    c = r["config"]
+    print(f"\nreaders={c['readers']} × items={c['items']}  virtual {c['duration']}s at ×{c['speed']}"
+          f"  (wall {r['wall_sec']:.1f}s)")
+    print(f"{'endpoint':32s} {'n':>7s} {'req/s':>8s} {'p50 ms':>8s} {'p99 ms':>8s} {'max ms':>8s}")
+    for key, e in r["endpoints"].items():
+        print(f"{key:32s} {e['requests']:7d} {e['rps']:8.1f} {e['p50_ms']:8.1f} {e['p99_ms']:8.1f} {e['max_ms']:8.1f}")
+    ev = r["events"]
+    print(f"\nusage_event: accepted {ev['accepted']} ({ev['per_sec']:.1f}/s), sent {ev['sent']}, "
+          f"duplicate {ev['duplicate']}, rejected {ev['rejected']}, left in outbox {ev['outbox_left']}"
+          f"  [pickups {ev['pickups']}]")
+    db = r["db"]
+    per_event = f", {db['bytes_per_event']:.0f} B/event" if db["bytes_per_event"] else ""
+    print(f"DB: {db['before'] / 1024:.0f} KiB -> {db['after'] / 1024:.0f} KiB "
+          f"(+{db['growth'] / 1024:.0f} KiB{per_event})")
+    cpu = r["reader_cpu"]
+    per_read = f", {cpu['us_per_read']:.1f} µs/read" if cpu["us_per_read"] else ""
+    print(f"reader CPU: mean {cpu['mean_pct']:.1f}%, max {cpu['max_pct']:.1f}% "
+          f"({cpu['reads']} reads{per_read})")
+    print(f"server CPU: {r['server_cpu_pct']:.1f}%")
+
+
+def compare(current, baseline, tolerance):
+    """baseline より tolerance 以上悪化した項目のリスト"""
+    worse = []
+    for key, e in current["endpoints"].items():
+        b = baseline["endpoints"].get(key)
+        if not b or min(e["requests"], b["requests"]) < MIN_COMPARE_SAMPLES:
+            continue
+        if e["p99_ms"] > b["p99_ms"] * (1 + tolerance):
+            worse.append(f"{key} p99 {b['p99_ms']:.1f} -> {e['p99_ms']:.1f} ms")
+    if current["events"]["per_sec"] < baseline["events"]["per_sec"] * (1 - tolerance):
+        worse.append(f"events/s {baseline['events']['per_sec']:.1f} -> {current['events']['per_sec']:.1f}")
+    b_cpu, cpu = baseline["reader_cpu"]["us_per_read"], current["reader_cpu"]["us_per_read"]
+    if b_cpu and cpu and cpu > b_cpu * (1 + tolerance):
+        worse.append(f"reader µs/read {b_cpu:.1f} -> {cpu:.1f}")
+    b_db, db = baseline["db"]["bytes_per_event"], current["db"]["bytes_per_event"]
+    if b_db and db and db > b_db * (1 + tolerance):
+        worse.append(f"DB B/event {b_db:.0f} -> {db:.0f}")
+    if current["events"]["outbox_left"] or current["events"]["rejected"]:
+        worse.append(f"undelivered events: outbox {current['events']['outbox_left']}, "
+                     f"rejected {current['events']['rejected']}")
+    return worse
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--readers", type=int, default=8, help="仮想リーダー（ステーション）の数")
+    ap.add_argument("--items", type=int, default=8, help="1台あたりのタグ数")
+    ap.add_argument("--duration", type=float, default=600, help="仮想時間（秒）")
+    ap.add_argument("--speed", type=float, default=60, help="仮想時間の倍速（0なら待たずに最速）")
+    ap.add_argument("--read-interval", type=float, default=0.5, help="置かれているタグを読む間隔（仮想秒）")
+    ap.add_argument("--mean-idle", type=float, default=120, help="置かれている時間の平均（仮想秒）")
+    ap.add_argument("--mean-use", type=float, default=60, help="持ち出している時間の平均（仮想秒）")
+    ap.add_argument("--miss", type=float, default=0.05, help="読み損じの割合")
+    ap.add_argument("--garble", type=float, default=0.01, help="文字落ちの割合")
+    ap.add_argument("--dashboards", type=int, default=2, help="/stats を見るクライアントの数")
+    ap.add_argument("--no-csv", action="store_true", help="リーダーのCSV出力を止める")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", help="結果をJSONで保存するパス")
+    ap.add_argument("--compare", help="比較する過去の結果（--json の出力）")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="--compare で悪化とみなす割合")
+    ap.add_argument("--keep", action="store_true", help="一時ディレクトリ（DB・ログ）を残す")
+    ap.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    tmp = Path(tempfile.mkdtemp(prefix="rfid_loadgen_"))
+    db_path = tmp / "server.db"
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    server_log = open(tmp / "server.log", "w")
+    server_proc = subprocess.Popen(
+        [sys.executable, __file__, "--serve", str(port)],
+        env={**os.environ, "RFID_DB_PATH": str(db_path)},
+        stdout=server_log, stderr=subprocess.STDOUT,
+    )
+    try:
+        session = requests.Session()
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while True:
+            try:
+                session.get(f"{base}/tags", timeout=1)
+                break
+            except requests.ConnectionError:
+                if time.monotonic() > deadline or server_proc.poll() is not None:
+                    sys.exit(f"server did not start (see {tmp / 'server.log'})")
+                time.sleep(0.1)
+
+        for station in range(args.readers):
+            for i in range(args.items):
+                r = session.post(f"{base}/register", timeout=10, json={
+                    "tag_id": station_tag(station, i),
+                    "name": f"s{station}-item{i}",
+                    "category": CATEGORIES[i % len(CATEGORIES)],
+                })
+                r.raise_for_status()
+        print(f"server {base} (pid {server_proc.pid}), {args.readers * args.items} tags registered, work dir {tmp}")
+
+        db_before = db_size(db_path)
+        cpu_before = process_cpu(server_proc.pid)
+        ctx = multiprocessing.get_context("fork")
+        results = ctx.Queue()
+        procs = []
+        for station in range(args.readers):
+            work_dir = tmp / f"reader{station}"
+            work_dir.mkdir()
+            p = ctx.Process(target=run_reader, args=(station, args, base, str(work_dir), results))
+            p.start()
+            procs.append(p)
+
+        dash_latencies = defaultdict(list)
+        stop = threading.Event()
+        dashboards = [threading.Thread(target=dashboard, args=(base, dash_latencies, stop, args.seed + i),
+                                       daemon=True) for i in range(args.dashboards)]
+        t0 = time.monotonic()
+        for t in dashboards:
+            t.start()
+
+        readers = []
+        for _ in procs:
+            readers.append(results.get())
+        wall = time.monotonic() - t0
+        stop.set()
+        for t in dashboards:
+            t.join()
+        for p in procs:
+            p.join()
+
+        server_cpu = process_cpu(server_proc.pid) - cpu_before
+    finally:
+        server_proc.terminate()
+        server_proc.wait()
+        server_log.close()
+
+    db_after = db_size(db_path)
+    with sqlite3.connect(db_path) as conn:
+        accepted = conn.execute("SELECT COUNT(*) FROM usage_event").fetchone()[0]
+
+    report = summarize(args, readers, dash_latencies, wall, db_before, db_after, accepted, server_cpu)
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2))
+    if not args.keep:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if args.compare:
+        worse = compare(report, json.loads(Path(args.compare).read_text()), args.tolerance)
+        for line in worse:
+            print(f"REGRESSION: {line}")
+        sys.exit(1 if worse else 0)
+
+
+if __name__ == "__main__":
+    main()
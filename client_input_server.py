@@ -1,12 +1,21 @@
 #!/usr/bin/env python3
+import logging
 import os
-import csv
+import queue
+import signal
 import time
-import requests
-import select
 from datetime import datetime
 from pathlib import Path
 
+from csv_sink import CsvSink
+from hid_devices import ReaderHub, parse_vid_pid
+import logsetup
+import metrics
+from presence import AbsenceTimers, PresenceStore
+# タグ仕様（E218/E280両対応）はサーバと共通
+from tag_rules import canonical_tag, normalize_tag
+from uplink import TagSync, Uplink
+
 # ======================
 # パス（固定）
 # ======================
@@ -17,160 +26,125 @@ DATA_DIR.mkdir(parents=True, exist_ok=True)
 CSV_DETECTED = DATA_DIR / "rfid_detect_log.csv"
 CSV_USED     = DATA_DIR / "cosmetics_session_summary.csv"
 CSV_USED_ALL = DATA_DIR / "cosmetics_usage_durations.csv"
+OUTBOX_DB    = DATA_DIR / "outbox.db"
+TAG_SNAPSHOT = DATA_DIR / "tags_snapshot.json"     # 最後に取れた台帳（起動直後はこれで照合する）
 
 # ======================
 # サーバ
 # ======================
 SERVER = "http://localhost:8000"
 
+CHECK_INTERVAL = 5          # /tags再取得
+ABSENCE_THRESHOLD = 10      # 未検出で離席扱い（離席判定はタグごとの期限で行う）
+LIP_CATEGORIES = ("リップ",)  # 離席時に lip_trigger と褒めメッセージを出すカテゴリ
+STATS_INTERVAL = 60         # 送信キューの状況を表示する間隔（秒）
+
 # ======================
-# タグ仕様（E218/E280両対応）
+# リーダー（hidraw）
 # ======================
-TAG_PREFIXES = ("E218", "E280")
-VALID_TAG_LENGTHS = {22, 23}
-
-CHECK_INTERVAL = 5          # /tags再取得
-ABSENCE_THRESHOLD = 10      # 未検出で離席扱い
-SWEEP_INTERVAL = 1.0        # 入力が来なくても1秒ごとに離席判定
+MULTI_READER = os.environ.get("RFID_MULTI_READER", "0") == "1"  # 見つかったリーダーをすべて使う
+HID_FILTER = os.environ.get("RFID_HID_FILTER", "")              # "VID:PID"（例 "1A86:DD01"）で絞り込み
 
 ENABLE_CSV = True
+CSV_DETECT_PER_PRESENCE = os.environ.get("RFID_DETECT_PER_PRESENCE", "0") == "1"  # 1なら検出ログは在席区間ごとに1行（既定は検出のたびに1行）
+DETECT_LOG_KEEP_DAYS = int(os.environ.get("RFID_LOG_KEEP_DAYS", "90"))  # 検出ログのローテーション済みを残す日数（0なら無期限）
 
-def normalize_tag(tag: str) -> str:
-    if tag is None:
-        return ""
-    t = tag.strip().upper()
-    t = "".join(ch for ch in t if ch.isalnum()).upper()
-    return t
-
-def is_valid_tag(tag: str) -> bool:
-    if not tag:
-        return False
-    if not tag.startswith(TAG_PREFIXES):
-        return False
-    if len(tag) not in VALID_TAG_LENGTHS:
-        return False
-    return True
+# ======================
+# メトリクス・ログ
+# ======================
+# http://<リーダー>:RFID_METRICS_PORT/metrics（Prometheus形式）。0なら公開しない
+METRICS_PORT = int(os.environ.get("RFID_METRICS_PORT", "9101"))
+
+log = logging.getLogger("rfid.reader")
+
+DETECTIONS = metrics.Counter("rfid_reader_detections_total", "tags handed to handle_detection", ["result"])
+PRESENCE = metrics.Counter("rfid_reader_presence_total", "presence transitions", ["event"])
+SWEEP_SECONDS = metrics.Histogram("rfid_reader_sweep_seconds", "sweep_absence duration",
+                                  buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                                           0.001, 0.0025, 0.01, 0.05))
+REGISTERED_TAGS = metrics.Gauge("rfid_reader_registered_tags", "tags known to the reader")
+# ホットパス用に子を取っておく
+_DETECT_OK = DETECTIONS.labels("ok")
+_DETECT_INVALID = DETECTIONS.labels("invalid")
+_DETECT_UNREGISTERED = DETECTIONS.labels("unregistered")
+_ABSENT = PRESENCE.labels("absent")
+_RETURN = PRESENCE.labels("return")
 
 # ======================
 # CSV
 # ======================
+# 開きっぱなしでバッファし、FLUSH_INTERVAL秒/FLUSH_ROWS行ごとにまとめて書き出す
+# 日付が変わったら rfid_detect_log-YYYYMMDD.csv.gz のようにローテーション
+# 検出ログのローテーション済みファイルは DETECT_LOG_KEEP_DAYS 日で消す
+csv_detected = CsvSink(CSV_DETECTED, ["timestamp", "tag_id", "name", "category"],
+                       keep_days=DETECT_LOG_KEEP_DAYS)
+csv_used = CsvSink(CSV_USED, ["timestamp", "name", "category"])
+csv_used_all = CsvSink(CSV_USED_ALL, ["timestamp", "name", "duration(sec)"])
+CSV_SINKS = (csv_detected, csv_used, csv_used_all)
+
 def ensure_csv_headers():
     if not ENABLE_CSV:
         return
+    for sink in CSV_SINKS:
+        sink.open()
+
+def flush_csv_if_due():
+    if not ENABLE_CSV:
+        return
+    for sink in CSV_SINKS:
+        sink.flush_if_due()
 
-    def touch(path: Path, header):
-        new = not path.exists()
-        with open(path, "a", encoding="utf-8", newline="") as f:
-            w = csv.writer(f)
-            if new:
-                w.writerow(header)
+def csv_next_due():
+    dues = [d for d in (sink.next_due() for sink in CSV_SINKS) if d is not None]
+    return min(dues) if dues else None
 
-    touch(CSV_DETECTED, ["timestamp", "tag_id", "name", "category"])
-    touch(CSV_USED, ["timestamp", "name", "category"])
-    touch(CSV_USED_ALL, ["timestamp", "name", "duration(sec)"])
+def close_csv():
+    for sink in CSV_SINKS:
+        try:
+            sink.close()
+        except Exception as e:
+            log.warning("⚠ CSVクローズ失敗: %s (%s)", sink.path, e)
 
 def log_csv_detect(tag, name, category):
     if not ENABLE_CSV:
         return
-    with open(CSV_DETECTED, "a", encoding="utf-8", newline="") as f:
-        csv.writer(f).writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), tag, name, category])
+    csv_detected.write([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), tag, name, category])
 
 def log_csv_used_once(name, category):
     if not ENABLE_CSV:
         return
-    with open(CSV_USED, "a", encoding="utf-8", newline="") as f:
-        csv.writer(f).writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), name, category])
+    csv_used.write([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), name, category])
 
 def log_csv_duration(name, duration):
     if not ENABLE_CSV:
         return
-    with open(CSV_USED_ALL, "a", encoding="utf-8", newline="") as f:
-        csv.writer(f).writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), name, int(duration)])
-
-# ======================
-# HID探索
-# ======================
-def find_hid_device():
-    print("\n🔍 RFIDリーダー接続待ち…")
-    while True:
-        for name in os.listdir("/dev"):
-            if not name.startswith("hidraw"):
-                continue
-            dev = f"/dev/{name}"
-            try:
-                with open(dev, "rb"):
-                    print(f"✅ RFID リーダー検出: {dev}")
-                    return dev
-            except Exception:
-                continue
-        time.sleep(1)
+    csv_used_all.write([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), name, int(duration)])
 
 # ======================
-# 8byte HIDキーボード読み取り
+# サーバ通信
 # ======================
-KEYMAP = {
-    0x1E: "1", 0x1F: "2", 0x20: "3", 0x21: "4",
-    0x22: "5", 0x23: "6", 0x24: "7", 0x25: "8",
-    0x26: "9", 0x27: "0",
-    0x04: "a", 0x05: "b", 0x06: "c", 0x07: "d",
-    0x08: "e", 0x09: "f", 0x0A: "g", 0x0B: "h",
-    0x0C: "i", 0x0D: "j", 0x0E: "k", 0x0F: "l",
-    0x10: "m", 0x11: "n", 0x12: "o", 0x13: "p",
-    0x14: "q", 0x15: "r", 0x16: "s", 0x17: "t",
-    0x18: "u", 0x19: "v", 0x1A: "w", 0x1B: "x",
-    0x1C: "y", 0x1D: "z",
-}
-
-def open_hid_nonblocking(hid_path: str):
-    # ノンブロッキングで開く（入力が来なくてもSWEEPを回すため）
-    fd = os.open(hid_path, os.O_RDONLY | os.O_NONBLOCK)
-    return fd
-
-def read_one_tag_from_fd(fd: int):
+def apply_tag_changes(store, timers, full, changes):
     """
-    fdから読める分だけ読む（ノンブロッキング）。
-    Enter(0x28)が来たら1タグ確定して返す。
-    何も確定しなければNone。
+    差分を store にその場で反映する。
+    full=Trueのときは一覧に無いタグを削除扱いにする。
     """
-    buf = getattr(read_one_tag_from_fd, "_buf", "")
-    try:
-        data = os.read(fd, 8)
-        # 読めない/データなし
-        if not data or len(data) < 3:
-            setattr(read_one_tag_from_fd, "_buf", buf)
-            return None
-
-        keycode = data[2]
-        if keycode in KEYMAP:
-            buf += KEYMAP[keycode].upper()
-        elif keycode == 0x28:  # Enter
-            tag = buf.strip().upper()
-            buf = ""
-            setattr(read_one_tag_from_fd, "_buf", buf)
-            return tag
-
-        setattr(read_one_tag_from_fd, "_buf", buf)
-        return None
-
-    except BlockingIOError:
-        setattr(read_one_tag_from_fd, "_buf", buf)
-        return None
-    except OSError:
-        # 切断など
-        return "___HID_DISCONNECTED___"
+    if full:
+        keep = {normalize_tag(ch["tag_id"]) for ch in changes}
+        for tid in [t for t in store.tag_set() if t not in keep]:
+            timers.discard(store.remove(tid))
+
+    for ch in changes:
+        tid = normalize_tag(ch["tag_id"])
+        if ch["op"] == "delete":
+            idx = store.remove(tid)
+            if idx is not None:
+                timers.discard(idx)
+            continue
+        store.upsert(tid, ch["name"], ch.get("category") or "")
 
-# ======================
-# サーバ通信
-# ======================
-def fetch_tags():
-    try:
-        r = requests.get(f"{SERVER}/tags", timeout=3)
-        if r.status_code == 200:
-            data = r.json()
-            return {normalize_tag(t["tag_id"]): {"name": t["name"], "category": t.get("category", "")} for t in data}
-    except Exception as e:
-        print(f"⚠ /tags取得エラー: {e}")
-    return {}
+# 送信はすべてバックグラウンドスレッド（HIDループはネットワークで止まらない）
+# main() で Outbox を開いてから作る
+uplink = None
 
 def post_usage_event(tag_id, name, category, event_type, duration_sec=None):
     payload = {
@@ -178,153 +152,196 @@ def post_usage_event(tag_id, name, category, event_type, duration_sec=None):
         "name": name,
         "category": category,
         "event_type": event_type,
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
     }
     if duration_sec is not None:
         payload["duration_sec"] = int(duration_sec)
-    try:
-        requests.post(f"{SERVER}/usage-event", json=payload, timeout=3)
-    except Exception as e:
-        print(f"⚠ /usage-event 送信失敗: {e}")
+    uplink.submit_usage(payload)
 
 def send_feedback(msg, img=None):
-    try:
-        requests.post(f"{SERVER}/feedback", json={"message": msg, "image": img}, timeout=3)
-        print(f"💬 褒め送信: {msg}")
-    except Exception as e:
-        print(f"⚠ フィードバック送信失敗: {e}")
+    uplink.submit_feedback(msg, img)
 
 # ======================
-# 離席判定（入力がなくても回せるよう関数化）
+# 判定結果の出力先
 # ======================
-def sweep_absence(state, tags_meta, now):
-    for tid, st in state.items():
-        if tid not in tags_meta:
-            continue
-        if st["last_seen"] is None:
-            continue
+class ReaderOutput:
+    """
+    handle_detection / sweep_absence の判定結果を受け取る（ログ・CSV・サーバ送信）。
+    replay.py は同じ判定を過去のログで回し、これを記録用の出力に差し替える。
+    """
 
-        if st["is_present"] and (now - st["last_seen"] > ABSENCE_THRESHOLD):
-            st["is_present"] = False
-            st["absent_since"] = now
-            print(f"🚫 離席: {st['name']} / {st['category']}")
+    def detected(self, tag, name, category):
+        log.info("🎯 検出: %s / %s (%s)", name, category, tag)
+        log_csv_detect(tag, name, category)
 
-            post_usage_event(tid, st["name"], st["category"], "absent_start")
+    def returned(self, tag, name, category, duration, first_session):
+        log_csv_duration(name, duration)
+        if first_session:
+            log_csv_used_once(name, category)
+        post_usage_event(tag, name, category, "present_return", duration_sec=duration)
 
-            # リップ判定（表記揺れ対策）
-            if st["category"].strip() == "リップ":
-                post_usage_event(tid, st["name"], st["category"], "lip_trigger")
-                send_feedback(
-                    "今日も化粧してえらい！！",
-                    f"{SERVER}/static/imgs/ikemenn.png"
-                )
+    def absent(self, tag, name, category):
+        log.info("🚫 離席: %s / %s", name, category, extra={"tag_id": tag})
+        post_usage_event(tag, name, category, "absent_start")
+
+    def lip(self, tag, name, category):
+        post_usage_event(tag, name, category, "lip_trigger")
+        send_feedback(
+            "今日も化粧してえらい！！",
+            f"{SERVER}/static/imgs/ikemenn.png"
+        )
+
+live_output = ReaderOutput()
+
+def is_lip(category, categories=LIP_CATEGORIES):
+    # 表記揺れ対策で前後の空白は無視する
+    return category.strip() in categories
+
+# ======================
+# 離席判定（在席中のタグの期限だけを見る）
+# ======================
+def sweep_absence(store, timers, now, out=live_output, lip_categories=LIP_CATEGORIES):
+    """
+    期限（最後の検出 + ABSENCE_THRESHOLD）を過ぎたタグを離席にする。
+    now は time.monotonic()。期限切れのタグだけを取り出すので、
+    登録タグ数が多くても在席していないタグには触れない。
+    """
+    for idx in timers.pop_expired(now):
+        if not store.mark_absent(idx, now):
+            continue    # 台帳から削除されたタグ
+
+        tid = store.tag_ids[idx]
+        name = store.names[idx]
+        category = store.categories[idx]
+        _ABSENT.inc()
+        out.absent(tid, name, category)
+
+        # リップ判定
+        if is_lip(category, lip_categories):
+            out.lip(tid, name, category)
 
 # ======================
 # main
 # ======================
 def main():
-    print("=== RFID Reader START ===")
-    print("CWD:", os.getcwd())
-    print("LOG DIR:", DATA_DIR)
+    log.info("=== RFID Reader START ===")
+    log.info("CWD: %s", os.getcwd())
+    log.info("LOG DIR: %s", DATA_DIR)
     ensure_csv_headers()
 
-    tags_meta = {}
-    last_meta_fetch = 0.0
-    last_sweep = 0.0
-
-    # state[tag_id] = {name, category, is_present, last_seen, absent_since, session_logged}
-    state = {}
-
-    hid_path = find_hid_device()
-    fd = open_hid_nonblocking(hid_path)
-    print("✅ HID opened (non-blocking)")
-
-    while True:
-        now = time.time()
-
-        # /tags 定期更新
-        if (now - last_meta_fetch > CHECK_INTERVAL) or (not tags_meta):
-            tags_meta = fetch_tags()
-            last_meta_fetch = now
-
-            # stateに反映
-            for tid, meta in tags_meta.items():
-                if tid not in state:
-                    state[tid] = {
-                        "name": meta["name"],
-                        "category": meta["category"],
-                        "is_present": False,
-                        "last_seen": None,
-                        "absent_since": None,
-                        "session_logged": False,
-                    }
-                else:
-                    state[tid]["name"] = meta["name"]
-                    state[tid]["category"] = meta["category"]
-
-        # 入力がなくても定期スイープ
-        if now - last_sweep >= SWEEP_INTERVAL:
-            sweep_absence(state, tags_meta, now)
-            last_sweep = now
-
-        # fdが読めるか（selectで待つ。短く待ってスイープ優先）
-        rlist, _, _ = select.select([fd], [], [], 0.2)
-        if not rlist:
-            continue
+    if METRICS_PORT:
+        try:
+            metrics.serve(METRICS_PORT)
+            log.info("📈 metrics: http://0.0.0.0:%s/metrics", METRICS_PORT)
+        except OSError as e:
+            log.warning("⚠ metricsを公開できません（port %s）: %s", METRICS_PORT, e)
 
-        tag_raw = read_one_tag_from_fd(fd)
-        if tag_raw is None:
-            continue
-        if tag_raw == "___HID_DISCONNECTED___":
-            print("⚠ RFID切断 → 再接続待ち")
-            try:
-                os.close(fd)
-            except Exception:
-                pass
-            hid_path = find_hid_device()
-            fd = open_hid_nonblocking(hid_path)
-            continue
+    global uplink
+    uplink = Uplink(SERVER, OUTBOX_DB).start()
+    tag_sync = TagSync(SERVER, CHECK_INTERVAL, TAG_SNAPSHOT).start()
+    run_reader(tag_sync)
 
-        tag = normalize_tag(tag_raw)
-        if not is_valid_tag(tag):
-            # デバッグしたいならここをprintしてもOK
-            continue
+def run_reader(tag_sync, stop=None):
+    """
+    リーダーを探してメインループを回す。送信先（uplink）と台帳の取得元（tag_sync）は呼び出し側が用意する
+    （単体では HTTP、サーバへの組み込み（embedded.py）ではDBを直接）。
+    """
+    # 登録タグと在席状態（タグごとの dict ではなく並列配列で持つ）
+    # 時刻はすべて time.monotonic()。timers のキーは store の添字
+    store = PresenceStore()
+    timers = AbsenceTimers()
+    REGISTERED_TAGS.set_function(lambda: len(store))
 
-        # 未登録タグは無視
-        if tag not in tags_meta:
-            print(f"⚠ 未登録タグ: {tag}")
-            continue
+    # リーダーは抜き差しを inotify で検知する。複数台なら1つの epoll でまとめて待つ
+    hub = ReaderHub(vid_pid=parse_vid_pid(HID_FILTER), max_devices=None if MULTI_READER else 1)
+    log.info("🔍 RFIDリーダー接続待ち…")
+    hub.scan()
 
-        name = tags_meta[tag]["name"]
-        category = tags_meta[tag]["category"]
+    run_loop(hub, store, timers, tag_sync, stop=stop)
 
-        print(f"🎯 検出: {name} / {category} ({tag})")
-        log_csv_detect(tag, name, category)
+def run_loop(hub, store, timers, tag_sync, clock=time.monotonic, stop=None):
+    """
+    リーダーのメインループ。hub は poll(timeout) -> [(path, tag)] を持つもの、
+    clock は time.monotonic 相当。stop（threading.Event）がセットされたら戻る。
+    負荷試験（benchmarks/loadgen.py）は偽のHID入力と時計でこのループをそのまま回す。
+    """
+    last_stats = clock()
+
+    while stop is None or not stop.is_set():
+        # 次にやることがある時刻（離席の期限・CSVのflush・統計表示）まで眠る
+        now = clock()
+        wake_at = min(d for d in (timers.next_deadline(), csv_next_due(), last_stats + STATS_INTERVAL)
+                      if d is not None)
 
-        # state準備
-        if tag not in state:
-            state[tag] = {
-                "name": name, "category": category,
-                "is_present": False, "last_seen": None,
-                "absent_since": None, "session_logged": False
-            }
-        s = state[tag]
+        # いずれかのリーダーが読めるまで待つ
+        # 読めたリーダーのレポートはすべてデコードされ、確定したタグがまとめて返る
+        detections = hub.poll(max(0.0, wake_at - now))
+        now = clock()
 
-        # absent→present（復帰）
-        if not s["is_present"]:
-            if s["absent_since"] is not None:
-                duration = int(now - s["absent_since"])
+        # 台帳の差分（バックグラウンドで取得済みのもの）を反映
+        while True:
+            try:
+                full, changes = tag_sync.results.get_nowait()
+            except queue.Empty:
+                break
+            apply_tag_changes(store, timers, full, changes)
+
+        # 在席状態はタグ単位で共有（どのリーダーで読めても同じタグとして扱う）
+        for _, tag_raw in detections:
+            handle_detection(tag_raw, now, store, timers)
+
+        t0 = time.perf_counter()
+        sweep_absence(store, timers, now)
+        SWEEP_SECONDS.observe(time.perf_counter() - t0)
+        flush_csv_if_due()
+
+        if now - last_stats >= STATS_INTERVAL:
+            log.info("📊 uplink", extra=uplink.stats())
+            last_stats = now
+
+def handle_detection(tag_raw, now, store, timers, out=live_output, threshold=None):
+    """確定した1タグ分の処理（在席・復帰の判定とログ）。threshold の既定は ABSENCE_THRESHOLD"""
+    # 正規化 + 検証（同じタグの2回目以降はキャッシュから）
+    tag = canonical_tag(tag_raw)
+    if tag is None:
+        _DETECT_INVALID.inc()
+        log.debug("不正なタグ: %r", tag_raw)
+        return
 
-                log_csv_duration(s["name"], duration)
-                if not s["session_logged"]:
-                    log_csv_used_once(s["name"], s["category"])
-                    s["session_logged"] = True
+    # 未登録タグは無視
+    idx = store.get(tag)
+    if idx is None:
+        _DETECT_UNREGISTERED.inc()
+        log.warning("⚠ 未登録タグ: %s", tag)
+        return
+    _DETECT_OK.inc()
 
-                post_usage_event(tag, s["name"], s["category"], "present_return", duration_sec=duration)
+    name = store.names[idx]
+    category = store.categories[idx]
 
-            s["is_present"] = True
-            s["absent_since"] = None
+    was_absent, duration, first_session = store.observe(idx, now)
+    if was_absent or not CSV_DETECT_PER_PRESENCE:
+        out.detected(tag, name, category)
 
-        s["last_seen"] = now
+    # absent→present（復帰）
+    if duration is not None:
+        _RETURN.inc()
+        out.returned(tag, name, category, int(duration), first_session)
+
+    timers.touch(idx, now + (ABSENCE_THRESHOLD if threshold is None else threshold))
+
+def _handle_sigterm(signum, frame):
+    # systemctl stop などでも finally（CSVのflush・送信の後始末）を通す
+    raise SystemExit(0)
 
 if __name__ == "__main__":
-    main()
+    logsetup.setup()
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_csv()
+        if uplink is not None:
+            uplink.stop()
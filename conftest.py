@@ -0,0 +1,25 @@
+"""
+テスト共通のフィクスチャ。
+
+server はインポート時に RFID_DB_PATH からDBと接続プールを作るので、テストごとに
+一時DBを指す環境変数で新しく import し直す（終わったら元のモジュールと環境変数に戻る）。
+"""
+import sys
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setenv("RFID_DB_PATH", str(tmp_path / "rfid.db"))
+    monkeypatch.setenv("RFID_RETENTION_DAYS", "0")
+    monkeypatch.delitem(sys.modules, "server", raising=False)
+    # import し直すとサーバのメトリクスをもう一度登録するので、テストの間だけ別の登録先にする
+    monkeypatch.setattr(metrics.REGISTRY, "_metrics", {})
+    import server
+
+    server.create_app(multiprocess=False)
+    yield server
+    server.pool.close_all()
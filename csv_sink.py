@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+CSVログの書き込み口（ファイルを開きっぱなしにしてバッファする）。
+
+1行ごとに open/append/close すると、検出のたびにシステムコールとSDカードへの
+書き込みが発生する。ここでは行をメモリに溜め、一定時間または一定行数ごとに
+まとめて書き出す。日付が変わるか一定サイズを超えたらファイルをローテーションし、
+古いファイルは（設定すれば）gzip圧縮する。keep_days を指定すると、ローテーションの
+ついでにそれより古いローテーション済みファイルを消す。
+"""
+import csv
+import gzip
+import io
+import logging
+import os
+import shutil
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+FLUSH_INTERVAL = 5.0        # 最後の書き出しからこの秒数で flush
+FLUSH_ROWS = 200            # この行数溜まったら flush
+ROTATE_DAILY = True         # 日付が変わったらローテーション
+ROTATE_MAX_BYTES = 0        # 0なら容量ではローテーションしない
+COMPRESS_ROTATED = True     # ローテーションしたファイルを gzip 圧縮する
+KEEP_ROTATED_DAYS = 0       # ローテーション済みファイルを残す日数（0なら消さない）
+
+log = logging.getLogger("rfid.csv")
+
+
+def _compress(path: Path):
+    gz = path.with_name(path.name + ".gz")
+    try:
+        with open(path, "rb") as src, gzip.open(gz, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(path)
+    except Exception as e:
+        log.warning("⚠ ログ圧縮失敗: %s (%s)", path, e)
+
+
+def rotated_files(path):
+    """path のローテーション済みファイル（stem-YYYYMMDD[-n].csv[.gz]）を [(Path, date)] で返す"""
+    path = Path(path)
+    pattern = re.compile(rf"{re.escape(path.stem)}-(\d{{8}})(?:-\d+)?{re.escape(path.suffix)}(?:\.gz)?")
+    found = []
+    if not path.parent.is_dir():
+        return found
+    for entry in path.parent.iterdir():
+        m = pattern.fullmatch(entry.name)
+        if m:
+            try:
+                found.append((entry, datetime.strptime(m.group(1), "%Y%m%d").date()))
+            except ValueError:
+                pass
+    return sorted(found, key=lambda item: (item[1], item[0].name))
+
+
+def prune_rotated(path, keep_days, today=None, dry_run=False):
+    """
+    keep_days 日より前のローテーション済みファイルを消す。
+    戻り値: [(Path, バイト数)]（dry_run=True なら消さずに対象だけ返す）
+    """
+    cutoff = (today or date.today()) - timedelta(days=keep_days)
+    removed = []
+    for entry, day in rotated_files(path):
+        if day >= cutoff:
+            continue
+        try:
+            size = entry.stat().st_size
+            if not dry_run:
+                os.remove(entry)
+        except OSError:
+            continue
+        removed.append((entry, size))
+    return removed
+
+
+class CsvSink:
+    def __init__(self, path, header, flush_interval=FLUSH_INTERVAL, flush_rows=FLUSH_ROWS,
+                 rotate_daily=ROTATE_DAILY, max_bytes=ROTATE_MAX_BYTES, compress=COMPRESS_ROTATED,
+                 keep_days=KEEP_ROTATED_DAYS, clock=time.monotonic):
+        self.path = Path(path)
+        self.header = header
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.rotate_daily = rotate_daily
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.keep_days = keep_days
+        self.clock = clock      # flush の間隔を測る時計（リーダーのループと同じものを使う）
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._day = None
+        self._size = 0
+        self._rows = []
+        self._last_flush = self.clock()
+
+    # ---- ファイル操作 ----
+    def open(self):
+        with self._lock:
+            self._open()
+
+    def _open(self):
+        if self._file is not None:
+            return
+        new = not self.path.exists() or self.path.stat().st_size == 0
+        if not new:
+            # 既存ファイルの日付は最終更新日とみなす（前日以前なら次の書き込みでローテーション）
+            self._day = date.fromtimestamp(self.path.stat().st_mtime)
+        else:
+            self._day = date.today()
+        self._file = open(self.path, "a", encoding="utf-8", newline="")
+        if new:
+            csv.writer(self._file).writerow(self.header)
+            self._file.flush()
+        self._size = self._file.tell()
+
+    def _rotated_name(self):
+        stamp = self._day.strftime("%Y%m%d")
+        for n in range(1000):
+            suffix = f"-{stamp}" if n == 0 else f"-{stamp}-{n}"
+            candidate = self.path.with_name(f"{self.path.stem}{suffix}{self.path.suffix}")
+            if not candidate.exists() and not candidate.with_name(candidate.name + ".gz").exists():
+                return candidate
+        return self.path.with_name(f"{self.path.stem}-{stamp}-{int(time.time())}{self.path.suffix}")
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        target = self._rotated_name()
+        os.replace(self.path, target)
+        threading.Thread(target=self._after_rotate, args=(target,), daemon=True).start()
+        self._open()
+
+    def _after_rotate(self, target):
+        if self.compress:
+            _compress(target)
+        if self.keep_days:
+            for entry, _ in prune_rotated(self.path, self.keep_days):
+                log.info("🗑 古いログを削除: %s", entry.name)
+
+    def _needs_rotation(self, today):
+        if self.rotate_daily and self._day != today:
+            return True
+        return bool(self.max_bytes) and self._size >= self.max_bytes
+
+    # ---- 書き込み ----
+    def write(self, row):
+        """行を溜める（timestamp は呼び出し時点のものを row に入れておくこと）"""
+        with self._lock:
+            self._rows.append(row)
+            if len(self._rows) >= self.flush_rows:
+                self._flush()
+
+    def _flush(self):
+        self._last_flush = self.clock()
+        if not self._rows:
+            return
+        self._open()
+        if self._needs_rotation(date.today()):
+            self._rotate()
+        buf = io.StringIO()
+        csv.writer(buf).writerows(self._rows)
+        self._rows = []
+        data = buf.getvalue()
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data.encode("utf-8"))
+        self._day = date.today()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def next_due(self):
+        """次に flush すべき時刻（self.clock 基準、溜まっていなければ None）"""
+        if not self._rows:
+            return None
+        return self._last_flush + self.flush_interval
+
+    def flush_if_due(self, now=None):
+        now = self.clock() if now is None else now
+        if self._rows and now - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+SQLite接続の使い回し（コネクションプール）。
+
+リクエストごとに sqlite3.connect / close すると、その分のオーバーヘッドと
+rollback journal のロック待ちが毎回発生する。ここでは起動時に開いた接続を
+スレッド間で貸し借りし、WAL + PRAGMA を一度だけ設定する。
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+
+from metrics import Histogram
+
+# ======================
+# 接続設定
+# ======================
+POOL_SIZE = 8                 # 同時に貸し出す接続の上限
+BUSY_TIMEOUT_MS = 5000        # 書き込みロック待ちの上限
+CACHE_SIZE_KB = 8000          # 1接続あたりのページキャッシュ（KiB）
+STATEMENT_CACHE = 128         # 接続ごとのプリペアドステートメントキャッシュ
+
+PRAGMAS = (
+    # 新規DBのみ有効（既存DBは retention の VACUUM で切り替わる）。削除した分を少しずつ返せる
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA cache_size=-{CACHE_SIZE_KB}",
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+)
+
+
+# ======================
+# メトリクス
+# ======================
+# execute は最初の1行が出るまで（SELECT の残りは fetch 側）、commit は WAL への書き込みまで
+DB_EXECUTE_SECONDS = Histogram("rfid_db_execute_seconds", "sqlite execute/executemany time", ["op"])
+DB_COMMIT_SECONDS = Histogram("rfid_db_commit_seconds", "sqlite commit time")
+DB_POOL_WAIT_SECONDS = Histogram("rfid_db_pool_wait_seconds", "time waiting for a pooled connection")
+DB_HOLD_SECONDS = Histogram("rfid_db_connection_hold_seconds", "time a pooled connection is held")
+_EXECUTE = DB_EXECUTE_SECONDS.labels("execute")
+_EXECUTEMANY = DB_EXECUTE_SECONDS.labels("executemany")
+_COMMIT = DB_COMMIT_SECONDS.labels()
+
+
+class TimedConnection(sqlite3.Connection):
+    """execute / executemany / commit の所要時間をヒストグラムに記録する接続"""
+
+    def execute(self, *args):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            _EXECUTE.observe(time.perf_counter() - t0)
+
+    def executemany(self, *args):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            _EXECUTEMANY.observe(time.perf_counter() - t0)
+
+    def commit(self):
+        t0 = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _COMMIT.observe(time.perf_counter() - t0)
+
+
+def open_connection(path) -> sqlite3.Connection:
+    """
+    PRAGMA設定済みの接続を1本開く。
+    SQL文字列を定数で渡せば cached_statements によりプリペアドステートメントが再利用される。
+    """
+    conn = sqlite3.connect(
+        str(path),
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE,
+        factory=TimedConnection,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+_inherited = []     # fork 前に親が開いた接続（子では使わない）
+
+
+class ConnectionPool:
+    """
+    接続を使い回すための小さなプール。
+
+    Flask開発サーバはリクエストごとにスレッドを作るため、threading.local では
+    結局毎回接続を開くことになる。そこでスレッドに紐付けず、LIFOキューで
+    直近に使った（キャッシュが温まった）接続から貸し出す。
+
+    persistent=False にすると従来どおり毎回 connect/close する（ベンチ比較用）。
+
+    fork された子プロセス（gunicorn --preload のワーカーなど）では、親から
+    引き継いだ接続を使わずにプールを空にして作り直す。
+    """
+
+    def __init__(self, path, size: int = POOL_SIZE, persistent: bool = True):
+        self.path = Path(path)
+        self.size = size
+        self.persistent = persistent
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+        ref = weakref.ref(self)
+
+        def after_fork():
+            pool = ref()
+            if pool is not None:
+                pool._after_fork()
+        os.register_at_fork(after_in_child=after_fork)
+
+    def _after_fork(self):
+        # 親の接続は close もしない（close 時のチェックポイント等が親のDBに触れる）。
+        # GC で閉じられないよう参照だけ残しておく
+        _inherited.append(self._idle)
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> sqlite3.Connection:
+        if not self.persistent:
+            return open_connection(self.path)
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return open_connection(self.path)
+                except Exception:
+                    self._opened -= 1
+                    raise
+        # 上限に達していれば返却を待つ
+        return self._idle.get()
+
+    def _release(self, conn: sqlite3.Connection, broken: bool = False):
+        if not self.persistent or self._closed or broken:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            if self.persistent:
+                with self._lock:
+                    self._opened -= 1
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        接続を借りる。例外時は未コミットのトランザクションを巻き戻してから返却する
+        （持続接続なので、開きっぱなしのトランザクションを次の利用者に残さない）。
+        """
+        t0 = time.perf_counter()
+        conn = self._acquire()
+        t1 = time.perf_counter()
+        DB_POOL_WAIT_SECONDS.observe(t1 - t0)
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
+            raise
+        finally:
+            if conn.in_transaction and not broken:
+                try:
+                    conn.rollback()
+                except sqlite3.Error:
+                    broken = True
+            self._release(conn, broken)
+            DB_HOLD_SECONDS.observe(time.perf_counter() - t1)
+
+    def close_all(self):
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except Exception:
+                pass
+            with self._lock:
+                self._opened -= 1
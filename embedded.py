@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+組み込みモード: リーダー（client_input_server.py）のHIDループをサーバのプロセスの中で動かす。
+リーダーとサーバを同じ小さいボードで動かすとき、localhost の HTTP と JSON を通さずに済ませる。
+
+    RFID_EMBEDDED_READER=1 python server.py
+
+- LocalUplink  : Uplink と同じ口。usage_event はサーバの接続プールから直接、まとめて
+                 1トランザクションで書く（/usage-events/batch と同じ store_usage_events）。
+                 褒めメッセージは FeedbackBroker.publish を直接呼ぶ
+- LocalTagSync : TagSync と同じ口。台帳の変更ログ（changes_since）を直接読む
+- 判定のロジック・CSV・メトリクスはリーダー単体のときと同じ（メトリクスはサーバの /metrics に出る）
+
+HTTP API はそのまま動くので、別のボードのリーダーは今までどおり繋げられる。
+複数ワーカーで動かしても、リーダーはジョブのロックを取れた1プロセスだけで動く（server.py）。
+送信待ちはディスクの Outbox ではなくメモリに持つ（同じプロセスなので BATCH_WINDOW 秒以内に書き込まれる）。
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+
+from tag_registry import changes_since
+from uplink import BATCH_WINDOW, FEEDBACK_QUEUE_MAX, OUTBOX_MAX_ROWS, RETRY_BASE, RETRY_MAX
+
+LOCAL_SYNC_INTERVAL = 1.0   # 台帳の変更ログを見る間隔（秒、MAX(seq) だけなので短くてよい）
+WRITE_MAX_EVENTS = 1000     # 1トランザクションで書く usage_event の上限
+
+log = logging.getLogger("rfid.embedded")
+
+
+class LocalUplink:
+    """
+    usage_event と褒めメッセージをサーバのDBへ直接書くスレッド（Uplink の代わり）。
+    store_events(events) -> (保存, 重複, results) と publish_feedback(message, image) を受け取る。
+    submit_* はDBを待たない（HIDループはキューに積むだけ）。
+    """
+
+    def __init__(self, store_events, publish_feedback, window=BATCH_WINDOW, max_rows=OUTBOX_MAX_ROWS):
+        self.store_events = store_events
+        self.publish_feedback = publish_feedback
+        self.window = window
+        self.max_rows = max_rows
+        self._events = deque()
+        self._feedback = deque(maxlen=FEEDBACK_QUEUE_MAX)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="local-uplink", daemon=True)
+
+        self.sent_events = 0
+        self.duplicate_events = 0
+        self.rejected_events = 0
+        self.sent_feedback = 0
+        self.dropped = 0
+        self.failures = 0
+        self.last_latency = None
+
+    # ---- ループ側から呼ぶ ----
+    def start(self):
+        self._thread.start()
+        return self
+
+    def submit_usage(self, payload):
+        if len(self._events) >= self.max_rows:
+            self.dropped += 1
+            return
+        payload = dict(payload)
+        payload.setdefault("event_key", uuid.uuid4().hex)
+        self._events.append(payload)
+        self._wake.set()
+
+    def submit_feedback(self, message, image=None):
+        if len(self._feedback) == self._feedback.maxlen:
+            self.dropped += 1
+        self._feedback.append((message, image))
+        self._wake.set()
+
+    def stats(self):
+        return {
+            "queue_depth": len(self._events) + len(self._feedback),
+            "sent_events": self.sent_events,
+            "duplicate_events": self.duplicate_events,
+            "rejected_events": self.rejected_events,
+            "sent_feedback": self.sent_feedback,
+            "dropped": self.dropped,
+            "failures": self.failures,
+            "last_latency_ms": None if self.last_latency is None else round(self.last_latency * 1000, 1),
+        }
+
+    def stop(self, timeout=5.0):
+        """溜まっている分を書いてから止める"""
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+    # ---- 書き込みスレッド ----
+    def _write_events(self):
+        while self._events:
+            batch = [self._events.popleft() for _ in range(min(len(self._events), WRITE_MAX_EVENTS))]
+            t0 = time.monotonic()
+            try:
+                _, _, results = self.store_events(batch)
+            except Exception:
+                log.exception("⚠ usage_event の書き込み失敗（%s件、再試行します）", len(batch))
+                self._events.extendleft(reversed(batch))
+                return False
+            self.last_latency = time.monotonic() - t0
+            for ev, res in zip(batch, results):
+                if res["status"] == "ok":
+                    self.sent_events += 1
+                elif res["status"] == "duplicate":
+                    self.duplicate_events += 1
+                else:
+                    self.rejected_events += 1
+                    log.error("⚠ usage_event 拒否: %s %s (%s)", ev.get("tag_id"), ev.get("event_type"),
+                              res.get("error"))
+        return True
+
+    def _publish_feedback(self):
+        while self._feedback:
+            message, image = self._feedback[0]
+            try:
+                self.publish_feedback(message, image)
+            except Exception:
+                log.exception("⚠ フィードバックの保存失敗")
+                return False
+            self._feedback.popleft()
+            self.sent_feedback += 1
+            log.info("💬 褒め: %s", message)
+        return True
+
+    def _run(self):
+        backoff = 0.0
+        while True:
+            stopping = self._stop.is_set()
+            if not stopping:
+                if backoff:
+                    self._stop.wait(backoff)
+                elif self._wake.wait(0.5) and self.window > 0 and not self._feedback:
+                    # 同時に発生したイベントをまとめて1回のコミットにする
+                    self._stop.wait(self.window)
+                self._wake.clear()
+
+            ok = self._publish_feedback()
+            ok = self._write_events() and ok
+            if ok:
+                backoff = 0.0
+            else:
+                self.failures += 1
+                backoff = min(RETRY_MAX, backoff * 2 if backoff else RETRY_BASE)
+
+            if stopping:
+                if self._events:
+                    log.warning("⚠ 書き込めなかったusage_event %s件を破棄します", len(self._events))
+                return
+
+
+class LocalTagSync:
+    """
+    台帳の変更ログを LOCAL_SYNC_INTERVAL ごとに直接読むスレッド（TagSync の代わり）。
+    結果は TagSync と同じく (full, changes) を results キューに入れる。
+    start() で1回目を読んでおくので、最初の検出から台帳が使える。
+    """
+
+    def __init__(self, pool, interval=LOCAL_SYNC_INTERVAL):
+        self.pool = pool
+        self.interval = interval
+        self.version = 0
+        self.synced = False
+        self.results = queue.SimpleQueue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="local-tag-sync", daemon=True)
+
+    def start(self):
+        self.poll()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def poll(self):
+        with self.pool.connection() as conn:
+            version, full, changes = changes_since(conn, self.version)
+        # 変更ログが空（version 0）のあいだは毎回 full が返るので、2回目以降は送らない
+        if full and self.synced and version == self.version:
+            return
+        self.version = version
+        self.synced = True
+        if full or changes:
+            self.results.put((full, changes))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                log.exception("⚠ 台帳の読み込み失敗")
+
+
+def start_reader(pool, store_events, publish_feedback):
+    """
+    リーダーのループをデーモンスレッドで始める。プロセスの終了時に CSV を書き出し、
+    溜まっている usage_event を書いてから止める。戻り値はスレッド。
+    """
+    import client_input_server as reader
+
+    reader.ensure_csv_headers()
+    reader.uplink = LocalUplink(store_events, publish_feedback).start()
+    tag_sync = LocalTagSync(pool).start()
+    stop = threading.Event()
+
+    def run():
+        try:
+            reader.run_reader(tag_sync, stop=stop)
+        except Exception:
+            log.exception("⚠ 組み込みリーダーが停止しました")
+
+    def shutdown():
+        stop.set()
+        tag_sync.stop()
+        reader.close_csv()
+        reader.uplink.stop()
+
+    thread = threading.Thread(target=run, name="embedded-reader", daemon=True)
+    thread.start()
+    atexit.register(shutdown)
+    return thread
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+usage_event / tags の書き出し（/export とコマンドライン）。
+
+- id のキーセット（WHERE id > ? ORDER BY id LIMIT ?）で CHUNK_ROWS 行ずつ読むので、
+  件数に関係なくメモリ使用量は一定。チャンクごとに接続を借りて返すので、
+  長い書き出しでもプールの接続や読み取りトランザクションを握り続けない
+- 形式: csv / ndjson / rfcol
+  rfcol は列指向の圧縮形式。CHUNK_ROWS 行ごとの行グループを1行のJSON
+  （列ごとの配列。id と ts_ms は差分符号化）にし、行グループごとに独立した gzip メンバーにする。
+  ファイル全体は普通の gzip としても読める（zcat で行グループのNDJSONになる）
+- 再開: 受け取った最後の id を after_id に渡すと続きから書き出す
+
+コマンドライン:
+    python export.py -o usage.csv --from 2026-01-01 --to 2026-01-31
+    python export.py -o usage.rfcol.gz --format rfcol --server http://raspberrypi.local:8000 --resume
+    python export.py --read usage.rfcol.gz          # rfcol を NDJSON に展開して表示
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+
+CHUNK_ROWS = 5000
+FORMATS = ("csv", "ndjson", "rfcol")
+TABLES = ("usage_event", "tags")
+MIMETYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "rfcol": "application/gzip",
+}
+EXTENSIONS = {"csv": "csv", "ndjson": "ndjson", "rfcol": "rfcol.gz"}
+
+USAGE_COLUMNS = ("id", "tag_id", "name", "category", "event_type", "timestamp", "ts_ms",
+                 "duration_sec", "event_key")
+TAG_COLUMNS = ("tag_id", "name", "category", "created_at")
+DELTA_COLUMNS = ("id", "ts_ms")     # rfcol で差分符号化する列
+
+SQL_USAGE_CHUNK = (
+    f"SELECT {', '.join(USAGE_COLUMNS)} FROM usage_event_named "
+    "WHERE id > ? {where} ORDER BY id LIMIT ?"
+)
+SQL_TAGS_CHUNK = f"SELECT rowid, {', '.join(TAG_COLUMNS)} FROM tags WHERE rowid > ? ORDER BY rowid LIMIT ?"
+
+
+class ExportQuery:
+    """
+    書き出す範囲。since_ms / until_ms はエポックミリ秒（until は含まない）。
+    until_id を指定すると id がそれ以下の行だけ（retention の退避で使う）。
+    """
+
+    def __init__(self, table="usage_event", since_ms=None, until_ms=None, tag_ids=(), after_id=0,
+                 until_id=None):
+        self.table = table
+        self.since_ms = since_ms
+        self.until_ms = until_ms
+        self.tag_ids = tuple(tag_ids)
+        self.after_id = after_id
+        self.until_id = until_id
+
+    @property
+    def columns(self):
+        return USAGE_COLUMNS if self.table == "usage_event" else TAG_COLUMNS
+
+    def _usage_sql(self):
+        where, params = [], []
+        if self.since_ms is not None:
+            where.append("AND ts_ms >= ?")
+            params.append(self.since_ms)
+        if self.until_ms is not None:
+            where.append("AND ts_ms < ?")
+            params.append(self.until_ms)
+        if self.until_id is not None:
+            where.append("AND id <= ?")
+            params.append(self.until_id)
+        if self.tag_ids:
+            where.append(f"AND tag_id IN ({','.join('?' * len(self.tag_ids))})")
+            params.extend(self.tag_ids)
+        return SQL_USAGE_CHUNK.format(where=" ".join(where)), params
+
+    def chunks(self, connect, chunk=CHUNK_ROWS):
+        """
+        行のリストを chunk 行ずつ返すジェネレータ。
+        connect は接続を貸すコンテキストマネージャを返す関数（pool.connection など）。
+        """
+        last = self.after_id if self.table == "usage_event" else 0
+        sql, params = self._usage_sql() if self.table == "usage_event" else (SQL_TAGS_CHUNK, [])
+        while True:
+            with connect() as conn:
+                if self.table == "usage_event":
+                    rows = conn.execute(sql, (last, *params, chunk)).fetchall()
+                else:
+                    rows = conn.execute(sql, (last, chunk)).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            if self.table == "tags":
+                rows = [r[1:] for r in rows]
+            yield rows
+            if len(rows) < chunk:
+                return
+
+
+# ======================
+# 形式ごとのエンコーダ（行のチャンク -> bytes）
+# ======================
+def encode_csv(chunks, columns, header=True):
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    if header:
+        writer.writerow(columns)
+        yield buf.getvalue().encode("utf-8")
+    for rows in chunks:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(rows)
+        yield buf.getvalue().encode("utf-8")
+
+
+def encode_ndjson(chunks, columns, header=True):
+    for rows in chunks:
+        yield "".join(
+            json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows
+        ).encode("utf-8")
+
+
+def _delta(values):
+    prev = 0
+    out = []
+    for v in values:
+        out.append(v - prev)
+        prev = v
+    return out
+
+
+def _undelta(values):
+    total = 0
+    out = []
+    for v in values:
+        total += v
+        out.append(total)
+    return out
+
+
+def encode_row_group(rows, columns, n=0):
+    """行のチャンク1つを rfcol の行グループ（独立した gzip メンバー）にする"""
+    cols = {name: [row[i] for row in rows] for i, name in enumerate(columns)}
+    encoding = {}
+    for name in DELTA_COLUMNS:
+        if name in cols:
+            cols[name] = _delta(cols[name])
+            encoding[name] = "delta"
+    group = {
+        "row_group": n,
+        "rows": len(rows),
+        "last_id": rows[-1][0] if columns[0] == "id" else None,
+        "encoding": encoding,
+        "columns": cols,
+    }
+    line = json.dumps(group, ensure_ascii=False, separators=(",", ":")) + "\n"
+    return gzip.compress(line.encode("utf-8"), compresslevel=6)
+
+
+def encode_rfcol(chunks, columns, header=True):
+    for n, rows in enumerate(chunks):
+        yield encode_row_group(rows, columns, n)
+
+
+ENCODERS = {"csv": encode_csv, "ndjson": encode_ndjson, "rfcol": encode_rfcol}
+
+
+def read_rfcol(fp):
+    """rfcol を1行ずつの dict に戻す"""
+    with gzip.open(fp, "rt", encoding="utf-8") as f:
+        for line in f:
+            group = json.loads(line)
+            cols = group["columns"]
+            for name, enc in group.get("encoding", {}).items():
+                if enc == "delta":
+                    cols[name] = _undelta(cols[name])
+            names = list(cols)
+            for values in zip(*(cols[name] for name in names)):
+                yield dict(zip(names, values))
+
+
+# ======================
+# 引数
+# ======================
+def parse_time_ms(text, end=False):
+    """
+    'YYYY-MM-DD' / 'YYYY-MM-DD HH:MM:SS'（ローカル時刻）/ エポックミリ秒 を受け付ける。
+    end=True で日付だけなら翌日0時（その日を含める）。不正なら ValueError
+    """
+    text = (text or "").strip()
+    if not text:
+        return None
+    if text.isdigit():
+        return int(text)
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+        try:
+            dt = datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        if end and fmt == "%Y-%m-%d":
+            dt += timedelta(days=1)
+        return int(dt.timestamp() * 1000)
+    raise ValueError(f"invalid time: {text}")
+
+
+# ======================
+# コマンドライン
+# ======================
+def _prepare_resume(path, fmt):
+    """
+    途中まで書いたファイルの末尾の書きかけ（行・gzip メンバーの途中）を切り詰め、
+    最後の id を返す（無ければ 0）。
+    """
+    if not path.exists() or path.stat().st_size == 0:
+        return 0
+    units = _CompleteUnits(fmt, header=(fmt == "csv"))
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(65536)
+            if not data:
+                break
+            size += len(units.feed(data))
+    if size != path.stat().st_size:
+        os.truncate(path, size)
+    return units.last_id or 0
+
+
+class _CompleteUnits:
+    """
+    HTTPで受け取った bytes を、途中で切れても壊れない単位
+    （csv/ndjson は行、rfcol は gzip メンバー＝行グループ）に区切り、最後の id を追う。
+    track_id=False（tags。id の列が無い）なら区切るだけ。
+    """
+
+    def __init__(self, fmt, header, track_id=True):
+        self.fmt = fmt
+        self.track_id = track_id
+        self.last_id = None
+        self._skip_header = fmt == "csv" and header
+        self._pending = b""
+        self._raw = bytearray()
+        self._text = []
+        self._inflate = zlib.decompressobj(wbits=31)
+
+    def feed(self, data):
+        """書き出してよい bytes を返す"""
+        if self.fmt == "rfcol":
+            return self._feed_rfcol(data)
+        data = self._pending + data
+        cut = data.rfind(b"\n") + 1
+        self._pending = data[cut:]
+        complete = data[:cut]
+        if not self.track_id:
+            return complete
+        for line in complete.splitlines():
+            if self._skip_header:
+                self._skip_header = False
+                continue
+            if self.fmt == "ndjson":
+                self.last_id = json.loads(line)["id"]
+            else:
+                self.last_id = int(line.split(b",", 1)[0])
+        return complete
+
+    def _feed_rfcol(self, data):
+        out = []
+        while data:
+            self._raw += data
+            self._text.append(self._inflate.decompress(data))
+            if not self._inflate.eof:
+                break
+            rest = self._inflate.unused_data
+            out.append(bytes(self._raw[:len(self._raw) - len(rest)]))
+            if self.track_id:
+                self.last_id = json.loads(b"".join(self._text))["last_id"]
+            self._raw = bytearray()
+            self._text = []
+            self._inflate = zlib.decompressobj(wbits=31)
+            data = rest
+        return b"".join(out)
+
+
+def export_http(server, params, out, fmt, after_id, retries, header):
+    """
+    サーバの /export から取る。接続が切れたら、書き終えた最後の id から取り直す
+    （書き出すのは行・行グループ単位で完結した分だけなので、ファイルは壊れない）。
+    tags には id が無いので、まだ何も書いていないときだけ最初から取り直す。
+    """
+    import requests
+
+    resumable = params.get("table", "usage_event") == "usage_event"
+    written = False
+    attempt = 0
+    while True:
+        units = _CompleteUnits(fmt, header, track_id=resumable)
+        query = dict(params, format=fmt, after_id=after_id, header="1" if header else "0")
+        try:
+            with requests.get(f"{server}/export", params=query, stream=True, timeout=(5, 60)) as resp:
+                if resp.status_code != 200:
+                    raise SystemExit(f"export failed: HTTP {resp.status_code} {resp.text[:200]}")
+                for data in resp.iter_content(chunk_size=65536):
+                    complete = units.feed(data)
+                    if complete:
+                        out.write(complete)
+                        written = True
+                        header = False
+                        attempt = 0
+            out.flush()
+            return
+        except requests.RequestException as e:
+            out.flush()
+            if not resumable and written:
+                raise SystemExit(f"export failed: {e}（tags は途中から再開できないので、もう一度実行してください）")
+            if units.last_id is not None:
+                after_id = units.last_id
+            attempt += 1
+            if attempt > retries:
+                raise SystemExit(f"export failed after {retries} retries: {e}")
+            wait = min(30, 2 ** attempt)
+            where = f"id>{after_id}" if resumable else "最初"
+            print(f"⚠ 接続が切れました（{e}）。{wait}秒後に {where} から再開します", file=sys.stderr)
+            time.sleep(wait)
+
+
+def export_local(db_path, query, out, fmt, header):
+    from contextlib import closing
+
+    def connect():
+        return closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True))
+
+    for data in ENCODERS[fmt](query.chunks(connect), query.columns, header=header):
+        out.write(data)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="usage_event / tags を書き出す")
+    ap.add_argument("-o", "--output", help="出力ファイル（省略時は標準出力）")
+    ap.add_argument("--format", choices=FORMATS, help="省略時は出力ファイルの拡張子から（既定 csv）")
+    ap.add_argument("--table", choices=TABLES, default="usage_event")
+    ap.add_argument("--from", dest="since", help="YYYY-MM-DD[ HH:MM:SS] またはエポックミリ秒")
+    ap.add_argument("--to", dest="until", help="YYYY-MM-DD（その日を含む）[ HH:MM:SS] またはエポックミリ秒")
+    ap.add_argument("--tag", action="append", default=[], help="tag_id で絞り込む（複数可）")
+    ap.add_argument("--after-id", type=int, default=0, help="この id より後から書き出す")
+    ap.add_argument("--resume", action="store_true", help="出力ファイルの最後の id から追記する")
+    ap.add_argument("--db", default=os.environ.get("RFID_DB_PATH", Path(__file__).resolve().parent / "rfid.db"))
+    ap.add_argument("--server", help="ローカルのDBではなくサーバの /export から取る（例 http://localhost:8000）")
+    ap.add_argument("--retries", type=int, default=10, help="--server で接続が切れたときの再試行回数")
+    ap.add_argument("--read", metavar="FILE", help="rfcol ファイルを NDJSON で表示して終了")
+    args = ap.parse_args(argv)
+
+    if args.read:
+        for row in read_rfcol(args.read):
+            sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+        return
+
+    fmt = args.format
+    if fmt is None:
+        fmt = next((f for f, ext in EXTENSIONS.items() if args.output and args.output.endswith(ext)), "csv")
+    try:
+        since_ms = parse_time_ms(args.since)
+        until_ms = parse_time_ms(args.until, end=True)
+    except ValueError as e:
+        ap.error(str(e))
+
+    after_id = args.after_id
+    header = True
+    path = Path(args.output) if args.output else None
+    if args.resume:
+        if path is None:
+            ap.error("--resume には -o が必要です")
+        if args.table != "usage_event":
+            ap.error("--resume は usage_event だけです")
+        after_id = max(after_id, _prepare_resume(path, fmt))
+        header = not (path.exists() and path.stat().st_size > 0)
+        if after_id:
+            print(f"id>{after_id} から再開します", file=sys.stderr)
+
+    out = open(path, "ab" if args.resume else "wb") if path else sys.stdout.buffer
+    try:
+        if args.server:
+            params = {"table": args.table}
+            if args.since:
+                params["from"] = args.since
+            if args.until:
+                params["to"] = args.until
+            if args.tag:
+                params["tag_id"] = ",".join(args.tag)
+            export_http(args.server.rstrip("/"), params, out, fmt, after_id, args.retries, header)
+        else:
+            query = ExportQuery(args.table, since_ms, until_ms, args.tag, after_id)
+            export_local(args.db, query, out, fmt, header)
+    finally:
+        if path:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+ディスプレイへの褒めメッセージ配信（Server-Sent Events 用）。
+
+最新メッセージを1つだけ持ち、publish() で seq を進めて待機中の購読者を一斉に起こす。
+購読者ごとのキューは持たないので、接続が何本あっても publish は O(1)、
+待機中の購読者は Condition の上で寝ているだけになる。
+
+複数のワーカープロセスで動かすときは FeedbackStore（DBの feedback_message テーブル）を渡す。
+publish は DB に書いてから自プロセスの購読者を起こし、他のプロセスはウォッチャースレッドが
+WATCH_INTERVAL ごとに最新の seq を見て追いつく。seq はDBの連番なので、
+どのワーカーに繋いでも Last-Event-ID がそのまま通じる。
+1プロセスだけで動かすとき（python server.py）は watch=False にする。publish はすべて
+自プロセスを通るのでウォッチャーは要らず、DBは起動後の最初の1回（再起動前のメッセージ）だけ読む。
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+FEEDBACK_TTL = 10.0         # 接続直後に「直前のメッセージ」を送る猶予（秒）
+KEEPALIVE_INTERVAL = 15.0   # 無通信時にコメント行を送る間隔（切断検知・プロキシ対策）
+WATCH_INTERVAL = 0.1        # 他プロセスの publish を確認する間隔（秒）
+FEEDBACK_KEEP = 100         # DBに残す過去のメッセージ数
+
+log = logging.getLogger("rfid.feedback")
+
+FEEDBACK_DDL = """
+    CREATE TABLE IF NOT EXISTS feedback_message (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        message TEXT NOT NULL,
+        image TEXT NOT NULL,
+        published_at REAL NOT NULL          -- UNIXエポック（秒）
+    )
+"""
+SQL_INSERT_FEEDBACK = "INSERT INTO feedback_message (message, image, published_at) VALUES (?, ?, ?)"
+SQL_PRUNE_FEEDBACK = "DELETE FROM feedback_message WHERE seq <= ?"
+SQL_LATEST_FEEDBACK = "SELECT seq, message, image, published_at FROM feedback_message ORDER BY seq DESC LIMIT 1"
+SQL_LATEST_FEEDBACK_SEQ = "SELECT COALESCE(MAX(seq), 0) FROM feedback_message"
+
+
+def create_feedback_table(conn):
+    conn.execute(FEEDBACK_DDL)
+
+
+class FeedbackStore:
+    """最新の褒めメッセージをDBに置き、ワーカープロセス間で共有する"""
+
+    def __init__(self, pool, keep=FEEDBACK_KEEP):
+        self.pool = pool
+        self.keep = keep
+
+    def publish(self, message, image):
+        """保存して (seq, published_at) を返す"""
+        published_at = time.time()
+        with self.pool.connection() as conn:
+            seq = conn.execute(SQL_INSERT_FEEDBACK, (message, image, published_at)).lastrowid
+            conn.execute(SQL_PRUNE_FEEDBACK, (seq - self.keep,))
+            conn.commit()
+        return seq, published_at
+
+    def latest(self):
+        """(seq, message, image, published_at)。まだ無ければ None"""
+        with self.pool.connection() as conn:
+            return conn.execute(SQL_LATEST_FEEDBACK).fetchone()
+
+    def latest_seq(self, conn):
+        return conn.execute(SQL_LATEST_FEEDBACK_SEQ).fetchone()[0]
+
+
+class FeedbackBroker:
+    def __init__(self, store=None, watch_interval=WATCH_INTERVAL, watch=True):
+        self.store = store
+        self.watch_interval = watch_interval
+        self.watch = watch
+        self._init_state()
+        # gunicorn --preload などで fork されたら、ロックとウォッチャーを作り直す
+        os.register_at_fork(after_in_child=self._init_state)
+
+    def _init_state(self):
+        self._cond = threading.Condition()
+        self.seq = 0
+        self.message = ""
+        self.image = ""
+        self.published_at = 0.0
+        self.subscribers = 0
+        self._watch_pid = None
+
+    def _apply(self, seq, message, image, published_at):
+        """seq が進んでいれば差し替えて購読者を起こす"""
+        with self._cond:
+            if seq <= self.seq:
+                return
+            self.seq = seq
+            self.message = message or ""
+            self.image = image or ""
+            self.published_at = published_at
+            self._cond.notify_all()
+
+    def _ensure_watcher(self):
+        """
+        共有ストアがあれば、このプロセスで最初に使われたときに最新を読み、
+        watch なら他プロセスの publish を拾うウォッチャーを起動する
+        """
+        if self.store is None or self._watch_pid == os.getpid():
+            return
+        with self._cond:
+            if self._watch_pid == os.getpid():
+                return
+            self._watch_pid = os.getpid()
+        row = self.store.latest()
+        if row is not None:
+            self._apply(*row)
+        if self.watch:
+            threading.Thread(target=self._watch, name="feedback-watch", daemon=True).start()
+
+    def _watch(self):
+        pid = os.getpid()
+        while self._watch_pid == pid:
+            time.sleep(self.watch_interval)
+            try:
+                with self.store.pool.connection() as conn:
+                    seq = self.store.latest_seq(conn)
+                if seq > self.seq:
+                    row = self.store.latest()
+                    if row is not None:
+                        self._apply(*row)
+            except Exception:
+                log.exception("feedback watcher")
+
+    def publish(self, message: str, image: str):
+        message = message or ""
+        image = image or ""
+        if self.store is None:
+            with self._cond:
+                self.seq += 1
+                self.message = message
+                self.image = image
+                self.published_at = time.time()
+                self._cond.notify_all()
+                return self.seq
+        self._ensure_watcher()
+        seq, published_at = self.store.publish(message, image)
+        self._apply(seq, message, image, published_at)
+        return seq
+
+    def latest(self):
+        self._ensure_watcher()
+        with self._cond:
+            return self.seq, self.message, self.image, self.published_at
+
+    def wait(self, after_seq: int, timeout: float):
+        """seq が after_seq より進むまで待つ。タイムアウトなら None"""
+        self._ensure_watcher()
+        with self._cond:
+            if self._cond.wait_for(lambda: self.seq > after_seq, timeout=timeout):
+                return self.seq, self.message, self.image, self.published_at
+        return None
+
+    def stream(self, last_event_id=None):
+        """
+        text/event-stream の本文を順に返すジェネレータ。
+        Last-Event-ID があればそれ以降、無ければ FEEDBACK_TTL 以内のメッセージから送る。
+        """
+        with self._cond:
+            self.subscribers += 1
+        try:
+            seq, message, image, published_at = self.latest()
+            if last_event_id is not None:
+                after = last_event_id
+            elif message or image:
+                after = seq - 1 if time.time() - published_at <= FEEDBACK_TTL else seq
+            else:
+                after = seq
+
+            yield "retry: 3000\n\n"
+            while True:
+                got = self.wait(after, KEEPALIVE_INTERVAL)
+                if got is None:
+                    yield ": keepalive\n\n"
+                    continue
+                seq, message, image, published_at = got
+                after = seq
+                data = json.dumps(
+                    {"seq": seq, "message": message, "image": image, "published_at": published_at},
+                    ensure_ascii=False,
+                )
+                yield f"id: {seq}\nevent: feedback\ndata: {data}\n\n"
+        finally:
+            with self._cond:
+                self.subscribers -= 1
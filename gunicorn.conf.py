@@ -0,0 +1,14 @@
+"""
+gunicorn の設定（カレントディレクトリの gunicorn.conf.py は自動で読まれる）。
+
+    gunicorn -w 4 -k gthread --threads 8 --preload -b 0.0.0.0:8000 wsgi:app
+
+retention と組み込みリーダーはスレッドで動くので、fork した後のワーカーの中で始める
+（--preload だと create_app は親プロセスで呼ばれる）。ロックを取れた1ワーカーだけが担当する。
+"""
+
+
+def post_worker_init(worker):
+    import server
+
+    server.start_background_jobs()
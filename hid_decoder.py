@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+キーボードエミュレーション型RFIDリーダー（hidraw, 8byteブートレポート）のデコーダ。
+
+レポート形式: [modifier, reserved, key1, key2, key3, key4, key5, key6]
+- 読めるだけまとめて読み、再利用する bytearray に直接受ける（os.readv）
+- 6つのキースロットをすべて見る。前のレポートから新たに押されたキーだけを入力とする
+- キーを離したレポート（全スロット0）を扱う。リーダーが離しレポートを送らない機種では
+  従来どおり各レポートのキーをそのまま入力とみなす
+- Enter でタグ確定。1回の読み取りで確定したタグはすべて返す
+
+hidraw は read() 1回につき1レポートしか返さないので、drain() で EAGAIN まで読み切る。
+パイプなどレポートがまとまって届く入力でも同じように扱える。
+"""
+import os
+
+REPORT_SIZE = 8
+KEY_ENTER = 0x28
+KEY_KEYPAD_ENTER = 0x58
+KEY_ERROR_ROLLOVER = 0x01
+
+KEYMAP = {
+    0x1E: "1", 0x1F: "2", 0x20: "3", 0x21: "4",
+    0x22: "5", 0x23: "6", 0x24: "7", 0x25: "8",
+    0x26: "9", 0x27: "0",
+    0x04: "A", 0x05: "B", 0x06: "C", 0x07: "D",
+    0x08: "E", 0x09: "F", 0x0A: "G", 0x0B: "H",
+    0x0C: "I", 0x0D: "J", 0x0E: "K", 0x0F: "L",
+    0x10: "M", 0x11: "N", 0x12: "O", 0x13: "P",
+    0x14: "Q", 0x15: "R", 0x16: "S", 0x17: "T",
+    0x18: "U", 0x19: "V", 0x1A: "W", 0x1B: "X",
+    0x1C: "Y", 0x1D: "Z",
+}
+
+# keycode -> 文字（Enter は "\n"、それ以外は None）の256要素表
+_DECODE = [None] * 256
+for _code, _ch in KEYMAP.items():
+    _DECODE[_code] = _ch
+_DECODE[KEY_ENTER] = "\n"
+_DECODE[KEY_KEYPAD_ENTER] = "\n"
+
+_NO_KEYS = bytes(6)
+
+
+class HidTagDecoder:
+    def __init__(self, report_size=REPORT_SIZE, buffer_reports=64):
+        self.report_size = report_size
+        self._buf = bytearray(report_size * buffer_reports)
+        self._view = memoryview(self._buf)
+        self._carry = 0             # 前回の読み取りで余った（レポート途中の）バイト数
+        self._chars = []            # 確定前のタグ文字
+        self._prev = _NO_KEYS       # 直前のレポートで押されていたキー
+        self._keyup_seen = False    # 離しレポートを送ってくる機種か
+        self.reports = 0            # デコードしたレポート数（統計用）
+
+    def reset(self):
+        self._carry = 0
+        self._chars = []
+        self._prev = _NO_KEYS
+
+    def feed(self, data):
+        """bytes-like を与えてデコードする。確定したタグのリストを返す"""
+        data = memoryview(data)
+        tags = []
+        while len(data):
+            room = len(self._buf) - self._carry
+            chunk = data[:room]
+            self._view[self._carry:self._carry + len(chunk)] = chunk
+            self._decode(self._carry + len(chunk), tags)
+            data = data[len(chunk):]
+        return tags
+
+    def read_from(self, fd):
+        """
+        fd から1回読んでデコードする（バッファへ直接読み込む）。
+        データが無ければ BlockingIOError、切断時は OSError がそのまま上がる。
+        EOF（0バイト）なら None。
+        """
+        n = os.readv(fd, [self._view[self._carry:]])
+        if n == 0:
+            return None
+        tags = []
+        self._decode(self._carry + n, tags)
+        return tags
+
+    def drain(self, fd):
+        """ノンブロッキングfdから読めるだけ読み、確定したタグをすべて返す"""
+        tags = []
+        while True:
+            try:
+                got = self.read_from(fd)
+            except BlockingIOError:
+                return tags
+            if got is None:
+                if tags:
+                    return tags     # 確定済みの分を先に返す（次回の呼び出しで OSError）
+                raise OSError("HID device closed")
+            tags.extend(got)
+
+    def _decode(self, end, tags):
+        size = self.report_size
+        buf = self._buf
+        decode = _DECODE
+        chars = self._chars
+        prev = self._prev
+        whole = end - end % size
+
+        for off in range(0, whole, size):
+            keys = buf[off + 2:off + size]
+            if keys == _NO_KEYS:
+                # 離しレポート
+                self._keyup_seen = True
+                prev = _NO_KEYS
+                continue
+            if keys == prev and self._keyup_seen:
+                continue
+            for k in keys:
+                if k == 0 or k == KEY_ERROR_ROLLOVER:
+                    continue
+                if self._keyup_seen and k in prev:
+                    continue            # 押しっぱなし
+                ch = decode[k]
+                if ch is None:
+                    continue
+                if ch == "\n":
+                    if chars:
+                        tags.append("".join(chars))
+                        chars.clear()
+                else:
+                    chars.append(ch)
+            prev = keys
+
+        self.reports += whole // size
+        self._prev = prev
+        # レポート途中で切れた分は先頭に寄せて次回に回す
+        self._carry = end - whole
+        if self._carry:
+            buf[0:self._carry] = buf[whole:end]
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+複数の hidraw リーダーを1プロセスでまとめて扱う。
+
+- list_hidraw(): /dev/hidraw* を列挙（sysfs の HID_ID で VID:PID を絞り込める）
+- DevWatcher   : inotify で /dev を監視し、抜き差しを検知する（1秒ごとの listdir の代わり）
+- ReaderHub    : 各デバイスを selectors（Linuxではepoll）に登録し、デバイスごとの
+                 HidTagDecoder でデコードする。pipe や pty の fd も add_fd() で登録できる
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import selectors
+import struct
+import time
+from pathlib import Path
+
+from hid_decoder import HidTagDecoder
+from metrics import Counter, Histogram
+
+SYS_HIDRAW = Path("/sys/class/hidraw")
+RESCAN_INTERVAL = 1.0       # inotify が使えないときの再探索間隔（秒）
+
+log = logging.getLogger("rfid.hid")
+
+HID_REPORTS = Counter("rfid_hid_reports_total", "HID reports decoded")
+HID_TAGS = Counter("rfid_hid_tags_total", "tags completed by the HID decoder")
+# 1回の drain（read + デコード）の時間を確定したタグ数で割ったもの
+HID_DECODE_SECONDS = Histogram("rfid_hid_decode_seconds", "read + decode time per tag",
+                               buckets=(0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025,
+                                        0.0005, 0.001, 0.0025, 0.01))
+
+IN_ATTRIB = 0x00000004
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def parse_vid_pid(text):
+    """'1A86:DD01' -> (0x1A86, 0xDD01)。空なら None"""
+    if not text:
+        return None
+    vid, pid = text.split(":")
+    return int(vid, 16), int(pid, 16)
+
+
+def device_vid_pid(name):
+    """sysfs の uevent（HID_ID=0003:00001A86:0000DD01）から (vid, pid) を読む"""
+    try:
+        for line in (SYS_HIDRAW / name / "device" / "uevent").read_text().splitlines():
+            if line.startswith("HID_ID="):
+                _, vid, pid = line[len("HID_ID="):].split(":")
+                return int(vid, 16), int(pid, 16)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def list_hidraw(vid_pid=None, dev_dir="/dev"):
+    names = sorted((n for n in os.listdir(dev_dir) if n.startswith("hidraw")),
+                   key=lambda n: int(n[6:]) if n[6:].isdigit() else 0)
+    if vid_pid is not None:
+        names = [n for n in names if device_vid_pid(n) == vid_pid]
+    return [f"{dev_dir}/{n}" for n in names]
+
+
+class DevWatcher:
+    """
+    /dev の inotify 監視。fileno() を selector に登録し、読めるようになったら
+    changed_names() で作成・属性変更・削除された hidraw の名前を取り出す。
+    inotify が使えない環境では available=False（呼び出し側で定期探索する）。
+    """
+
+    def __init__(self, dev_dir="/dev"):
+        self.dev_dir = dev_dir
+        self.fd = None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return
+            if libc.inotify_add_watch(fd, dev_dir.encode(), IN_CREATE | IN_DELETE | IN_ATTRIB) < 0:
+                os.close(fd)
+                return
+            self.fd = fd
+        except (OSError, AttributeError):
+            self.fd = None
+
+    @property
+    def available(self):
+        return self.fd is not None
+
+    def fileno(self):
+        return self.fd
+
+    def changed_names(self):
+        names = set()
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return names
+            off = 0
+            while off + _EVENT_HEADER.size <= len(data):
+                _, _, _, length = _EVENT_HEADER.unpack_from(data, off)
+                off += _EVENT_HEADER.size
+                name = data[off:off + length].split(b"\0", 1)[0].decode(errors="replace")
+                off += length
+                if name.startswith("hidraw"):
+                    names.add(name)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class ReaderDevice:
+    def __init__(self, path, fd):
+        self.path = path
+        self.fd = fd
+        self.decoder = HidTagDecoder()
+        self.tags_read = 0
+
+
+class ReaderHub:
+    """
+    複数リーダーの多重化。poll() が (device_path, tag) のリストを返す。
+    max_devices=1 なら従来どおり最初に見つかった1台だけを使う。
+    """
+
+    def __init__(self, vid_pid=None, max_devices=None, dev_dir="/dev", watch=True):
+        self.vid_pid = vid_pid
+        self.max_devices = max_devices
+        self.dev_dir = dev_dir
+        self.devices = {}               # path -> ReaderDevice
+        self._sel = selectors.DefaultSelector()
+        self._watcher = DevWatcher(dev_dir) if watch else None
+        if self._watcher is not None and self._watcher.available:
+            self._sel.register(self._watcher.fd, selectors.EVENT_READ, None)
+        self._last_scan = 0.0
+
+    def _full(self):
+        return self.max_devices is not None and len(self.devices) >= self.max_devices
+
+    def add_fd(self, path, fd):
+        """開いたfd（hidraw / pipe / pty）を登録する"""
+        os.set_blocking(fd, False)
+        dev = ReaderDevice(path, fd)
+        self.devices[path] = dev
+        self._sel.register(fd, selectors.EVENT_READ, dev)
+        log.info("✅ RFID リーダー検出: %s", path)
+        return dev
+
+    def try_open(self, path):
+        if path in self.devices or self._full():
+            return None
+        if self.vid_pid is not None and device_vid_pid(os.path.basename(path)) != self.vid_pid:
+            return None
+        try:
+            fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        except OSError:
+            return None     # 権限がまだ付いていない等（IN_ATTRIB で再試行される）
+        return self.add_fd(path, fd)
+
+    def remove(self, path):
+        dev = self.devices.pop(path, None)
+        if dev is None:
+            return
+        try:
+            self._sel.unregister(dev.fd)
+        except (KeyError, ValueError):
+            pass
+        try:
+            os.close(dev.fd)
+        except OSError:
+            pass
+        log.warning("⚠ RFID切断: %s", path)
+
+    def scan(self):
+        self._last_scan = time.monotonic()
+        try:
+            paths = list_hidraw(self.vid_pid, self.dev_dir)
+        except OSError:
+            return
+        for path in paths:
+            if self._full():
+                break
+            self.try_open(path)
+
+    def poll(self, timeout):
+        """timeout 秒まで待ち、確定したタグを [(device_path, tag)] で返す"""
+        if self._watcher is None or not self._watcher.available:
+            if not self._full() and time.monotonic() - self._last_scan >= RESCAN_INTERVAL:
+                self.scan()
+            if not self.devices:
+                # 登録対象が無いと select が即座に返らないので、ここで待つ
+                time.sleep(timeout if timeout is not None else RESCAN_INTERVAL)
+                return []
+            if timeout is None:
+                timeout = RESCAN_INTERVAL
+        elif not self.devices and not self._sel.get_map():
+            time.sleep(timeout if timeout is not None else RESCAN_INTERVAL)
+            return []
+
+        results = []
+        for key, _ in self._sel.select(timeout):
+            dev = key.data
+            if dev is None:
+                for name in self._watcher.changed_names():
+                    path = f"{self.dev_dir}/{name}"
+                    if path in self.devices:
+                        if not os.path.exists(path):
+                            self.remove(path)
+                    elif os.path.exists(path):
+                        self.try_open(path)
+                continue
+            reports = dev.decoder.reports
+            t0 = time.perf_counter()
+            try:
+                tags = dev.decoder.drain(dev.fd)
+            except OSError:
+                self.remove(dev.path)
+                continue
+            elapsed = time.perf_counter() - t0
+            HID_REPORTS.inc(dev.decoder.reports - reports)
+            if tags:
+                HID_TAGS.inc(len(tags))
+                per_tag = elapsed / len(tags)
+                for _ in tags:
+                    HID_DECODE_SECONDS.observe(per_tag)
+            dev.tags_read += len(tags)
+            results.extend((dev.path, tag) for tag in tags)
+        return results
+
+    def close(self):
+        for path in list(self.devices):
+            self.remove(path)
+        if self._watcher is not None:
+            self._watcher.close()
+        self._sel.close()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+ログの設定（サーバ・リーダー・retention で共通）。
+
+- レベルは RFID_LOG_LEVEL（DEBUG / INFO / WARNING / ERROR、既定 INFO）
+- 形式は RFID_LOG_FORMAT: text（既定、人が読む1行）か json（1行1オブジェクト）
+- log.info("離席", extra={"tag_id": tid}) のように extra で渡した項目は
+  text なら末尾に key=value、json ならキーとして出る
+
+無効なレベルのログは logging 側で isEnabledFor() を見て即座に捨てられる。
+ホットパス（1読み取りごと）では f-string ではなく %s の引数で渡し、
+文字列の組み立ても捨てられる側に回す。
+"""
+import json
+import logging
+import os
+import sys
+
+LOG_LEVEL = os.environ.get("RFID_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("RFID_LOG_FORMAT", "text")
+
+# LogRecord が標準で持つ属性（これ以外が extra で渡された項目）
+_STANDARD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _extra_fields(record):
+    return {k: v for k, v in vars(record).items() if k not in _STANDARD_ATTRS}
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s %(message)s", "%Y-%m-%d %H:%M:%S")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            head, sep, tail = line.partition("\n")     # 例外のトレースバックより前に付ける
+            line = head + "".join(f" {k}={v}" for k, v in fields.items()) + sep + tail
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **_extra_fields(record),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup(level=None, fmt=None, stream=None):
+    """ルートロガーに1つだけハンドラを付ける（何度呼んでも同じ）"""
+    root = logging.getLogger()
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if (fmt or LOG_FORMAT) == "json" else TextFormatter())
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level or LOG_LEVEL)
+    # werkzeug のアクセスログは /metrics で代わりに数えるので WARNING 以上だけ
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Prometheus のテキスト形式で出せる最小限のメトリクス（外部ライブラリなし）。
+
+- Counter / Gauge / Histogram。labels(...) でラベル付きの子を取る（子はキャッシュされる）
+- Gauge.set_function(fn) で、出力時に値を取りに行くゲージにできる（キューの長さなど）
+- render() が登録済みの全メトリクスをテキスト形式（version 0.0.4）で返す
+- serve(port) は /metrics だけを返す小さなHTTPサーバ（リーダー用、デーモンスレッド）
+
+サーバは /metrics、リーダーは RFID_METRICS_PORT で公開する。
+ホットパスでは labels() の結果を変数に取っておき、inc()/observe() だけを呼ぶ。
+"""
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 秒単位の既定のバケット（0.1ms〜10s）
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.doc}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, doc, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        registry.register(self)
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: expected labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _only(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name}: labels() is required")
+        return self._children[()]
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield from child.samples(self.name, self.labelnames, values)
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labelnames, values):
+        yield f"{name}{_format_labels(labelnames, values)} {_format_value(self.value)}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._only().inc(amount)
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+        self._fn = None
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, fn):
+        self._fn = fn
+
+    def get(self):
+        if self._fn is None:
+            return self.value
+        try:
+            return self._fn()
+        except Exception:
+            return math.nan
+
+    def samples(self, name, labelnames, values):
+        yield f"{name}{_format_labels(labelnames, values)} {_format_value(float(self.get()))}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._only().set(value)
+
+    def inc(self, amount=1):
+        self._only().inc(amount)
+
+    def dec(self, amount=1):
+        self._only().dec(amount)
+
+    def set_function(self, fn):
+        self._only().set_function(fn)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # 最後は +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0)
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def samples(self, name, labelnames, values):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, n in zip(self.buckets + (math.inf,), counts):
+            cumulative += n
+            le = (("le", _format_value(float(bound))),)
+            yield f"{name}_bucket{_format_labels(labelnames, values, le)} {cumulative}"
+        yield f"{name}_sum{_format_labels(labelnames, values)} {_format_value(total)}"
+        yield f"{name}_count{_format_labels(labelnames, values)} {cumulative}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, doc, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._only().observe(value)
+
+    def time(self):
+        return self._only().time()
+
+
+def render(registry=REGISTRY):
+    return registry.render()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass    # スクレイプのたびにアクセスログを出さない
+
+
+def serve(port, host="0.0.0.0", registry=REGISTRY):
+    """/metrics を返すHTTPサーバをデーモンスレッドで起動する（port=0 なら空いているポート）"""
+    handler = type("MetricsHandler", (_Handler,), {"registry": registry})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics", daemon=True).start()
+    return httpd
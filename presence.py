@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+在席・離席判定のためのデータ構造。
+
+AbsenceTimers: 在席中のタグの「離席とみなす期限」を min-heap で持つ。
+  - 期限は time.monotonic() 基準（NTPで時計が飛んでも誤検知しない）
+  - 検出のたびに期限を延ばすが、heap への push はしない（dict を書き換えるだけ）
+    取り出したときに期限が延びていれば入れ直す（遅延削除）
+  - heap の要素数は在席中のタグ数まで。登録タグ数には比例しない
+
+PresenceStore: 登録タグの在席状態（最後の検出時刻・離席開始時刻・フラグ）を
+  タグごとの dict ではなく並列配列で持つ。
+"""
+import heapq
+import sys
+from array import array
+
+NAN = float("nan")
+
+
+class AbsenceTimers:
+    """キーは tag_id でも PresenceStore の添字でもよい"""
+
+    def __init__(self):
+        self._heap = []             # (deadline, key)
+        self._deadline = {}         # key -> 現在の期限
+
+    def __len__(self):
+        return len(self._deadline)
+
+    def touch(self, tag_id, deadline):
+        """タグを検出した: 期限を deadline に更新する"""
+        scheduled = tag_id in self._deadline
+        self._deadline[tag_id] = deadline
+        if not scheduled:
+            heapq.heappush(self._heap, (deadline, tag_id))
+
+    def discard(self, tag_id):
+        """タグの監視をやめる（heap上の要素は取り出し時に捨てる）"""
+        self._deadline.pop(tag_id, None)
+
+    def next_deadline(self):
+        """最も早い期限（監視中のタグが無ければ None）"""
+        heap = self._heap
+        while heap:
+            deadline, tag_id = heap[0]
+            current = self._deadline.get(tag_id)
+            if current is None:
+                heapq.heappop(heap)             # discard 済み
+            elif current != deadline:
+                heapq.heapreplace(heap, (current, tag_id))   # 期限が延びていた
+            else:
+                return deadline
+        return None
+
+    def pop_expired(self, now):
+        """期限が now 以前のタグを取り出す（監視対象から外れる）"""
+        expired = []
+        while True:
+            deadline = self.next_deadline()
+            if deadline is None or deadline > now:
+                return expired
+            _, tag_id = heapq.heappop(self._heap)
+            del self._deadline[tag_id]
+            expired.append(tag_id)
+
+
+PRESENT = 0x01          # 在席中
+SESSION_LOGGED = 0x02   # 使用記録（cosmetics_session_summary）を書いた
+REGISTERED = 0x04       # 台帳に存在する（0なら空きスロット）
+
+
+class PresenceStore:
+    """
+    登録タグごとの在席状態をコンパクトに持つ。
+
+    タグごとに dict を作る代わりに、タグIDを整数の添字に対応させ、
+    名前・カテゴリはリスト（sys.intern 済み）、時刻は array('d')、フラグは bytearray に
+    並べて持つ。未設定の時刻は NaN。削除したタグの添字は再利用する。
+    時刻はすべて time.monotonic() 基準。
+    """
+
+    def __init__(self):
+        self._index = {}                # tag_id -> 添字
+        self._free = []                 # 空き添字
+        self.tag_ids = []
+        self.names = []
+        self.categories = []
+        self.last_seen = array("d")
+        self.absent_since = array("d")
+        self.flags = bytearray()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, tag_id):
+        return tag_id in self._index
+
+    def get(self, tag_id):
+        """登録済みなら添字、未登録なら None"""
+        return self._index.get(tag_id)
+
+    def tag_set(self):
+        return self._index.keys()
+
+    # ---- 台帳の反映 ----
+    def upsert(self, tag_id, name, category):
+        idx = self._index.get(tag_id)
+        name = sys.intern(name)
+        category = sys.intern(category)
+        if idx is not None:
+            self.names[idx] = name
+            self.categories[idx] = category
+            return idx
+
+        tag_id = sys.intern(tag_id)
+        if self._free:
+            idx = self._free.pop()
+            self.tag_ids[idx] = tag_id
+            self.names[idx] = name
+            self.categories[idx] = category
+            self.last_seen[idx] = NAN
+            self.absent_since[idx] = NAN
+        else:
+            idx = len(self.tag_ids)
+            self.tag_ids.append(tag_id)
+            self.names.append(name)
+            self.categories.append(category)
+            self.last_seen.append(NAN)
+            self.absent_since.append(NAN)
+            self.flags.append(0)
+        self.flags[idx] = REGISTERED
+        self._index[tag_id] = idx
+        return idx
+
+    def remove(self, tag_id):
+        """台帳から消えたタグを外す。外した添字を返す（無ければ None）"""
+        idx = self._index.pop(tag_id, None)
+        if idx is None:
+            return None
+        self.flags[idx] = 0
+        self.names[idx] = ""
+        self.categories[idx] = ""
+        self._free.append(idx)
+        return idx
+
+    # ---- 在席状態の遷移 ----
+    def is_present(self, idx):
+        return bool(self.flags[idx] & PRESENT)
+
+    def observe(self, idx, now):
+        """
+        タグを検出した。戻り値: (was_absent, duration, first_session)
+          was_absent    : 非在席から在席になったか
+          duration      : 離席していた秒数（離席から復帰した場合のみ、それ以外 None）
+          first_session : 復帰時に初めて使用記録を書くべきか
+        """
+        flags = self.flags[idx]
+        self.last_seen[idx] = now
+        if flags & PRESENT:
+            return False, None, False
+
+        duration = None
+        first_session = False
+        absent_since = self.absent_since[idx]
+        if absent_since == absent_since:        # NaN でなければ離席からの復帰
+            duration = now - absent_since
+            if not flags & SESSION_LOGGED:
+                first_session = True
+                flags |= SESSION_LOGGED
+        self.flags[idx] = flags | PRESENT
+        self.absent_since[idx] = NAN
+        return True, duration, first_session
+
+    def mark_absent(self, idx, now):
+        """在席中なら離席にして True を返す"""
+        flags = self.flags[idx]
+        if not (flags & REGISTERED and flags & PRESENT):
+            return False
+        self.flags[idx] = flags & ~PRESENT
+        self.absent_since[idx] = now
+        return True
@@ -1,40 +1,39 @@
 #!/usr/bin/env python3
+"""
+RFIDタグの読み取りツール（登録用）。
+
+    python read_single_tag.py              # 1枚ずつ読み、クリップボードへ（register-ui に貼り付け）
+    python read_single_tag.py --scan --category リップ --names names.txt
+                                           # 連続読み取り。ESC で終えると /register/bulk へまとめて登録
+
+--scan では、かざしたタグを順に溜める（同じタグは1回だけ）。名前は --names のファイルの
+行を読んだ順に割り当てる。名前かカテゴリが欠けていれば送らずに CSV だけを書くので、
+埋めてから tag_import.py で登録する。CSV は送ったときも logs/ に残す。
+"""
+import argparse
+import os
+import select
 import sys
-import time
 import termios
+import time
 import tty
-import os
-import pyperclip
-
-TAG_PREFIXES = ("E218", "E280")
-VALID_LENGTHS = {22, 23}
-
-KEYMAP = {
-    0x1E: "1", 0x1F: "2", 0x20: "3", 0x21: "4",
-    0x22: "5", 0x23: "6", 0x24: "7", 0x25: "8",
-    0x26: "9", 0x27: "0",
-    0x04: "a", 0x05: "b", 0x06: "c", 0x07: "d",
-    0x08: "e", 0x09: "f", 0x0A: "g", 0x0B: "h",
-    0x0C: "i", 0x0D: "j", 0x0E: "k", 0x0F: "l",
-    0x10: "m", 0x11: "n", 0x12: "o", 0x13: "p",
-    0x14: "q", 0x15: "r", 0x16: "s", 0x17: "t",
-    0x18: "u", 0x19: "v", 0x1A: "w", 0x1B: "x",
-    0x1C: "y", 0x1D: "z",
-}
-
-def normalize_tag(tag: str) -> str:
-    if not tag:
-        return ""
-    t = tag.strip().upper()
-    t = "".join(ch for ch in t if ch.isalnum()).upper()
-    return t
+from datetime import datetime
+from pathlib import Path
 
-def is_valid_tag(tag: str) -> bool:
-    if not tag.startswith(TAG_PREFIXES):
-        return False
-    if len(tag) not in VALID_LENGTHS:
-        return False
-    return True
+try:
+    import pyperclip
+except ImportError:     # クリップボードが使えない環境では表示だけ
+    pyperclip = None
+
+from hid_decoder import HidTagDecoder
+# タグ仕様（E218/E280両対応）はサーバと共通
+from tag_rules import TAG_PREFIXES, VALID_TAG_LENGTHS, is_valid_tag, normalize_tag
+import tag_import
+
+SERVER = os.environ.get("RFID_SERVER", "http://localhost:8000")
+SCAN_DIR = Path(__file__).resolve().parent / "logs"
+KEY_ESC = b"\x1b"
+KEYS_UNDO = (b"\x7f", b"\x08", b"u")     # Backspace / u で直前の1件を取り消す
 
 def wait_for_space_or_esc():
     fd = sys.stdin.fileno()
@@ -67,23 +66,113 @@ def find_hid_device():
 
 def read_single_tag_hid(hid_path):
     try:
-        with open(hid_path, "rb") as hid:
-            buffer = ""
-            print("📡 タグをかざしてください...")
-            while True:
-                data = hid.read(8)
-                if not data or len(data) < 3:
-                    return ""
-                keycode = data[2]
-                if keycode in KEYMAP:
-                    buffer += KEYMAP[keycode].upper()
-                elif keycode == 0x28:
-                    return normalize_tag(buffer)
+        fd = os.open(hid_path, os.O_RDONLY)
+    except Exception as e:
+        print(f"⚠ HID 読取エラー: {e}")
+        return ""
+    try:
+        decoder = HidTagDecoder()
+        print("📡 タグをかざしてください...")
+        while True:
+            tags = decoder.read_from(fd)
+            if tags is None:
+                return ""
+            if tags:
+                return normalize_tag(tags[0])
     except Exception as e:
         print(f"⚠ HID 読取エラー: {e}")
         return ""
+    finally:
+        os.close(fd)
+
+def scan_session(hid_path, names=(), category=""):
+    """
+    連続読み取り。タグをかざすたびに {"tag_id", "name", "category"} を溜めて返す。
+    HID と端末を1つの select で待つので、スペースキーを押さずに次々かざせる。
+    """
+    fd = os.open(hid_path, os.O_RDONLY | os.O_NONBLOCK)
+    stdin = sys.stdin.fileno()
+    old = termios.tcgetattr(stdin)
+    tty.setcbreak(stdin)
+    decoder = HidTagDecoder()
+    items, seen = [], set()
+    try:
+        while True:
+            ready, _, _ = select.select([fd, stdin], [], [])
+            if stdin in ready:
+                key = os.read(stdin, 1)
+                if key == KEY_ESC:
+                    break
+                if key in KEYS_UNDO and items:
+                    removed = items.pop()
+                    seen.discard(removed["tag_id"])
+                    print(f"↩ 取り消し: {removed['tag_id']} {removed['name']}")
+            if fd in ready:
+                for raw in decoder.drain(fd):
+                    tag = normalize_tag(raw)
+                    if not is_valid_tag(tag):
+                        print(f"❌ 無効なタグです（取得値: {tag}）")
+                        continue
+                    if tag in seen:
+                        continue    # かざしている間は同じタグが何度も読める
+                    seen.add(tag)
+                    name = names[len(items)] if len(items) < len(names) else ""
+                    items.append({"tag_id": tag, "name": name, "category": category})
+                    print(f"✅ {len(items):4d} {tag} {name or '（名前なし）'}")
+    except OSError as e:
+        print(f"⚠ HID 読取エラー: {e}（ここまでの {len(items)} 件を保存します）")
+    finally:
+        termios.tcsetattr(stdin, termios.TCSADRAIN, old)
+        os.close(fd)
+    return items
+
+
+def finish_scan(items, out_path, server, submit=True):
+    """CSVに残し、名前とカテゴリが揃っていれば /register/bulk にまとめて送る"""
+    if not items:
+        print("読み取ったタグはありません")
+        return
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tag_import.write_csv(out_path, items)
+    print(f"💾 {len(items)}件を {out_path} に保存しました")
+    retry = f"python tag_import.py {out_path} --server {server}"
+
+    missing = sum(1 for item in items if not (item["name"] and item["category"]))
+    if missing:
+        print(f"⚠ 名前かカテゴリの無い行が{missing}件あります。CSVを埋めてから登録してください:\n  {retry}")
+        return
+    if not submit:
+        print(f"登録するには:\n  {retry}")
+        return
+    try:
+        results = tag_import.post_bulk(server, items)
+    except Exception as e:
+        print(f"⚠ 登録できませんでした: {e}\n  あとで: {retry}")
+        return
+    tag_import.print_results(results, [f"{out_path}:{i + 2}" for i in range(len(items))])
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="RFIDタグの読み取り（登録用）")
+    ap.add_argument("--scan", action="store_true", help="連続読み取りしてまとめて登録する")
+    ap.add_argument("--names", help="--scan で読んだ順に割り当てる名前（1行1件）")
+    ap.add_argument("--category", default="", help="--scan で全件に付けるカテゴリ")
+    ap.add_argument("--out", help="--scan の結果のCSV（既定 logs/scan-日時.csv）")
+    ap.add_argument("--server", default=SERVER)
+    ap.add_argument("--no-submit", action="store_true", help="--scan でCSVを書くだけにする")
+    args = ap.parse_args(argv)
+
+    if args.scan:
+        names = []
+        if args.names:
+            names = [line.strip() for line in Path(args.names).read_text(encoding="utf-8").splitlines() if line.strip()]
+        print("=== RFID タグ連続読み取り ===")
+        print(f"タグを順にかざしてください / Backspaceで直前を取り消し / ESCで終了（名前 {len(names)}件）\n")
+        items = scan_session(find_hid_device(), names, args.category.strip())
+        out = Path(args.out) if args.out else SCAN_DIR / f"scan-{datetime.now().strftime('%Y%m%d-%H%M%S')}.csv"
+        finish_scan(items, out, args.server.rstrip("/"), submit=not args.no_submit)
+        return
 
-def main():
     print("=== RFID タグ登録ツール ===")
     print("スペースキーで読み取り開始 / ESCで終了\n")
     hid_path = find_hid_device()
@@ -101,12 +190,15 @@ def main():
             continue
 
         if is_valid_tag(tag):
-            pyperclip.copy(tag)
             print(f"✅ 読み取り成功: {tag}")
-            print("📋 クリップボードにコピーしました（register-uiへ貼り付けてください）\n")
+            if pyperclip is not None:
+                pyperclip.copy(tag)
+                print("📋 クリップボードにコピーしました（register-uiへ貼り付けてください）\n")
+            else:
+                print("（pyperclip が無いためクリップボードにはコピーしていません）\n")
         else:
             print(f"❌ 無効なタグです（取得値: {tag}）")
-            print(f"⛔ prefix={TAG_PREFIXES}, 長さ={sorted(VALID_LENGTHS)} が必要\n")
+            print(f"⛔ prefix={TAG_PREFIXES}, 長さ={sorted(VALID_TAG_LENGTHS)} が必要\n")
 
 if __name__ == "__main__":
     main()
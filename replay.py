@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+過去のログをリーダーの在席判定に流し直すオフラインのリプレイ。
+
+リーダーと同じ handle_detection / sweep_absence（PresenceStore + AbsenceTimers）を、
+ログの時刻を仮想時計として待たずに回し、リーダーが出したはずのイベント列
+（absent_start / present_return / lip_trigger）と使用時間の記録を作る。
+ABSENCE_THRESHOLD などを変えたときの結果を、実時間で回さずに確かめるためのもの。
+
+入力（どれもストリームで読むので、何か月分でもメモリはタグ数程度）:
+- 検出ログ: rfid_detect_log.csv / detected_tags.csv（timestamp,tag_id,name,category）。
+  ローテーション済みの .csv.gz も可。複数ファイルは時刻順にマージする。
+  検出ごとに1行のログが必要（既定。RFID_DETECT_PER_PRESENCE=1 で書いたログは使えない）。
+  在席区間ごとに1行のログからは在席の長さが分からないので、usage_event を使う
+- usage_event: export.py の出力（.csv / .ndjson / .rfcol.gz）か --db のDB。
+  present_return の時刻と absent_start - 記録時のしきい値（--source-threshold）を
+  在席区間とみなし、その間を --fill-interval ごとに読めたことにする。
+  区間の終わりには必ず1回読むので、間隔がしきい値より短ければ結果は間隔によらない
+  （既定はしきい値の半分。1秒ごとに埋めるより読み取りが数倍少なく速い）。
+  区間内の細かい途切れは残っていないので、記録時より短いしきい値は評価できない
+
+パラメータ（--sweep NAME=V1,V2 で直積を作り、プロセスプールで並列に回す）:
+- threshold       離席とみなす未検出秒数（リーダーの ABSENCE_THRESHOLD）
+- sweep_interval  離席判定の間隔（0ならリーダーと同じく期限ちょうど。旧方式の1秒ごとなら 1）
+- lip_categories  lip_trigger を出すカテゴリ（複数は | 区切り）
+
+    python replay.py logs/rfid_detect_log*.csv* --events events.csv --durations durations.csv
+    python replay.py --db rfid.db --sweep threshold=5,10,20,30 --sweep sweep_interval=0,1 --jobs 4
+"""
+import argparse
+import csv
+import gzip
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import client_input_server as reader
+import export
+from presence import AbsenceTimers, PresenceStore
+from tag_rules import canonical_tag
+
+SOURCE_THRESHOLD = reader.ABSENCE_THRESHOLD     # usage_event を記録したリーダーのしきい値
+FILL_RATIO = 0.5            # usage_event から作る読み取りの間隔（しきい値に対する比。1未満）
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+EVENT_COLUMNS = ["timestamp", "tag_id", "name", "category", "event_type", "duration_sec"]
+DURATION_COLUMNS = ["timestamp", "name", "duration(sec)"]
+PARAMS = ("threshold", "sweep_interval", "lip_categories")
+SHORT_USE_SEC = 30          # これより短い使用（読み損じによる見かけの離席の目安）を数える
+INF = float("inf")
+
+
+class ReplayParams:
+    def __init__(self, threshold=reader.ABSENCE_THRESHOLD, sweep_interval=0.0,
+                 lip_categories=reader.LIP_CATEGORIES):
+        self.threshold = float(threshold)
+        self.sweep_interval = float(sweep_interval)
+        self.lip_categories = tuple(lip_categories)
+
+    @classmethod
+    def parse(cls, name, text):
+        """--sweep の1つの値（文字列）を受け付けて (name, value) を返す"""
+        if name == "lip_categories":
+            return name, tuple(c for c in text.split("|") if c)
+        if name in ("threshold", "sweep_interval"):
+            return name, float(text)
+        raise ValueError(f"unknown parameter: {name}（{', '.join(PARAMS)}）")
+
+    def as_dict(self):
+        return {"threshold": self.threshold, "sweep_interval": self.sweep_interval,
+                "lip_categories": "|".join(self.lip_categories)}
+
+
+# ======================
+# 入力
+# ======================
+_day_start = {}
+_last_ts = [None, 0.0]
+
+
+def parse_local_ts(text):
+    """
+    'YYYY-MM-DD HH:MM:SS'（ローカル時刻）-> エポック秒。日付ごとの0時だけ mktime でキャッシュし、
+    同じ秒の行が続くとき（1秒に何回も読める）は直前の結果を返す
+    """
+    if text == _last_ts[0]:
+        return _last_ts[1]
+    day = text[:10]
+    base = _day_start.get(day)
+    if base is None:
+        base = _day_start[day] = time.mktime(time.strptime(day, "%Y-%m-%d"))
+    ts = base + int(text[11:13]) * 3600 + int(text[14:16]) * 60 + float(text[17:19])
+    _last_ts[0], _last_ts[1] = text, ts
+    return ts
+
+
+def _open_text(path):
+    path = str(path)
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+def read_detect_log(path, stats):
+    """検出ログCSV -> (エポック秒, tag_id, name, category)"""
+    with _open_text(path) as f:
+        rows = csv.reader(f)
+        header = next(rows, None)
+        if header and header[0] != "timestamp":
+            rows = itertools.chain([header], rows)    # ヘッダの無い古いログ
+        for row in rows:
+            try:
+                yield parse_local_ts(row[0]), row[1], row[2], row[3]
+            except (IndexError, ValueError):
+                stats["bad_rows"] += 1
+
+
+def _usage_rows_from_file(path):
+    name = str(path)
+    if name.endswith(".rfcol.gz") or name.endswith(".rfcol"):
+        with open(path, "rb") as fp:
+            yield from export.read_rfcol(fp)
+    elif name.endswith(".ndjson") or name.endswith(".jsonl"):
+        with _open_text(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with _open_text(path) as f:
+            yield from csv.DictReader(f)
+
+
+@contextmanager
+def _readonly(db_path):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def _usage_rows_from_db(db_path):
+    query = export.ExportQuery("usage_event")
+    for rows in query.chunks(lambda: _readonly(db_path)):
+        for row in rows:
+            yield dict(zip(export.USAGE_COLUMNS, row))
+
+
+def detections_from_events(rows, stats, source_threshold=SOURCE_THRESHOLD,
+                           fill_interval=SOURCE_THRESHOLD * FILL_RATIO):
+    """
+    usage_event の行から読み取りの列を作る（時刻順）。
+    present_return で在席区間を開き、absent_start - source_threshold（最後に読めた時刻）で閉じる。
+    区間内の読み取りは fill_interval ごと。区間の終わりは後から分かるので、
+    ts が source_threshold 以上過ぎた分だけを出す（先読みは source_threshold 秒ぶん）。
+    """
+    heap = []           # (時刻, 連番, 世代, tag_id)。在席中のタグごとに1つだけ
+    seq = itertools.count()
+    meta = {}           # tag_id -> (name, category)
+    gen = {}            # tag_id -> 世代（在席区間が閉じたら進め、ヒープに残った分を無効にする）
+    last = {}           # tag_id -> 最後に出した読み取りの時刻
+
+    def release(horizon):
+        while heap and heap[0][0] <= horizon:
+            t, _, g, tag = heapq.heappop(heap)
+            if gen.get(tag) != g:
+                continue
+            name, category = meta[tag]
+            last[tag] = t
+            yield t, tag, name, category
+            heapq.heappush(heap, (t + fill_interval, next(seq), g, tag))
+
+    prev = None
+    for row in rows:
+        try:
+            ts_ms = row.get("ts_ms")
+            t = int(ts_ms) / 1000 if ts_ms not in (None, "") else parse_local_ts(row["timestamp"])
+            tag, event_type = row["tag_id"], row["event_type"]
+        except (KeyError, ValueError, TypeError):
+            stats["bad_rows"] += 1
+            continue
+        if prev is not None and t < prev:
+            stats["reordered"] += 1
+            t = prev
+        prev = t
+        yield from release(t - source_threshold)
+        meta[tag] = (row.get("name") or "", row.get("category") or "")
+
+        if event_type == "present_return":
+            g = gen[tag] = gen.get(tag, 0) + 1
+            heapq.heappush(heap, (t, next(seq), g, tag))
+        elif event_type == "absent_start":
+            # 最後に読めた時刻ちょうどにも1回（在席の始まりが記録より前ならこれだけ）。
+            # ここまでの読み取りは stop 以前に出し終えているので、今出しても時刻順は崩れない
+            stop = t - source_threshold
+            gen[tag] = gen.get(tag, 0) + 1
+            if last.get(tag, -INF) < stop:
+                last[tag] = stop
+                name, category = meta[tag]
+                yield stop, tag, name, category
+    yield from release(INF if prev is None else prev)
+
+
+def open_inputs(paths, db, stats, source_threshold, fill_interval):
+    """入力をすべて時刻順にマージした (エポック秒, tag_id, name, category) の列"""
+    streams = []
+    for path in paths:
+        if _is_detect_log(path):
+            streams.append(read_detect_log(path, stats))
+        else:
+            streams.append(detections_from_events(_usage_rows_from_file(path), stats, source_threshold,
+                                                  fill_interval))
+    if db is not None:
+        streams.append(detections_from_events(_usage_rows_from_db(db), stats, source_threshold, fill_interval))
+    return heapq.merge(*streams, key=lambda r: r[0])
+
+
+def _is_detect_log(path):
+    """先頭行が検出ログのヘッダ（または時刻で始まる行）なら検出ログ"""
+    name = str(path)
+    if name.endswith(".rfcol.gz") or name.endswith(".rfcol") or name.endswith(".ndjson") or name.endswith(".jsonl"):
+        return False
+    with _open_text(path) as f:
+        first = f.readline()
+    return first.startswith("timestamp,tag_id,name,category") or (first[:4].isdigit() and "event_type" not in first)
+
+
+# ======================
+# 出力
+# ======================
+class RecordingOutput(reader.ReaderOutput):
+    """
+    リーダーの出力（ログ・CSV・送信）の代わりに、仮想時刻付きで記録する。
+    events / durations は csv.writer（None なら数えるだけ）。
+    """
+
+    def __init__(self, events=None, durations=None):
+        self.now = 0.0
+        self.events = events
+        self.durations_out = durations
+        self.counts = {"detected": 0, "present_return": 0, "absent_start": 0, "lip_trigger": 0,
+                       "used_once": 0}
+        self.durations = array("l")
+
+    def _ts(self):
+        return time.strftime(TS_FORMAT, time.localtime(self.now))
+
+    def _event(self, tag, name, category, event_type, duration=None):
+        self.counts[event_type] += 1
+        if self.events is not None:
+            self.events.writerow([self._ts(), tag, name, category, event_type, "" if duration is None else duration])
+
+    def detected(self, tag, name, category):
+        self.counts["detected"] += 1
+
+    def returned(self, tag, name, category, duration, first_session):
+        self.durations.append(duration)
+        if first_session:
+            self.counts["used_once"] += 1
+        if self.durations_out is not None:
+            self.durations_out.writerow([self._ts(), name, duration])
+        self._event(tag, name, category, "present_return", duration)
+
+    def absent(self, tag, name, category):
+        self._event(tag, name, category, "absent_start")
+
+    def lip(self, tag, name, category):
+        self._event(tag, name, category, "lip_trigger")
+
+
+# ======================
+# 本体
+# ======================
+def replay(detections, params, out):
+    """
+    読み取りの列を在席判定に流す。リーダーのループは次の期限ちょうどに起きて sweep_absence を
+    呼ぶので、読み取りの前に「その時刻までに来た期限」を順に処理する。
+    sweep_interval > 0 なら、判定を sweep_interval 秒の倍数の時刻に寄せる（定期スイープ方式）。
+    """
+    store = PresenceStore()
+    timers = AbsenceTimers()
+    threshold = params.threshold
+    interval = params.sweep_interval
+    lip = params.lip_categories
+    handle, sweep = reader.handle_detection, reader.sweep_absence
+
+    def due(deadline):
+        return -(-deadline // interval) * interval if interval > 0 else deadline
+
+    def sweep_until(t):
+        """t までに来た期限を処理し、次に起きる時刻を返す"""
+        while True:
+            deadline = timers.next_deadline()
+            if deadline is None:
+                return INF
+            deadline = due(deadline)
+            if deadline > t:
+                return deadline
+            out.now = deadline
+            sweep(store, timers, deadline, out, lip)
+
+    # 次に起きる時刻は読み取りのたびには聞き直さない。touch は期限を後ろにずらすか
+    # t + threshold の期限を足すだけなので、その分だけ min を取れば早めに起きる側にしかずれない
+    wake = INF
+    known = {}      # raw -> (name, category)。台帳への登録は名前が変わったときだけ
+    reads = 0
+    for t, raw, name, category in detections:
+        if t >= wake:
+            wake = sweep_until(t)
+        if known.get(raw) != (name, category):
+            known[raw] = (name, category)
+            tag = canonical_tag(raw)
+            if tag is not None:
+                store.upsert(tag, name, category)
+        out.now = t
+        handle(raw, t, store, timers, out, threshold)
+        next_wake = due(t + threshold)
+        if next_wake < wake:
+            wake = next_wake
+        reads += 1
+    # ログの終わりで在席中のタグも、期限が来れば離席になる
+    sweep_until(INF)
+    return reads
+
+
+def summarize(out, reads, elapsed, params, stats):
+    durations = sorted(out.durations)
+
+    def pct(p):
+        return durations[min(len(durations) - 1, int(p / 100 * len(durations)))] if durations else None
+
+    return {
+        **params.as_dict(),
+        "reads": reads,
+        **out.counts,
+        "duration_mean": round(sum(durations) / len(durations), 1) if durations else None,
+        "duration_p50": pct(50),
+        "duration_p90": pct(90),
+        "short_uses": sum(1 for d in durations if d < SHORT_USE_SEC),
+        "bad_rows": stats["bad_rows"],
+        "reordered": stats["reordered"],
+        "elapsed_sec": round(elapsed, 3),
+        "reads_per_sec": round(reads / elapsed) if elapsed else None,
+    }
+
+
+def run_one(paths, db, params, source_threshold, fill_interval, events_path=None, durations_path=None):
+    """1組のパラメータでリプレイして集計を返す（プロセスプールからも呼ぶ）"""
+    logging.getLogger("rfid.reader").setLevel(logging.ERROR)
+    stats = {"bad_rows": 0, "reordered": 0}
+    fill_interval = fill_interval or params.threshold * FILL_RATIO
+    files = []
+    try:
+        writers = []
+        for path, header in ((events_path, EVENT_COLUMNS), (durations_path, DURATION_COLUMNS)):
+            if path is None:
+                writers.append(None)
+                continue
+            f = open(path, "w", encoding="utf-8", newline="", buffering=1 << 20)
+            files.append(f)
+            w = csv.writer(f)
+            w.writerow(header)
+            writers.append(w)
+        out = RecordingOutput(*writers)
+        t0 = time.perf_counter()
+        reads = replay(open_inputs(paths, db, stats, source_threshold, fill_interval), params, out)
+        elapsed = time.perf_counter() - t0
+    finally:
+        for f in files:
+            f.close()
+    return summarize(out, reads, elapsed, params, stats)
+
+
+def sweep_grid(specs):
+    """["threshold=5,10", "sweep_interval=0,1"] -> ReplayParams の直積"""
+    axes = []
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        axes.append([ReplayParams.parse(name.strip(), v.strip()) for v in values.split(",") if v.strip()])
+    for combo in itertools.product(*axes):
+        yield ReplayParams(**dict(combo))
+
+
+SUMMARY_COLUMNS = ("threshold", "sweep_interval", "lip_categories", "reads", "present_return", "absent_start",
+                   "lip_trigger", "used_once", "duration_p50", "duration_p90", "short_uses", "reads_per_sec")
+
+
+def print_table(results):
+    print(" ".join(f"{c:>14s}" for c in SUMMARY_COLUMNS))
+    for r in results:
+        print(" ".join(f"{'' if r[c] is None else r[c]!s:>14s}" for c in SUMMARY_COLUMNS))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="検出ログ・usage_event をリーダーの在席判定でリプレイする")
+    ap.add_argument("inputs", nargs="*", help="検出ログCSV（.gz可）や export の出力")
+    ap.add_argument("--db", help="usage_event を読むDB（読み取り専用で開く）")
+    ap.add_argument("--threshold", type=float, default=reader.ABSENCE_THRESHOLD)
+    ap.add_argument("--sweep-interval", type=float, default=0.0)
+    ap.add_argument("--lip-categories", default="|".join(reader.LIP_CATEGORIES), help="| 区切り")
+    ap.add_argument("--sweep", action="append", default=[], metavar="NAME=V1,V2",
+                    help=f"パラメータの候補（{', '.join(PARAMS)}）。複数指定で直積")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count(), help="--sweep の並列数")
+    ap.add_argument("--source-threshold", type=float, default=SOURCE_THRESHOLD,
+                    help="usage_event を記録したときのしきい値（秒）")
+    ap.add_argument("--fill-interval", type=float, default=None,
+                    help="usage_event から作る読み取りの間隔（秒、既定はしきい値の半分）")
+    ap.add_argument("--events", help="イベント列を書き出すCSV（--sweep なしのとき）")
+    ap.add_argument("--durations", help="使用時間の記録を書き出すCSV（--sweep なしのとき）")
+    ap.add_argument("--json", action="store_true", help="集計をJSONで出力する")
+    args = ap.parse_args(argv)
+
+    if not args.inputs and not args.db:
+        ap.error("入力ファイルか --db を指定してください")
+    paths = [Path(p) for p in args.inputs]
+    for p in paths:
+        if not p.exists():
+            ap.error(f"ファイルがありません: {p}")
+
+    if args.sweep:
+        if args.events or args.durations:
+            ap.error("--events / --durations は --sweep と一緒には使えません")
+        try:
+            grid = list(sweep_grid(args.sweep))
+        except ValueError as e:
+            ap.error(str(e))
+        with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(grid)))) as pool:
+            futures = [pool.submit(run_one, paths, args.db, params, args.source_threshold, args.fill_interval)
+                       for params in grid]
+            results = [f.result() for f in futures]
+    else:
+        params = ReplayParams(args.threshold, args.sweep_interval,
+                              [c for c in args.lip_categories.split("|") if c])
+        results = [run_one(paths, args.db, params, args.source_threshold, args.fill_interval,
+                           args.events, args.durations)]
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+usage_event の保持期間・退避・VACUUM。
+
+1日1回（RUN_HOUR 時）に以下を順に行う。どの段階も短いトランザクションに分けるので、
+/usage-event などの書き込みを長く止めない。
+  1. rollup   : ロールアップを最新にする（集計は消さずに残る）
+  2. archive  : RETENTION_DAYS 日より古い生イベントを archive/ に rfcol（export.py）で退避し、
+                ロールアップ済み（high_water 以下）の行だけを BATCH_ROWS 行ずつ消す。
+                行グループを書いて fsync してから、その分を消す
+  3. hourly   : HOURLY_RETENTION_DAYS 日より古い時間別ロールアップを消す（日別は残す）
+  4. logs     : 指定されたCSVログのローテーション済みファイルを消す（コマンドラインのみ）
+  5. vacuum   : 空きページを incremental_vacuum で VACUUM_STEP_PAGES ずつ返す。
+                auto_vacuum が無効な古いDBは、--full-vacuum を付けたときだけ、空きが
+                FULL_VACUUM_MIN_FREE を超えていれば1度 VACUUM して INCREMENTAL に切り替える
+                （その間は書き込みが待たされるので、サーバのスケジューラからは行わない）
+
+生イベントの削除は既定では行わない（RFID_RETENTION_DAYS か --days で日数を指定したときだけ）。
+
+dry_run=True なら何も変えずに、各段階で消える行数と空く容量の見積もりを返す。
+
+    python retention.py --dry-run
+    python retention.py --days 180 --logs logs/rfid_detect_log.csv --log-keep-days 30
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import export
+import rollups
+from csv_sink import prune_rotated
+from schema import SCHEMA_VERSION, migrate, schema_version
+
+RETENTION_DAYS = int(os.environ.get("RFID_RETENTION_DAYS", "0"))     # 0なら生イベントを消さない（既定）
+HOURLY_RETENTION_DAYS = int(os.environ.get("RFID_HOURLY_RETENTION_DAYS", "90"))
+ARCHIVE_DIR = os.environ.get("RFID_ARCHIVE_DIR", "")                 # 空ならDBと同じ場所の archive/
+BATCH_ROWS = export.CHUNK_ROWS
+DELETE_CHUNK = 500              # 1文の DELETE ... IN (...) に渡す id の数
+VACUUM_STEP_PAGES = 256         # incremental_vacuum 1回で返すページ数
+VACUUM_PAUSE = 0.05             # incremental_vacuum の合間に書き込みへ譲る秒数
+FULL_VACUUM_MIN_FREE = 0.25     # auto_vacuum 無効のDBで VACUUM するときの空きページ率
+RUN_HOUR = 3                    # 毎日この時刻（ローカル）に実行
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+log = logging.getLogger("rfid.retention")
+
+
+class RetentionPolicy:
+    def __init__(self, days=RETENTION_DAYS, hourly_days=HOURLY_RETENTION_DAYS, archive_dir=None,
+                 log_paths=(), log_keep_days=0, full_vacuum=False):
+        self.days = days
+        self.hourly_days = hourly_days
+        self.archive_dir = Path(archive_dir) if archive_dir else None
+        self.log_paths = [Path(p) for p in log_paths]
+        self.log_keep_days = log_keep_days
+        self.full_vacuum = full_vacuum
+
+    def cutoff_ms(self, now):
+        return int((now - timedelta(days=self.days)).timestamp() * 1000)
+
+    def hourly_cutoff_day(self, now):
+        return (now - timedelta(days=self.hourly_days)).strftime("%Y-%m-%d")
+
+
+# ======================
+# 容量の見積もり
+# ======================
+def _object_bytes(conn, table):
+    """テーブルとそのインデックスのバイト数（dbstat が無ければ None）"""
+    names = [table] + [r[1] for r in conn.execute(f"PRAGMA index_list({table})")]
+    try:
+        return conn.execute(
+            f"SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN ({','.join('?' * len(names))})",
+            names,
+        ).fetchone()[0]
+    except Exception:
+        return None
+
+
+def _page_info(conn):
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return page_size, pages, free
+
+
+def _share(conn, table, rows, total):
+    """rows/total 行分のバイト数の見積もり"""
+    if not rows or not total:
+        return 0
+    size = _object_bytes(conn, table)
+    if size is None:
+        page_size, pages, free = _page_info(conn)
+        size = (pages - free) * page_size       # dbstat が無い: ファイル全体で按分（多めに出る）
+    return int(size * rows / total)
+
+
+def plan(conn, policy, now=None):
+    """各段階の対象と、空く容量の見積もり（バイト）を返す"""
+    now = now or datetime.now()
+    steps = []
+
+    hw = rollups.high_water(conn)
+    pending = conn.execute("SELECT COUNT(*) FROM usage_event WHERE id > ?", (hw,)).fetchone()[0]
+    steps.append({"step": "rollup", "rows": pending, "bytes": 0})
+
+    total = conn.execute("SELECT COUNT(*) FROM usage_event").fetchone()[0]
+    if policy.days > 0:
+        old = conn.execute("SELECT COUNT(*) FROM usage_event WHERE ts_ms < ?",
+                           (policy.cutoff_ms(now),)).fetchone()[0]
+    else:
+        old = 0
+    steps.append({"step": "archive", "rows": old, "bytes": _share(conn, "usage_event", old, total)})
+
+    hourly_total = conn.execute("SELECT COUNT(*) FROM usage_rollup_hourly").fetchone()[0]
+    if policy.hourly_days > 0:
+        hourly_old = conn.execute("SELECT COUNT(*) FROM usage_rollup_hourly WHERE day < ?",
+                                  (policy.hourly_cutoff_day(now),)).fetchone()[0]
+    else:
+        hourly_old = 0
+    steps.append({"step": "hourly", "rows": hourly_old,
+                  "bytes": _share(conn, "usage_rollup_hourly", hourly_old, hourly_total)})
+
+    files = []
+    if policy.log_keep_days > 0:
+        for path in policy.log_paths:
+            files.extend(prune_rotated(path, policy.log_keep_days, today=now.date(), dry_run=True))
+    steps.append({"step": "logs", "files": [str(p) for p, _ in files], "bytes": sum(size for _, size in files)})
+
+    # 既存の空きページ + 上で消える分がファイルから返る
+    page_size, pages, free = _page_info(conn)
+    freed = sum(step["bytes"] for step in steps if step["step"] in ("archive", "hourly"))
+    steps.append({
+        "step": "vacuum",
+        "auto_vacuum": conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+        "free_pages": free,
+        "bytes": free * page_size + freed,
+    })
+    return {"db_bytes": pages * page_size, "cutoff_ms": policy.cutoff_ms(now) if policy.days > 0 else None,
+            "steps": steps}
+
+
+# ======================
+# 実行
+# ======================
+def archive_old_events(pool, policy, now):
+    """古い生イベントを退避して消す。戻り値: (退避した行数, 退避ファイル)"""
+    with pool.connection() as conn:
+        hw = rollups.high_water(conn)
+        db_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    archive_dir = policy.archive_dir or Path(db_file).resolve().parent / "archive"
+    cutoff = policy.cutoff_ms(now)
+    query = export.ExportQuery("usage_event", until_ms=cutoff, until_id=hw)
+
+    path = None
+    moved = 0
+    out = None
+    try:
+        for n, rows in enumerate(query.chunks(pool.connection, BATCH_ROWS)):
+            if out is None:
+                archive_dir.mkdir(parents=True, exist_ok=True)
+                stamp = now.strftime("%Y%m%d%H%M%S")
+                path = archive_dir / f"usage_event-before-{datetime.fromtimestamp(cutoff / 1000):%Y%m%d}-{stamp}.rfcol.gz"
+                out = open(path, "ab")
+            out.write(export.encode_row_group(rows, query.columns, n))
+            out.flush()
+            os.fsync(out.fileno())
+
+            ids = [row[0] for row in rows]
+            with pool.connection() as conn:
+                for i in range(0, len(ids), DELETE_CHUNK):
+                    chunk = ids[i:i + DELETE_CHUNK]
+                    conn.execute(f"DELETE FROM usage_event WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+                conn.commit()
+            moved += len(rows)
+    finally:
+        if out is not None:
+            out.close()
+    return moved, path
+
+
+def prune_hourly(pool, policy, now):
+    cutoff_day = policy.hourly_cutoff_day(now)
+    removed = 0
+    with pool.connection() as conn:
+        days = [r[0] for r in conn.execute(
+            "SELECT DISTINCT day FROM usage_rollup_hourly WHERE day < ? ORDER BY day", (cutoff_day,))]
+    for day in days:
+        with pool.connection() as conn:
+            removed += conn.execute("DELETE FROM usage_rollup_hourly WHERE day = ?", (day,)).rowcount
+            conn.commit()
+    return removed
+
+
+def vacuum(pool, policy):
+    """空きページを返す。戻り値: 返したページ数"""
+    with pool.connection() as conn:
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        _, pages, free = _page_info(conn)
+        if mode != AUTO_VACUUM_INCREMENTAL:
+            if not policy.full_vacuum or not pages or free / pages < FULL_VACUUM_MIN_FREE:
+                return 0
+            # 1度だけ: 全体を作り直して incremental に切り替える
+            conn.execute(f"PRAGMA auto_vacuum={AUTO_VACUUM_INCREMENTAL}")
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+            return free
+
+    returned = 0
+    while True:
+        with pool.connection() as conn:
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if before == 0:
+                break
+            conn.execute(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})").fetchall()
+            after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if after >= before:
+            break
+        returned += before - after
+        time.sleep(VACUUM_PAUSE)
+    with pool.connection() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    return returned
+
+
+def run(pool, policy, now=None, dry_run=False):
+    """retention を1回行う。dry_run なら plan() の結果だけを返す"""
+    now = now or datetime.now()
+    with pool.connection() as conn:
+        report = plan(conn, policy, now)
+    if dry_run:
+        report["dry_run"] = True
+        return report
+
+    with pool.connection() as conn:
+        done = {"rollup": rollups.refresh(conn)}
+    if policy.days > 0:
+        moved, path = archive_old_events(pool, policy, now)
+        done["archive"] = moved
+        done["archive_file"] = str(path) if path else None
+    if policy.hourly_days > 0:
+        done["hourly"] = prune_hourly(pool, policy, now)
+    if policy.log_keep_days > 0:
+        done["logs"] = [str(p) for path in policy.log_paths
+                        for p, _ in prune_rotated(path, policy.log_keep_days, today=now.date())]
+    done["vacuum_pages"] = vacuum(pool, policy)
+    with pool.connection() as conn:
+        page_size, pages, _ = _page_info(conn)
+    report["done"] = done
+    report["db_bytes_after"] = pages * page_size
+    return report
+
+
+class RetentionScheduler:
+    """毎日 RUN_HOUR 時に run() するスレッド（書き込みを止める full VACUUM は行わない）"""
+
+    def __init__(self, pool, policy, run_hour=RUN_HOUR):
+        if policy.full_vacuum:
+            raise ValueError("full VACUUM はコマンドライン（--full-vacuum）でだけ行う")
+        self.pool = pool
+        self.policy = policy
+        self.run_hour = run_hour
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _seconds_until_next(self):
+        now = datetime.now()
+        nxt = now.replace(hour=self.run_hour, minute=0, second=0, microsecond=0)
+        if nxt <= now:
+            nxt += timedelta(days=1)
+        return (nxt - now).total_seconds()
+
+    def _run(self):
+        while not self._stop.wait(self._seconds_until_next()):
+            try:
+                report = run(self.pool, self.policy)
+                log.info("[retention] %s", json.dumps(report["done"], ensure_ascii=False))
+            except Exception:
+                log.exception("[ERROR] retention")
+
+
+# ======================
+# コマンドライン
+# ======================
+def _format_bytes(n):
+    if n < 1024:
+        return f"{n} B"
+    for unit in ("KiB", "MiB", "GiB"):
+        n /= 1024
+        if n < 1024 or unit == "GiB":
+            return f"{n:.1f} {unit}"
+
+
+def main(argv=None):
+    from db import ConnectionPool
+
+    ap = argparse.ArgumentParser(description="usage_event の保持期間・退避・VACUUM")
+    ap.add_argument("--db", default=os.environ.get("RFID_DB_PATH", Path(__file__).resolve().parent / "rfid.db"))
+    ap.add_argument("--days", type=int, default=RETENTION_DAYS, help="生イベントを残す日数（0なら消さない）")
+    ap.add_argument("--hourly-days", type=int, default=HOURLY_RETENTION_DAYS, help="時間別ロールアップを残す日数")
+    ap.add_argument("--archive-dir", default=ARCHIVE_DIR or None)
+    ap.add_argument("--logs", nargs="*", default=[], help="ローテーション済みを消すCSVログ（例 logs/rfid_detect_log.csv）")
+    ap.add_argument("--log-keep-days", type=int, default=0)
+    ap.add_argument("--full-vacuum", action="store_true",
+                    help="auto_vacuum 無効のDBなら VACUUM して INCREMENTAL に切り替える（その間は書き込みが止まる）")
+    ap.add_argument("--dry-run", action="store_true", help="何も変えずに見積もりだけ表示する")
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args(argv)
+
+    policy = RetentionPolicy(args.days, args.hourly_days, args.archive_dir, args.logs, args.log_keep_days,
+                             full_vacuum=args.full_vacuum)
+    pool = ConnectionPool(args.db, size=2)
+    try:
+        # サーバをまだ新しい版で起動していないDBでも動くように、先にスキーマを揃える
+        with pool.connection() as conn:
+            if schema_version(conn) < SCHEMA_VERSION:
+                if args.dry_run:
+                    raise SystemExit(f"DBのスキーマが古いです（v{schema_version(conn)}）。"
+                                     "--dry-run なしで実行するか、先にサーバを起動して更新してください")
+                before, after = migrate(conn)
+                print(f"DBのスキーマを v{before} から v{after} に更新しました")
+        report = run(pool, policy, dry_run=args.dry_run)
+    finally:
+        pool.close_all()
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print(f"DB: {args.db} ({_format_bytes(report['db_bytes'])})")
+    for step in report["steps"]:
+        count = step.get("rows", len(step.get("files", [])))
+        print(f"  {step['step']:8s} {count:>10} 件  空く容量(見積もり) {_format_bytes(step['bytes'])}")
+    if "done" in report:
+        print(f"実行結果: {json.dumps(report['done'], ensure_ascii=False)}")
+        print(f"DB: {_format_bytes(report['db_bytes_after'])}")
+    else:
+        print("（dry-run: 変更していません）")
+
+
+if __name__ == "__main__":
+    main()
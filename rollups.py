@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+usage_event の集計（ロールアップ）。
+
+usage_event を毎回スキャンする代わりに、日別・時間別 × タグ × 種別の件数と
+duration_sec の合計を別テーブルに持つ。rollup_state の high_water（処理済みの最大 id）
+より後の行だけを足し込むので、更新のコストは新しく入った行数にだけ比例し、
+/stats の読み出しは履歴の長さに関係なくロールアップの行数（期間 × タグ数）で決まる。
+
+日付・時刻はサーバのローカル時刻で区切る。カテゴリは集計時点の台帳から引く
+（削除済みタグは変更ログの墓石から）。
+"""
+import threading
+
+ROLLUP_NAME = "usage_event"
+REFRESH_CHUNK = 50000       # 1トランザクションで足し込む usage_event の行数
+
+ROLLUP_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS usage_rollup_daily (
+        day TEXT NOT NULL,                  -- 'YYYY-MM-DD'（ローカル）
+        tag_id TEXT NOT NULL,
+        event_type TEXT NOT NULL,
+        events INTEGER NOT NULL,
+        duration_sec INTEGER NOT NULL,      -- present_return の duration_sec の合計
+        PRIMARY KEY (day, tag_id, event_type)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS usage_rollup_hourly (
+        day TEXT NOT NULL,
+        hour INTEGER NOT NULL,              -- 0-23（ローカル）
+        tag_id TEXT NOT NULL,
+        event_type TEXT NOT NULL,
+        events INTEGER NOT NULL,
+        duration_sec INTEGER NOT NULL,
+        PRIMARY KEY (day, hour, tag_id, event_type)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_usage_rollup_daily_tag ON usage_rollup_daily(tag_id, day)",
+    # タグの名前・カテゴリ（台帳に無ければ変更ログの最後の行＝墓石）
+    """
+    CREATE VIEW IF NOT EXISTS tag_labels AS
+    SELECT tag_id, name, category FROM tags
+    UNION ALL
+    SELECT c.tag_id, c.name, c.category
+    FROM tag_changes c
+    WHERE c.op = 'delete'
+      AND c.tag_id NOT IN (SELECT tag_id FROM tags)
+      AND c.seq = (SELECT MAX(seq) FROM tag_changes WHERE tag_id = c.tag_id)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS rollup_state (
+        name TEXT PRIMARY KEY,
+        high_water INTEGER NOT NULL         -- 足し込み済みの usage_event.id の最大値
+    )
+    """,
+)
+
+_LOCAL = "datetime(ts_ms / 1000, 'unixepoch', 'localtime')"
+
+SQL_ROLLUP_DAILY = f"""
+    INSERT INTO usage_rollup_daily (day, tag_id, event_type, events, duration_sec)
+    SELECT date({_LOCAL}), tag_id, event_type, COUNT(*), COALESCE(SUM(duration_sec), 0)
+    FROM usage_event WHERE id > ? AND id <= ?
+    GROUP BY 1, 2, 3
+    ON CONFLICT (day, tag_id, event_type) DO UPDATE SET
+        events = events + excluded.events,
+        duration_sec = duration_sec + excluded.duration_sec
+"""
+
+SQL_ROLLUP_HOURLY = f"""
+    INSERT INTO usage_rollup_hourly (day, hour, tag_id, event_type, events, duration_sec)
+    SELECT date({_LOCAL}), CAST(strftime('%H', {_LOCAL}) AS INTEGER), tag_id, event_type,
+           COUNT(*), COALESCE(SUM(duration_sec), 0)
+    FROM usage_event WHERE id > ? AND id <= ?
+    GROUP BY 1, 2, 3, 4
+    ON CONFLICT (day, hour, tag_id, event_type) DO UPDATE SET
+        events = events + excluded.events,
+        duration_sec = duration_sec + excluded.duration_sec
+"""
+
+SQL_HIGH_WATER = "SELECT high_water FROM rollup_state WHERE name = ?"
+SQL_SET_HIGH_WATER = (
+    "INSERT INTO rollup_state (name, high_water) VALUES (?, ?) "
+    "ON CONFLICT (name) DO UPDATE SET high_water = excluded.high_water"
+)
+
+# 種別ごとの件数を横に並べる
+_MEASURES = """
+    SUM(CASE WHEN event_type = 'present_return' THEN events ELSE 0 END) AS uses,
+    SUM(CASE WHEN event_type = 'present_return' THEN duration_sec ELSE 0 END) AS duration_sec,
+    SUM(CASE WHEN event_type = 'absent_start' THEN events ELSE 0 END) AS absences,
+    SUM(CASE WHEN event_type = 'lip_trigger' THEN events ELSE 0 END) AS lip_triggers,
+    SUM(CASE WHEN event_type = 'legacy_log' THEN events ELSE 0 END) AS legacy_logs
+"""
+_MEASURE_KEYS = ("uses", "duration_sec", "absences", "lip_triggers", "legacy_logs")
+_SUM_MEASURES = ", ".join(f"SUM({key})" for key in _MEASURE_KEYS)
+
+# 先にタグ単位まで集計してから名前・カテゴリ（tag_labels ビュー）を引く
+_PER_TAG = f"""
+    SELECT tag_id, {_MEASURES}
+    FROM usage_rollup_daily
+    WHERE day BETWEEN ? AND ?
+    GROUP BY tag_id
+"""
+
+SQL_STATS_BY_TAG = f"""
+    SELECT r.tag_id, l.name, COALESCE(l.category, ''), r.{", r.".join(_MEASURE_KEYS)}
+    FROM ({_PER_TAG}) r LEFT JOIN tag_labels l ON l.tag_id = r.tag_id
+    ORDER BY r.uses DESC, r.tag_id
+"""
+
+SQL_STATS_BY_CATEGORY = f"""
+    SELECT COALESCE(l.category, '') AS label, COUNT(*), {_SUM_MEASURES}
+    FROM ({_PER_TAG}) r LEFT JOIN tag_labels l ON l.tag_id = r.tag_id
+    GROUP BY label
+    ORDER BY 3 DESC, label
+"""
+
+SQL_STATS_DAILY = f"""
+    SELECT day, {_MEASURES}
+    FROM usage_rollup_daily
+    WHERE day BETWEEN ? AND ? {{where}}
+    GROUP BY day
+    ORDER BY day
+"""
+
+SQL_STATS_HOURLY = f"""
+    SELECT hour, {_MEASURES}
+    FROM usage_rollup_hourly
+    WHERE day = ? {{where}}
+    GROUP BY hour
+    ORDER BY hour
+"""
+
+
+def create_rollup_tables(conn):
+    for ddl in ROLLUP_DDL:
+        conn.execute(ddl)
+
+
+def high_water(conn):
+    row = conn.execute(SQL_HIGH_WATER, (ROLLUP_NAME,)).fetchone()
+    return row[0] if row else 0
+
+
+def refresh(conn, chunk=REFRESH_CHUNK):
+    """
+    high_water より後の usage_event をロールアップに足し込む。足し込んだ行数を返す。
+    chunk 行ごとにコミットするので、初回（既存の履歴すべて）でも書き込みロックを長く握らない。
+    high_water はロックを取ってから読むので、複数プロセスから呼んでも二重に足さない。
+    """
+    if conn.in_transaction:
+        conn.commit()
+    done = 0
+    end = conn.execute("SELECT COALESCE(MAX(id), 0) FROM usage_event").fetchone()[0]
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            start = high_water(conn)
+            if start >= end:
+                conn.rollback()
+                return done
+            stop = min(start + chunk, end)
+            conn.execute(SQL_ROLLUP_DAILY, (start, stop))
+            conn.execute(SQL_ROLLUP_HOURLY, (start, stop))
+            conn.execute(SQL_SET_HIGH_WATER, (ROLLUP_NAME, stop))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        done += stop - start
+
+
+def _measures(row):
+    return {key: row[i] or 0 for i, key in enumerate(_MEASURE_KEYS)}
+
+
+def _filters(tag_id, category):
+    where, params = [], []
+    if tag_id:
+        where.append("AND tag_id = ?")
+        params.append(tag_id)
+    if category:
+        where.append("AND tag_id IN (SELECT tag_id FROM tag_labels WHERE category = ?)")
+        params.append(category)
+    return " ".join(where), params
+
+
+def stats_by_tag(conn, day_from, day_to):
+    return [
+        {"tag_id": r[0], "name": r[1], "category": r[2], **_measures(r[3:])}
+        for r in conn.execute(SQL_STATS_BY_TAG, (day_from, day_to))
+    ]
+
+
+def stats_by_category(conn, day_from, day_to):
+    return [
+        {"category": r[0], "tags": r[1], **_measures(r[2:])}
+        for r in conn.execute(SQL_STATS_BY_CATEGORY, (day_from, day_to))
+    ]
+
+
+def stats_daily(conn, day_from, day_to, tag_id=None, category=None):
+    where, params = _filters(tag_id, category)
+    return [
+        {"day": r[0], **_measures(r[1:])}
+        for r in conn.execute(SQL_STATS_DAILY.format(where=where), (day_from, day_to, *params))
+    ]
+
+
+def stats_hourly(conn, day, tag_id=None, category=None):
+    where, params = _filters(tag_id, category)
+    return [
+        {"hour": r[0], **_measures(r[1:])}
+        for r in conn.execute(SQL_STATS_HOURLY.format(where=where), (day, *params))
+    ]
+
+
+class RollupRefresher:
+    """
+    /stats の読み出し前に呼ぶ。同時に来たリクエストで二重に足し込まないよう直列化し、
+    min_interval 秒以内の再呼び出しは何もしない（ダッシュボードの連続読み込み対策）。
+    """
+
+    def __init__(self, min_interval=1.0):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._last = None
+
+    def __call__(self, pool, now):
+        with self._lock:
+            if self._last is not None and now - self._last < self.min_interval:
+                return 0
+            with pool.connection() as conn:
+                done = refresh(conn)
+            self._last = now
+            return done
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+rfid.db のスキーマとマイグレーション。
+
+PRAGMA user_version にスキーマのバージョンを持ち、起動時に足りない分だけ順に適用する。
+全体を1つの BEGIN IMMEDIATE で行うので、途中で落ちても古いスキーマのまま残り、
+複数プロセスが同時に起動しても適用は1回だけになる。
+
+  v1: tags と変更ログ（tag_changes + トリガ）
+  v2: usage_event を型付きの形に作り直す
+      - 時刻は ts_ms（UNIXエポックのミリ秒, INTEGER）
+      - name / category は持たず tag_id で tags を引く（削除済みタグは変更ログの墓石から）
+      - (tag_id, ts_ms) と (event_type, ts_ms) のカバリングインデックス
+      - 旧 usage_event（TEXT timestamp）と旧 usage_log の行を移す
+        （usage_log の行は event_type='legacy_log'）
+  v3: 日別・時間別のロールアップ（rollups.py）と high_water
+  v4: 褒めメッセージの共有（feedback_message。複数ワーカーで /feedback を揃える）
+  v5: 登録画面の検索（tags_fts。FTS5 の trigram 索引）と created_at の索引（tag_search.py）
+"""
+from feedback_bus import create_feedback_table
+from rollups import create_rollup_tables
+from tag_registry import create_change_log
+from tag_search import create_search_index
+
+SCHEMA_VERSION = 5
+
+# 名前・カテゴリ付きで usage_event を読むときはこのビューを使う
+USAGE_EVENT_VIEW = "usage_event_named"
+LEGACY_EVENT_TYPE = "legacy_log"
+
+# 旧スキーマの TEXT（ローカル時刻 'YYYY-MM-DD HH:MM:SS'）-> エポックミリ秒
+# 解釈できない値は 0 にする（行は落とさない）
+_TEXT_TO_MS = "COALESCE(CAST(strftime('%s', {col}, 'utc') AS INTEGER) * 1000, 0)"
+
+USAGE_EVENT_DDL = """
+    CREATE TABLE IF NOT EXISTS usage_event (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tag_id TEXT NOT NULL,               -- tags.tag_id（削除済みでも行は残す）
+        event_type TEXT NOT NULL,           -- 'absent_start' | 'present_return' | 'lip_trigger' | 'legacy_log'
+        ts_ms INTEGER NOT NULL,             -- UNIXエポック（ミリ秒）
+        duration_sec INTEGER,               -- present_return 時に入る
+        event_key TEXT                      -- リーダー再送の重複排除キー
+    )
+"""
+
+USAGE_EVENT_INDEXES = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_usage_event_key ON usage_event(event_key)",
+    # タグ別・期間指定の集計（event_type まで含めてテーブルを読まずに済ませる）
+    "CREATE INDEX IF NOT EXISTS idx_usage_event_tag_ts ON usage_event(tag_id, ts_ms, event_type)",
+    # 種別・期間指定の集計（カテゴリ別は tag_id から tags を引く）
+    "CREATE INDEX IF NOT EXISTS idx_usage_event_type_ts ON usage_event(event_type, ts_ms, tag_id)",
+)
+
+USAGE_EVENT_VIEW_DDL = f"""
+    CREATE VIEW IF NOT EXISTS {USAGE_EVENT_VIEW} AS
+    SELECT e.id, e.tag_id,
+           COALESCE(t.name, c.name) AS name,
+           COALESCE(t.category, c.category) AS category,
+           e.event_type, e.ts_ms,
+           datetime(e.ts_ms / 1000, 'unixepoch', 'localtime') AS timestamp,
+           e.duration_sec, e.event_key
+    FROM usage_event e
+    LEFT JOIN tags t ON t.tag_id = e.tag_id
+    LEFT JOIN tag_changes c
+           ON t.tag_id IS NULL
+          AND c.seq = (SELECT MAX(seq) FROM tag_changes WHERE tag_id = e.tag_id)
+"""
+
+
+def _columns(conn, table):
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _table_exists(conn, table):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone() is not None
+
+
+def _v1_tags(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tags (
+            tag_id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            category TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+    if "created_at" not in _columns(conn, "tags"):
+        conn.execute("ALTER TABLE tags ADD COLUMN created_at TEXT")
+    create_change_log(conn)
+
+
+def _v2_typed_usage_event(conn):
+    legacy = _table_exists(conn, "usage_event") and "timestamp" in _columns(conn, "usage_event")
+    if legacy:
+        conn.execute("ALTER TABLE usage_event RENAME TO usage_event_v1")
+    conn.execute(USAGE_EVENT_DDL)
+
+    if legacy:
+        has_key = "event_key" in _columns(conn, "usage_event_v1")
+        conn.execute(
+            "INSERT INTO usage_event (id, tag_id, event_type, ts_ms, duration_sec, event_key) "
+            f"SELECT id, tag_id, event_type, {_TEXT_TO_MS.format(col='timestamp')}, duration_sec, "
+            f"{'event_key' if has_key else 'NULL'} FROM usage_event_v1 ORDER BY id"
+        )
+        # 台帳にも変更ログにも無いタグ（変更ログ導入前に削除されたもの）は、
+        # イベントに残っていた最後の名前・カテゴリを墓石として残す
+        conn.execute("""
+            INSERT INTO tag_changes (tag_id, op, name, category, changed_at)
+            SELECT v.tag_id, 'delete', v.name, v.category, datetime('now', 'localtime')
+            FROM usage_event_v1 v
+            WHERE v.id IN (SELECT MAX(id) FROM usage_event_v1 GROUP BY tag_id)
+              AND v.tag_id NOT IN (SELECT tag_id FROM tags)
+              AND v.tag_id NOT IN (SELECT tag_id FROM tag_changes)
+        """)
+        conn.execute("DROP TABLE usage_event_v1")
+
+    if _table_exists(conn, "usage_log"):
+        conn.execute(
+            "INSERT OR IGNORE INTO usage_event (tag_id, event_type, ts_ms, duration_sec, event_key) "
+            f"SELECT tag_id, '{LEGACY_EVENT_TYPE}', {_TEXT_TO_MS.format(col='timestamp')}, NULL, "
+            "'usage_log:' || id FROM usage_log WHERE tag_id IS NOT NULL ORDER BY id"
+        )
+        conn.execute("DROP TABLE usage_log")
+
+    for ddl in USAGE_EVENT_INDEXES:
+        conn.execute(ddl)
+    conn.execute(USAGE_EVENT_VIEW_DDL)
+
+
+MIGRATIONS = (
+    (1, _v1_tags),
+    (2, _v2_typed_usage_event),
+    (3, create_rollup_tables),
+    (4, create_feedback_table),
+    (5, create_search_index),
+)
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    足りないマイグレーションを適用する。戻り値: (適用前のバージョン, 適用後のバージョン)
+    """
+    current = schema_version(conn)
+    if current >= SCHEMA_VERSION:
+        return current, current
+
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # ロックを取るまでに別プロセスが適用しているかもしれない
+        before = schema_version(conn)
+        for version, step in MIGRATIONS:
+            if version > before:
+                step(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return before, max(before, SCHEMA_VERSION)
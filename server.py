@@ -1,245 +1,658 @@
 #!/usr/bin/env python3
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, g, request, jsonify, redirect, render_template, stream_with_context, url_for
 from flask_cors import CORS
+import fcntl
+import logging
+import os
 import sqlite3
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
-import re
+
+from db import ConnectionPool
+import export
+import logsetup
+import metrics
+import retention
+from feedback_bus import FeedbackBroker, FeedbackStore
+import rollups
+from schema import SCHEMA_VERSION, migrate
+from tag_registry import TagRegistry, changes_since, compact_change_log
+import tag_import
+import tag_search
+# タグ仕様（E218/E280両対応）はリーダー・登録ツールと共通
+from tag_rules import is_valid_tag, normalize_tag
 
 # ======================
 # パス
 # ======================
 BASE_DIR = Path(__file__).resolve().parent
-DB_PATH = BASE_DIR / "rfid.db"
+DB_PATH = Path(os.environ.get("RFID_DB_PATH", BASE_DIR / "rfid.db"))
 
-# ======================
-# タグ仕様（E218/E280両対応）
-# ======================
-TAG_PREFIXES = ("E218", "E280")
-VALID_TAG_LENGTHS = {22, 23}
-TAG_ALLOWED_RE = re.compile(r"^[0-9A-F]+$")
-
-def normalize_tag(tag: str) -> str:
-    if tag is None:
-        return ""
-    t = tag.strip().upper()
-    t = "".join(ch for ch in t if ch.isalnum()).upper()
-    return t
-
-def is_valid_tag(tag: str) -> bool:
-    if not tag:
-        return False
-    if not tag.startswith(TAG_PREFIXES):
-        return False
-    if len(tag) not in VALID_TAG_LENGTHS:
-        return False
-    if not TAG_ALLOWED_RE.match(tag):
-        return False
-    return True
+# 全ルートで共有する接続プール（起動時に1度だけ作る）
+pool = ConnectionPool(DB_PATH)
+
+# 1なら、リーダーのループをこのプロセスの中で動かす（embedded.py。HTTP を通さずDBへ直接書く）
+EMBEDDED_READER = os.environ.get("RFID_EMBEDDED_READER", "0") == "1"
+
+# tagsテーブルのキャッシュ（書き込み時に invalidate する）
+tag_registry = TagRegistry()
 
 app = Flask(__name__, template_folder=str(BASE_DIR / "templates"))
 CORS(app)
 
-latest_feedback_message = ""
-latest_feedback_image = ""
+# /stats 用のロールアップ（読み出し前に新しい usage_event だけを足し込む）
+refresh_rollups = rollups.RollupRefresher()
+
+# 最新の褒めメッセージ（/feedback と /feedback/stream で共有）
+# DBに置くので、複数のワーカープロセスで動かしても同じメッセージが返る
+feedback = FeedbackBroker(FeedbackStore(pool))
+
+log = logging.getLogger("rfid.server")
+
+# ======================
+# メトリクス（/metrics。DBの execute/commit 時間は db.py 側で記録）
+# ======================
+HTTP_REQUESTS = metrics.Counter("rfid_http_requests_total", "HTTP requests", ["method", "route", "status"])
+HTTP_SECONDS = metrics.Histogram("rfid_http_request_seconds", "time to response headers", ["method", "route"])
+USAGE_EVENTS = metrics.Counter("rfid_usage_events_total", "usage_event received", ["result"])
+SSE_SUBSCRIBERS = metrics.Gauge("rfid_feedback_subscribers", "connected /feedback/stream clients")
+SSE_SUBSCRIBERS.set_function(lambda: feedback.subscribers)
+
+# ======================
+# SQL（定数にしておくと接続ごとのステートメントキャッシュに乗る）
+# ======================
+SQL_INSERT_TAG = "INSERT INTO tags (tag_id, name, category, created_at) VALUES (?, ?, ?, ?)"
+SQL_DELETE_TAG = "DELETE FROM tags WHERE tag_id = ?"
+SQL_INSERT_USAGE_EVENT = (
+    "INSERT OR IGNORE INTO usage_event (tag_id, event_type, ts_ms, duration_sec, event_key) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+EVENT_KEY_COL = 4   # parse_usage_event が返す行での event_key の位置
 
 def init_db():
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(DB_PATH))
-    c = conn.cursor()
-
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS tags (
-            tag_id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            category TEXT NOT NULL,
-            created_at TEXT NOT NULL
-        )
-    ''')
-
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS usage_event (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            tag_id TEXT NOT NULL,
-            name TEXT NOT NULL,
-            category TEXT NOT NULL,
-            event_type TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            duration_sec INTEGER
-        )
-    ''')
+    with pool.connection() as conn:
+        before, after = _create_tables(conn)
+    if before != after:
+        log.info("[DB] スキーマを v%s から v%s に更新しました", before, after)
+    log.info("[DB] 初期化完了: %s (WAL, pool=%s, schema=v%s)", DB_PATH, pool.size, SCHEMA_VERSION)
+
+def _create_tables(conn):
+    # テーブル・インデックスは schema.py のマイグレーションで作る（PRAGMA user_version で管理）
+    before, after = migrate(conn)
 
+    # 差分同期用の変更ログは起動のたびに詰める
+    compact_change_log(conn)
     conn.commit()
-    conn.close()
-    print(f"[DB] 初期化完了: {DB_PATH}")
+
+    # 既存の履歴をロールアップに反映しておく（2回目以降は新しい行だけ）
+    added = rollups.refresh(conn)
+    if added:
+        log.info("[DB] ロールアップに %s 件を反映しました", added)
+    return before, after
+
+# ======================
+# リクエストの計測
+# ======================
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _record_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        # ラベルはURLではなくルールにする（/stats?... やタグIDで種類が増えないように）
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        HTTP_SECONDS.labels(request.method, route).observe(time.perf_counter() - started)
+        HTTP_REQUESTS.labels(request.method, route, response.status_code).inc()
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Prometheus のテキスト形式"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route("/register", methods=["POST"])
 def register_tag():
-    data = request.json or {}
-    tag_id = normalize_tag(data.get("tag_id", ""))
-    name = (data.get("name") or "").strip()
-    category = (data.get("category") or "").strip()
-
-    if not (tag_id and name and category):
-        return jsonify({"error": "tag_id, name, categoryが必要です"}), 400
-    if any(re.search(r"\s", field) for field in [tag_id, name, category]):
-        return jsonify({"error": "空白文字は含めないでください"}), 400
-    if not is_valid_tag(tag_id):
-        return jsonify({"error": f"tag_idが不正です（prefix={TAG_PREFIXES}, len={sorted(VALID_TAG_LENGTHS)}）"}), 400
+    row, error = tag_import.parse_tag(request.json or {})
+    if error:
+        return jsonify({"error": error}), 400
 
     try:
-        conn = sqlite3.connect(str(DB_PATH))
-        c = conn.cursor()
-        c.execute(
-            "INSERT INTO tags (tag_id, name, category, created_at) VALUES (?, ?, ?, ?)",
-            (tag_id, name, category, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-        )
-        conn.commit()
+        with pool.connection() as conn:
+            conn.execute(SQL_INSERT_TAG, (*row, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            conn.commit()
+        tag_registry.invalidate()
         return jsonify({"status": "registered"})
     except sqlite3.IntegrityError:
         return jsonify({"status": "already_registered"})
-    except Exception as e:
-        print("[ERROR] register:", e)
+    except Exception:
+        log.exception("[ERROR] /register")
+        return jsonify({"error": "internal server error"}), 500
+
+@app.route("/register/bulk", methods=["POST"])
+def register_bulk():
+    """
+    タグをまとめて登録・更新する（tag_import.py の CLI や read_single_tag.py --scan から）。
+    body: {"tags": [{"tag_id", "name", "category"}, ...]}、その配列そのもの、
+          text/csv（tag_id,name,category）、application/x-ndjson のいずれか。?dry_run=1 なら判定だけ
+    results[i] は i 行目の結果（created / updated / unchanged / error）。正しい行だけを1トランザクションで保存する。
+    """
+    content_type = request.mimetype or ""
+    if content_type == "application/json":
+        data = request.get_json(silent=True)
+        items = data.get("tags") if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            return jsonify({"error": "tagsの配列が必要です"}), 400
+    else:
+        items = tag_import.read_items(request.get_data(as_text=True), tag_import.detect_format(content_type=content_type))
+    if len(items) > tag_import.MAX_BULK_TAGS:
+        return jsonify({"error": f"1回に送れるのは{tag_import.MAX_BULK_TAGS}件までです"}), 413
+    dry_run = request.args.get("dry_run", "0") not in ("0", "")
+
+    try:
+        with pool.connection() as conn:
+            results = tag_import.import_tags(conn, items, dry_run)
+    except Exception:
+        log.exception("[ERROR] /register/bulk")
         return jsonify({"error": "internal server error"}), 500
-    finally:
-        try: conn.close()
-        except Exception: pass
+    counts = tag_import.summarize(results)
+    if not dry_run and (counts["created"] or counts["updated"]):
+        tag_registry.invalidate()
+    return jsonify({"status": "ok", "dry_run": dry_run, **counts, "results": results})
 
 @app.route("/tags", methods=["GET"])
 def get_tags():
+    """
+    台帳はキャッシュから返す。If-None-Match が現在のETagと一致すれば304。
+    """
     try:
-        conn = sqlite3.connect(str(DB_PATH))
-        c = conn.cursor()
-        c.execute("SELECT tag_id, name, category FROM tags ORDER BY created_at DESC")
-        rows = c.fetchall()
-        return jsonify([{"tag_id": r[0], "name": r[1], "category": r[2]} for r in rows])
-    except Exception as e:
-        print("[ERROR] /tags:", e)
+        _, body, etag = tag_registry.snapshot(pool)
+    except Exception:
+        log.exception("[ERROR] /tags")
         return jsonify({"error": "internal server error"}), 500
-    finally:
-        try: conn.close()
-        except Exception: pass
 
-@app.route("/usage-event", methods=["POST"])
-def usage_event():
-    data = request.json or {}
-    tag_id = normalize_tag(data.get("tag_id", ""))
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+@app.route("/tags/search", methods=["GET"])
+def search_tags():
+    """
+    登録画面の一覧用。?q=検索語（空白区切りで AND） &after=前のページの next &limit=
+    {"rows": [{"tag_id", "name", "category", "created_at"}], "next": 続きのカーソル（無ければ null）}
+    """
+    try:
+        limit = int(request.args.get("limit") or tag_search.PAGE_SIZE)
+        with pool.connection() as conn:
+            rows, next_cursor = tag_search.search_tags(conn, request.args.get("q", ""),
+                                                       request.args.get("after"), limit)
+    except ValueError:
+        return jsonify({"error": "limitは整数、afterは前の応答の next を指定してください"}), 400
+    except Exception:
+        log.exception("[ERROR] /tags/search")
+        return jsonify({"error": "internal server error"}), 500
+    columns = ("tag_id", "name", "category", "created_at")
+    return jsonify({"rows": [dict(zip(columns, r)) for r in rows], "next": next_cursor})
+
+@app.route("/tags/changes", methods=["GET"])
+def get_tag_changes():
+    """
+    ?since=<version> 以降に追加・更新・削除されたタグだけを返す。
+    {"version": 最新バージョン, "full": 全件かどうか, "changes": [{"tag_id", "op", "name", "category"}]}
+    """
+    try:
+        since = int(request.args.get("since", "0"))
+    except ValueError:
+        return jsonify({"error": "sinceは整数で指定してください"}), 400
+
+    try:
+        with pool.connection() as conn:
+            version, full, changes = changes_since(conn, since)
+        return jsonify({"version": version, "full": full, "changes": changes})
+    except Exception:
+        log.exception("[ERROR] /tags/changes")
+        return jsonify({"error": "internal server error"}), 500
+
+USAGE_EVENT_TYPES = ("absent_start", "present_return", "lip_trigger")
+MAX_BATCH_EVENTS = 1000
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+USAGE_EVENT_STR_FIELDS = ("tag_id", "name", "category", "event_type", "timestamp", "event_key")
+SQLITE_INT_MAX = 2 ** 63 - 1
+
+def _non_negative_int(value, strict=False):
+    """
+    0 以上で SQLite の INTEGER（64bit）に収まる整数にする。収まらなければ None。
+    strict=False なら従来どおり "12" や 12.0 も int() で受け付ける（bool は受け付けない）
+    """
+    if isinstance(value, bool) or (strict and not isinstance(value, int)):
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return value if 0 <= value <= SQLITE_INT_MAX else None
+
+def parse_usage_event(data):
+    """
+    usage_event 1件分の入力を検証し、INSERT用のタプルを返す。
+    戻り値: (row, None) もしくは (None, エラーメッセージ)
+    timestamp（'YYYY-MM-DD HH:MM:SS' ローカル時刻）か ts_ms（エポックミリ秒）は
+    リーダー側でバッファされた場合に送られてくる（無ければ受信時刻）。
+    event_key は再送時の重複排除用（同じキーの2件目以降は無視される）。
+    name / category は保存しない（tag_id から台帳を引く）。
+    """
+    if not isinstance(data, dict):
+        return None, "event must be an object"
+    # 型の違う値は、そのイベントだけのエラーにする（バッチ全体を 500 にしない）
+    for field in USAGE_EVENT_STR_FIELDS:
+        value = data.get(field)
+        if value is not None and not isinstance(value, str):
+            return None, f"{field} must be a string"
+    tag_id = normalize_tag(data.get("tag_id") or "")
     name = (data.get("name") or "").strip()
     category = (data.get("category") or "").strip()
     event_type = (data.get("event_type") or "").strip()
     duration_sec = data.get("duration_sec", None)
+    ts = (data.get("timestamp") or "").strip()
+    ts_ms = data.get("ts_ms", None)
+    event_key = (data.get("event_key") or "").strip() or None
 
     if not (tag_id and name and category and event_type):
-        return jsonify({"error": "tag_id, name, category, event_typeが必要です"}), 400
+        return None, "tag_id, name, category, event_typeが必要です"
     if not is_valid_tag(tag_id):
-        return jsonify({"error": "invalid tag_id"}), 400
-    if event_type not in ("absent_start", "present_return", "lip_trigger"):
-        return jsonify({"error": "invalid event_type"}), 400
+        return None, "invalid tag_id"
+    if event_type not in USAGE_EVENT_TYPES:
+        return None, "invalid event_type"
+    if duration_sec is not None:
+        duration_sec = _non_negative_int(duration_sec)
+        if duration_sec is None:
+            return None, "invalid duration_sec"
+    if ts_ms is not None:
+        ts_ms = _non_negative_int(ts_ms, strict=True)
+        if ts_ms is None:
+            return None, "invalid ts_ms"
+    elif ts:
+        try:
+            ts_ms = int(datetime.strptime(ts, TS_FORMAT).timestamp() * 1000)
+        except ValueError:
+            return None, "invalid timestamp"
+    else:
+        ts_ms = int(time.time() * 1000)
 
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return (tag_id, event_type, ts_ms, duration_sec, event_key), None
+
+@app.route("/usage-event", methods=["POST"])
+def usage_event():
+    row, error = parse_usage_event(request.json or {})
+    if error:
+        USAGE_EVENTS.labels("error").inc()
+        return jsonify({"error": error}), 400
 
     try:
-        conn = sqlite3.connect(str(DB_PATH))
-        c = conn.cursor()
-        c.execute(
-            "INSERT INTO usage_event (tag_id, name, category, event_type, timestamp, duration_sec) VALUES (?, ?, ?, ?, ?, ?)",
-            (tag_id, name, category, event_type, ts, int(duration_sec) if duration_sec is not None else None)
-        )
-        conn.commit()
-        return jsonify({"status": "ok"})
-    except Exception as e:
-        print("[ERROR] /usage-event:", e)
+        with pool.connection() as conn:
+            cur = conn.execute(SQL_INSERT_USAGE_EVENT, row)
+            conn.commit()
+        status = "ok" if cur.rowcount else "duplicate"
+        USAGE_EVENTS.labels(status).inc()
+        return jsonify({"status": status})
+    except Exception:
+        log.exception("[ERROR] /usage-event")
+        return jsonify({"error": "internal server error"}), 500
+
+@app.route("/usage-events/batch", methods=["POST"])
+def usage_events_batch():
+    """
+    usage_event をまとめて登録する。
+    body: {"events": [...]} もしくは配列そのもの
+    1件ずつ検証し、正しいものだけを1トランザクション（executemany）で保存する。
+    results[i] は events[i] に対応する。登録済みの event_key は "duplicate"。
+    """
+    data = request.json
+    events = data.get("events") if isinstance(data, dict) else data
+    if not isinstance(events, list):
+        return jsonify({"error": "eventsの配列が必要です"}), 400
+    if len(events) > MAX_BATCH_EVENTS:
+        return jsonify({"error": f"1回に送れるのは{MAX_BATCH_EVENTS}件までです"}), 413
+
+    try:
+        accepted, duplicates, results = store_usage_events(events)
+    except Exception:
+        log.exception("[ERROR] /usage-events/batch")
         return jsonify({"error": "internal server error"}), 500
-    finally:
-        try: conn.close()
-        except Exception: pass
+    return jsonify({
+        "status": "ok",
+        "accepted": accepted,
+        "duplicates": duplicates,
+        "rejected": len(events) - accepted - duplicates,
+        "results": results,
+    })
+
+def store_usage_events(events):
+    """
+    usage_event を1件ずつ検証し、正しいものだけを1トランザクション（executemany）で保存する。
+    /usage-events/batch と組み込みリーダー（embedded.py）で共通。
+    戻り値: (保存した件数, 重複の件数, results)。results[i] は events[i] の結果。
+    """
+    rows = []
+    results = []
+    for ev in events:
+        row, error = parse_usage_event(ev)
+        if error:
+            results.append({"status": "error", "error": error})
+        else:
+            rows.append(row)
+            results.append({"status": "ok"})
+
+    if rows:
+        with pool.connection() as conn:
+            keys = [row[EVENT_KEY_COL] for row in rows if row[EVENT_KEY_COL]]
+            seen = set()
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                seen.update(r[0] for r in conn.execute(
+                    f"SELECT event_key FROM usage_event WHERE event_key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ))
+            conn.executemany(SQL_INSERT_USAGE_EVENT, rows)
+            conn.commit()
+
+        # 既に登録済み、または同じバッチ内で重複したキーは duplicate
+        it = iter(rows)
+        for res in results:
+            if res["status"] != "ok":
+                continue
+            key = next(it)[EVENT_KEY_COL]
+            if key is None:
+                continue
+            if key in seen:
+                res["status"] = "duplicate"
+            seen.add(key)
+
+    duplicates = sum(1 for res in results if res["status"] == "duplicate")
+    USAGE_EVENTS.labels("ok").inc(len(rows) - duplicates)
+    USAGE_EVENTS.labels("duplicate").inc(duplicates)
+    USAGE_EVENTS.labels("error").inc(len(events) - len(rows))
+    return len(rows) - duplicates, duplicates, results
+
+# ======================
+# 集計（ロールアップから返す）
+# ======================
+STATS_DEFAULT_DAYS = 30
+STATS_MAX_DAYS = 366
+DAY_FORMAT = "%Y-%m-%d"
+
+def _stats_range():
+    """?from=YYYY-MM-DD&to=YYYY-MM-DD（省略時は直近 STATS_DEFAULT_DAYS 日）。戻り値: (from, to, error)"""
+    try:
+        day_to = datetime.strptime(request.args["to"], DAY_FORMAT) if request.args.get("to") else datetime.now()
+        day_from = (datetime.strptime(request.args["from"], DAY_FORMAT) if request.args.get("from")
+                    else day_to - timedelta(days=STATS_DEFAULT_DAYS - 1))
+    except ValueError:
+        return None, None, "from/toは YYYY-MM-DD で指定してください"
+    if day_from > day_to:
+        return None, None, "fromはto以前の日付にしてください"
+    if (day_to - day_from).days >= STATS_MAX_DAYS:
+        return None, None, f"期間は{STATS_MAX_DAYS}日以内にしてください"
+    return day_from.strftime(DAY_FORMAT), day_to.strftime(DAY_FORMAT), None
+
+def _stats_response(name, query, **body):
+    try:
+        refresh_rollups(pool, time.monotonic())
+        with pool.connection() as conn:
+            rows = query(conn)
+        return jsonify({**body, "rows": rows})
+    except Exception:
+        log.exception("[ERROR] /stats/%s", name)
+        return jsonify({"error": "internal server error"}), 500
+
+@app.route("/stats/tags", methods=["GET"])
+def stats_tags():
+    """タグごとの使用回数（present_return）・使用時間の合計・離席回数・リップ判定回数"""
+    day_from, day_to, error = _stats_range()
+    if error:
+        return jsonify({"error": error}), 400
+    return _stats_response("tags", lambda conn: rollups.stats_by_tag(conn, day_from, day_to),
+                           **{"from": day_from, "to": day_to})
+
+@app.route("/stats/categories", methods=["GET"])
+def stats_categories():
+    day_from, day_to, error = _stats_range()
+    if error:
+        return jsonify({"error": error}), 400
+    return _stats_response("categories", lambda conn: rollups.stats_by_category(conn, day_from, day_to),
+                           **{"from": day_from, "to": day_to})
+
+@app.route("/stats/daily", methods=["GET"])
+def stats_daily():
+    """日別。?tag_id= / ?category= で絞り込める"""
+    day_from, day_to, error = _stats_range()
+    if error:
+        return jsonify({"error": error}), 400
+    tag_id = normalize_tag(request.args.get("tag_id", "")) or None
+    category = (request.args.get("category") or "").strip() or None
+    return _stats_response(
+        "daily", lambda conn: rollups.stats_daily(conn, day_from, day_to, tag_id, category),
+        **{"from": day_from, "to": day_to, "tag_id": tag_id, "category": category},
+    )
+
+@app.route("/stats/hourly", methods=["GET"])
+def stats_hourly():
+    """?date=YYYY-MM-DD（省略時は今日）の時間別。?tag_id= / ?category= で絞り込める"""
+    try:
+        day = datetime.strptime(request.args["date"], DAY_FORMAT) if request.args.get("date") else datetime.now()
+    except ValueError:
+        return jsonify({"error": "dateは YYYY-MM-DD で指定してください"}), 400
+    day = day.strftime(DAY_FORMAT)
+    tag_id = normalize_tag(request.args.get("tag_id", "")) or None
+    category = (request.args.get("category") or "").strip() or None
+    return _stats_response(
+        "hourly", lambda conn: rollups.stats_hourly(conn, day, tag_id, category),
+        date=day, tag_id=tag_id, category=category,
+    )
+
+# ======================
+# 書き出し
+# ======================
+@app.route("/export", methods=["GET"])
+def export_usage():
+    """
+    usage_event / tags をストリームで書き出す（chunked transfer）。
+    ?table=usage_event|tags &format=csv|ndjson|rfcol &from= &to= &tag_id=a,b &after_id= &header=0|1
+    接続が切れたら、受け取った最後の id を after_id に渡して続きから取れる。
+    """
+    table = request.args.get("table", "usage_event")
+    fmt = request.args.get("format", "csv")
+    if table not in export.TABLES:
+        return jsonify({"error": f"tableは{export.TABLES}のいずれかです"}), 400
+    if fmt not in export.FORMATS:
+        return jsonify({"error": f"formatは{export.FORMATS}のいずれかです"}), 400
+    try:
+        since_ms = export.parse_time_ms(request.args.get("from"))
+        until_ms = export.parse_time_ms(request.args.get("to"), end=True)
+        after_id = int(request.args.get("after_id") or 0)
+    except ValueError:
+        return jsonify({"error": "from/toは YYYY-MM-DD[ HH:MM:SS] かエポックミリ秒、after_idは整数で指定してください"}), 400
+    tag_ids = [normalize_tag(t) for t in (request.args.get("tag_id") or "").split(",") if t.strip()]
+    header = request.args.get("header", "1") != "0"
+
+    query = export.ExportQuery(table, since_ms, until_ms, tag_ids, after_id)
+    body = export.ENCODERS[fmt](query.chunks(pool.connection), query.columns, header=header)
+    filename = f"{table}-{datetime.now().strftime('%Y%m%d%H%M%S')}.{export.EXTENSIONS[fmt]}"
+    return Response(
+        stream_with_context(body),
+        mimetype=export.MIMETYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename={filename}", "Cache-Control": "no-store"},
+    )
 
 @app.route("/feedback", methods=["GET"])
 def get_feedback():
-    return jsonify({"message": latest_feedback_message or "", "image": latest_feedback_image or ""})
+    _, message, image, _ = feedback.latest()
+    return jsonify({"message": message, "image": image})
 
 @app.route("/feedback", methods=["POST"])
 def receive_feedback():
-    global latest_feedback_message, latest_feedback_image
     data = request.json or {}
-    latest_feedback_message = data.get("message", "") or ""
-    latest_feedback_image = data.get("image", "") or ""
+    feedback.publish(data.get("message", "") or "", data.get("image", "") or "")
     return jsonify({"status": "received"})
 
+@app.route("/feedback/stream")
+def stream_feedback():
+    """
+    Server-Sent Events で褒めメッセージを即時配信する。
+    /feedback へのPOST（リップ判定時の送信を含む）があった瞬間に event: feedback が届く。
+    """
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    return Response(
+        feedback.stream(last_event_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.route("/test-feedback")
 def test_feedback():
-    global latest_feedback_message, latest_feedback_image
-    latest_feedback_message = "今日も化粧してえらい！！"
-    latest_feedback_image = "/static/imgs/ikemenn.png"
-    return jsonify({"status": "ok", "message": latest_feedback_message})
+    message = "今日も化粧してえらい！！"
+    feedback.publish(message, "/static/imgs/ikemenn.png")
+    return jsonify({"status": "ok", "message": message})
 
 @app.route("/display")
 def show_display():
+    _, message, image, _ = feedback.latest()
     return render_template(
         "display.html",
-        latest_feedback_message=latest_feedback_message or "",
-        latest_feedback_image=latest_feedback_image or ""
+        latest_feedback_message=message,
+        latest_feedback_image=image
     )
 
 @app.route("/register-ui", methods=["GET", "POST"])
 def register_ui():
-    message = ""
+    """一覧は最初のページだけを描き、続きと検索はページ内から /tags/search で取る"""
+    message = request.args.get("message", "")
+    query = request.args.get("q", "")
     if request.method == "POST":
-        tag_id = normalize_tag(request.form.get("tag_id", ""))
-        name = (request.form.get("name", "") or "").strip()
-        category = (request.form.get("category", "") or "").strip()
-
-        if not (tag_id and name and category):
-            message = "すべての項目を入力してください。"
-        elif any(re.search(r"\s", field) for field in [tag_id, name, category]):
-            message = "各項目に空白文字を含めないでください。"
-        elif not is_valid_tag(tag_id):
-            message = f"タグIDが不正です（prefix={TAG_PREFIXES}, len={sorted(VALID_TAG_LENGTHS)}）"
+        # /register・/register/bulk と同じ検証
+        row, error = tag_import.parse_tag(request.form.to_dict())
+        if error:
+            message = error
         else:
             try:
-                conn = sqlite3.connect(str(DB_PATH))
-                c = conn.cursor()
-                c.execute(
-                    "INSERT INTO tags (tag_id, name, category, created_at) VALUES (?, ?, ?, ?)",
-                    (tag_id, name, category, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-                )
-                conn.commit()
-                message = f"タグ {tag_id} を登録しました。"
+                with pool.connection() as conn:
+                    conn.execute(SQL_INSERT_TAG, (*row, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+                    conn.commit()
+                tag_registry.invalidate()
+                message = f"タグ {row[0]} を登録しました。"
             except sqlite3.IntegrityError:
                 message = "このタグはすでに登録されています。"
             except Exception as e:
                 message = f"エラーが発生しました: {e}"
-            finally:
-                try: conn.close()
-                except Exception: pass
 
-    conn = sqlite3.connect(str(DB_PATH))
-    c = conn.cursor()
-    c.execute("SELECT tag_id, name, category, created_at FROM tags ORDER BY created_at DESC")
-    tags = c.fetchall()
-    conn.close()
-    return render_template("register.html", message=message, tags=tags)
+    with pool.connection() as conn:
+        tags, next_cursor = tag_search.search_tags(conn, query)
+    return render_template("register.html", message=message, tags=tags, next_cursor=next_cursor, q=query,
+                           page_size=tag_search.PAGE_SIZE)
 
 @app.route("/delete", methods=["POST"])
 def delete_tag():
+    """削除したら一覧へリダイレクトする（再読み込みで削除を送り直さない）"""
     tag_id = normalize_tag(request.form.get("tag_id", ""))
     if not tag_id:
-        return register_ui()
+        return redirect(url_for("register_ui"), code=303)
     try:
-        conn = sqlite3.connect(str(DB_PATH))
-        c = conn.cursor()
-        c.execute("DELETE FROM tags WHERE tag_id = ?", (tag_id,))
-        conn.commit()
-        return register_ui()
+        with pool.connection() as conn:
+            deleted = conn.execute(SQL_DELETE_TAG, (tag_id,)).rowcount
+            conn.commit()
+        tag_registry.invalidate()
     except Exception as e:
-        print("[ERROR] delete:", e)
+        log.exception("[ERROR] /delete")
         return f"削除中にエラーが発生しました: {e}", 500
-    finally:
-        try: conn.close()
-        except Exception: pass
+    message = f"タグ {tag_id} を削除しました。" if deleted else f"タグ {tag_id} は登録されていません。"
+    return redirect(url_for("register_ui", message=message, q=request.form.get("q") or None), code=303)
+
+# ======================
+# 起動（開発サーバ / WSGIサーバ共通）
+# ======================
+_initialized = False
+_jobs_on_request = False    # WSGI のワーカーではリクエストの前に担当を試みる
+_jobs_lock = None
+_jobs_tried = 0.0
+JOBS_RETRY_INTERVAL = 60.0  # ロックを取れなかったワーカーが取り直しを試みる間隔（担当が終了したときの引き継ぎ）
+
+def start_background_jobs():
+    """
+    retention のような1日1回の処理と組み込みリーダー（RFID_EMBEDDED_READER=1）は、
+    ワーカーがいくつあっても1プロセスだけで動かす。
+    DBの隣のロックファイルを先に取れたプロセスが担当する（プロセスが終われば外れる）。
+    スレッドは fork を越えられないので、ワーカーのプロセスの中で呼ぶ
+    （開発サーバは起動時、WSGI は gunicorn.conf.py の post_worker_init と各リクエストの前）。
+    """
+    global _jobs_lock, _jobs_tried
+    if (retention.RETENTION_DAYS <= 0 and not EMBEDDED_READER) or _jobs_lock is not None:
+        return
+    now = time.monotonic()
+    if _jobs_tried and now - _jobs_tried < JOBS_RETRY_INTERVAL:
+        return
+    _jobs_tried = now
+    lock = open(f"{DB_PATH}.jobs.lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return
+    _jobs_lock = lock
+    if retention.RETENTION_DAYS > 0:
+        # 古い生イベントの退避と VACUUM（毎日 retention.RUN_HOUR 時）
+        retention.RetentionScheduler(pool, retention.RetentionPolicy()).start()
+        log.info("[起動] retention を pid %s で実行します", os.getpid())
+    if EMBEDDED_READER:
+        import embedded
+        embedded.start_reader(pool, store_usage_events, feedback.publish)
+        log.info("[起動] 組み込みリーダーを pid %s で実行します", os.getpid())
+
+def _reset_background_jobs():
+    """fork された子はスレッドを持たないので、担当していない状態からやり直す"""
+    global _jobs_lock, _jobs_tried
+    _jobs_lock = None
+    _jobs_tried = 0.0
+
+os.register_at_fork(after_in_child=_reset_background_jobs)
+
+@app.before_request
+def _jobs_before_request():
+    if _jobs_on_request:
+        start_background_jobs()
+
+def create_app(multiprocess=True):
+    """
+    アプリファクトリ（wsgi.py から gunicorn / uvicorn 用に呼ぶ）。
+    DBの初期化（マイグレーション）はプロセスごとに1回だけ。--preload なら親で1回だけ行い、
+    複数ワーカーが同時に初期化しても migrate() が BEGIN IMMEDIATE で1回に揃える。
+    multiprocess=False（開発サーバ）なら、他プロセスの褒めメッセージを見に行くウォッチャーを動かさず、
+    バックグラウンドの処理もここで始める。multiprocess=True ではここでは始めない
+    （--preload だと親プロセスで呼ばれ、fork したワーカーにスレッドが引き継がれないため）。
+    """
+    global _initialized, _jobs_on_request
+    feedback.watch = multiprocess
+    if not _initialized:
+        init_db()
+        _initialized = True
+    _jobs_on_request = multiprocess
+    if not multiprocess:
+        start_background_jobs()
+    return app
 
 if __name__ == "__main__":
-    init_db()
-    print("[起動] Flaskサーバー: http://0.0.0.0:8000")
-    print("[パス] DB:", DB_PATH)
+    logsetup.setup()
+    create_app(multiprocess=False)
+    log.info("[起動] Flaskサーバー: http://0.0.0.0:8000")
+    log.info("[パス] DB: %s", DB_PATH)
     app.run(host="0.0.0.0", port=8000)
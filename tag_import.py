@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+タグ台帳の一括登録（/register/bulk と CLI、read_single_tag.py の連続読み取りで共通）。
+
+- 入力は (tag_id, name, category) の CSV（ヘッダ行は有っても無くても）か NDJSON
+- 1行ずつ /register と同じ規則（tag_rules）で検証し、正しい行だけを
+  1トランザクション（BEGIN IMMEDIATE + executemany）で upsert する
+- 結果は行ごとに created / updated / unchanged / error（入力と同じ順）。
+  同じ tag_id が2回出てきたら2回目以降は error（どちらを採るか黙って決めない）
+- 名前・カテゴリが同じ行は書き換えない（変更ログが増えず、リーダーの再同期も起きない）
+
+    python tag_import.py shelf.csv --server http://localhost:8000
+    python tag_import.py shelf.ndjson --db rfid.db --dry-run
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import sqlite3
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from tag_rules import TAG_PREFIXES, VALID_TAG_LENGTHS, is_valid_tag, normalize_tag
+
+COLUMNS = ("tag_id", "name", "category")
+FORMATS = ("csv", "ndjson")
+MAX_BULK_TAGS = 5000        # 1回のリクエストで受け付ける行数（CLI はこれずつ分けて送る）
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 名前・カテゴリが変わるときだけ UPDATE する（同じなら変更ログのトリガも動かない）
+SQL_UPSERT_TAG = """
+    INSERT INTO tags (tag_id, name, category, created_at) VALUES (?, ?, ?, ?)
+    ON CONFLICT(tag_id) DO UPDATE SET name = excluded.name, category = excluded.category
+    WHERE name <> excluded.name OR category <> excluded.category
+"""
+SQL_SELECT_EXISTING = "SELECT tag_id, name, category FROM tags WHERE tag_id IN ({})"
+IN_CHUNK = 500
+
+
+def parse_tag(data):
+    """
+    1行分の入力（dict）を検証する（/register と共通）。
+    戻り値: ((tag_id, name, category), None) もしくは (None, エラーメッセージ)
+    """
+    if not isinstance(data, dict):
+        return None, "行はオブジェクトで指定してください"
+    tag_id = normalize_tag(str(data.get("tag_id") or ""))
+    name = str(data.get("name") or "").strip()
+    category = str(data.get("category") or "").strip()
+    if not (tag_id and name and category):
+        return None, "tag_id, name, categoryが必要です"
+    if any(re.search(r"\s", field) for field in (tag_id, name, category)):
+        return None, "空白文字は含めないでください"
+    if not is_valid_tag(tag_id):
+        return None, f"tag_idが不正です（prefix={TAG_PREFIXES}, len={sorted(VALID_TAG_LENGTHS)}）"
+    return (tag_id, name, category), None
+
+
+def detect_format(name="", content_type=""):
+    """ファイル名か Content-Type から csv / ndjson を決める（既定 csv）"""
+    if "ndjson" in content_type or "jsonl" in content_type or name.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    return "csv"
+
+
+def read_items(text, fmt="csv"):
+    """
+    CSV / NDJSON の本文 -> dict のリスト。
+    CSV の1行目が tag_id,name,category ならヘッダとして読み飛ばし、それ以外は列の順で読む。
+    NDJSON の壊れた行は {"_error": ...} にして行ごとのエラーとして返す。
+    """
+    return read_items_with_lines(text, fmt)[0]
+
+
+def read_items_with_lines(text, fmt="csv"):
+    """read_items と同じ。加えて各 item が始まる元のファイルの行番号（1始まり）のリストを返す"""
+    text = text.lstrip("\ufeff")     # Excel の BOM 付き CSV
+    items, lines = [], []
+    if fmt == "ndjson":
+        for n, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append({"_error": f"JSONとして読めません: {e}"})
+            lines.append(n)
+        return items, lines
+    reader = csv.reader(io.StringIO(text))
+    start = 1
+    first = True
+    for row in reader:
+        # 引用符の中の改行で複数行にまたがる行もあるので、行の始まりを覚えておく
+        n, start = start, reader.line_num + 1
+        if not any(cell.strip() for cell in row):
+            continue
+        if first:
+            first = False
+            if [c.strip().lower() for c in row[:3]] == list(COLUMNS):
+                continue
+        items.append(dict(zip(COLUMNS, row)))
+        lines.append(n)
+    return items, lines
+
+
+def import_tags(conn, items, dry_run=False, now=None):
+    """
+    items（dict のリスト）を検証して1トランザクションで upsert する。
+    戻り値: 行ごとの結果のリスト [{"tag_id", "status", "error"?}]（items と同じ順）。
+    dry_run なら同じ判定だけして書き込まない。
+    """
+    created_at = (now or datetime.now()).strftime(TS_FORMAT)
+    results = []
+    rows = {}       # tag_id -> (tag_id, name, category)
+    for item in items:
+        error = item.get("_error") if isinstance(item, dict) else None
+        row = None
+        if error is None:
+            row, error = parse_tag(item)
+        if row is not None and row[0] in rows:
+            row, error = None, "同じtag_idが入力の中で重複しています"
+        if error:
+            tag_id = item.get("tag_id") if isinstance(item, dict) else None
+            results.append({"tag_id": tag_id, "status": "error", "error": error})
+            continue
+        rows[row[0]] = row
+        results.append({"tag_id": row[0], "status": None})
+    if not rows:
+        return results
+
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")     # 判定と書き込みの間に他から書かれないように
+    try:
+        ids = list(rows)
+        existing = {}
+        for i in range(0, len(ids), IN_CHUNK):
+            chunk = ids[i:i + IN_CHUNK]
+            for tag_id, name, category in conn.execute(SQL_SELECT_EXISTING.format(",".join("?" * len(chunk))), chunk):
+                existing[tag_id] = (tag_id, name, category)
+        changed = []
+        for res in results:
+            if res["status"] is not None:
+                continue
+            row = rows[res["tag_id"]]
+            old = existing.get(row[0])
+            if old is None:
+                res["status"] = "created"
+            elif old != row:
+                res["status"] = "updated"
+            else:
+                res["status"] = "unchanged"
+                continue
+            changed.append((*row, created_at))
+        if changed and not dry_run:
+            conn.executemany(SQL_UPSERT_TAG, changed)
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return results
+
+
+def summarize(results):
+    counts = {"created": 0, "updated": 0, "unchanged": 0, "error": 0}
+    for res in results:
+        counts[res["status"]] += 1
+    return counts
+
+
+def post_bulk(server, items, dry_run=False, timeout=30):
+    """items を MAX_BULK_TAGS ずつ /register/bulk に送り、行ごとの結果をつないで返す"""
+    import requests
+
+    results = []
+    for i in range(0, len(items), MAX_BULK_TAGS):
+        chunk = items[i:i + MAX_BULK_TAGS]
+        r = requests.post(f"{server}/register/bulk", params={"dry_run": "1"} if dry_run else None,
+                          json={"tags": chunk}, timeout=timeout)
+        r.raise_for_status()
+        results.extend(r.json()["results"])
+    return results
+
+
+def write_csv(path, items):
+    """read_single_tag.py の連続読み取りの結果を、このツールで読める CSV に書く"""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(COLUMNS)
+        for item in items:
+            w.writerow([item.get(c, "") for c in COLUMNS])
+
+
+def print_results(results, labels=None, out=sys.stdout):
+    """エラーの行を表示し、最後に件数をまとめる。labels[i] は results[i] の出どころ（ファイル:行）"""
+    for i, res in enumerate(results):
+        if res["status"] == "error":
+            where = labels[i] if labels else f"#{i + 1}"
+            print(f"❌ {where}: {res.get('tag_id') or ''} {res['error']}", file=out)
+    counts = summarize(results)
+    print(", ".join(f"{k} {v}" for k, v in counts.items()), file=out)
+    return counts
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="タグ台帳の一括登録（CSV / NDJSON の tag_id,name,category）")
+    ap.add_argument("inputs", nargs="+", help="CSV / NDJSON（- なら標準入力）")
+    ap.add_argument("--format", choices=FORMATS, help="省略時は拡張子から（既定 csv）")
+    ap.add_argument("--db", default=os.environ.get("RFID_DB_PATH", Path(__file__).resolve().parent / "rfid.db"))
+    ap.add_argument("--server", help="ローカルのDBではなくサーバの /register/bulk に送る（例 http://localhost:8000）")
+    ap.add_argument("--dry-run", action="store_true", help="検証と判定だけして登録しない")
+    ap.add_argument("--json", action="store_true", help="行ごとの結果をJSONで出力する")
+    args = ap.parse_args(argv)
+
+    items, labels = [], []
+    for path in args.inputs:
+        if path == "-":
+            text = sys.stdin.read()
+        else:
+            text = Path(path).read_text(encoding="utf-8")
+        fmt = args.format or detect_format(path)
+        rows, lines = read_items_with_lines(text, fmt)
+        items.extend(rows)
+        labels.extend(f"{path}:{n}" for n in lines)
+
+    if args.server:
+        results = post_bulk(args.server.rstrip("/"), items, args.dry_run)
+    else:
+        conn = sqlite3.connect(args.db, timeout=30)
+        try:
+            results = import_tags(conn, items, args.dry_run)
+        finally:
+            conn.close()
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        counts = summarize(results)
+    else:
+        counts = print_results(results, labels)
+        if args.dry_run:
+            print("（--dry-run のため登録していません）")
+    sys.exit(1 if counts["error"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+タグ台帳（tagsテーブル）のメモリキャッシュ。
+
+リーダーは CHECK_INTERVAL ごとに /tags を取りに来るが、台帳はほとんど変わらない。
+読み出しのたびに変更ログの最新 seq（MAX(seq) なので一瞬）だけを見て、
+変わったときだけ SELECT し直す。別のワーカープロセスが書き込んでも追いつける。
+同じプロセスの書き込み側（register / register-ui / delete）は invalidate() も呼ぶ。
+/tags のレスポンス本体と ETag もここで作って使い回す。ETag は本体のハッシュなので、
+どのワーカーが返しても同じ値になる。
+
+差分同期用に tag_changes（変更ログ）も持つ。tags への INSERT/UPDATE/DELETE を
+トリガで記録し、削除は op='delete' の墓石として残す。seq が台帳のバージョン。
+"""
+import hashlib
+import json
+import threading
+
+SQL_SELECT_ALL_TAGS = "SELECT tag_id, name, category, created_at FROM tags ORDER BY created_at DESC"
+SQL_CHANGE_LOG_VERSION = "SELECT COALESCE(MAX(seq), 0) FROM tag_changes"
+SQL_CHANGES_SINCE = """
+    SELECT c.seq, c.tag_id, c.op, c.name, c.category
+    FROM tag_changes c
+    WHERE c.seq > ? AND c.seq <= ?
+      AND c.seq = (SELECT MAX(seq) FROM tag_changes WHERE tag_id = c.tag_id)
+    ORDER BY c.seq
+"""
+
+CHANGE_LOG_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS tag_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tag_id TEXT NOT NULL,
+        op TEXT NOT NULL,             -- 'upsert' | 'delete'
+        name TEXT,
+        category TEXT,
+        changed_at TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_tag_changes_tag_seq ON tag_changes(tag_id, seq)",
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_tags_insert AFTER INSERT ON tags
+    BEGIN
+        INSERT INTO tag_changes (tag_id, op, name, category, changed_at)
+        VALUES (NEW.tag_id, 'upsert', NEW.name, NEW.category, datetime('now', 'localtime'));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_tags_update AFTER UPDATE ON tags
+    BEGIN
+        INSERT INTO tag_changes (tag_id, op, name, category, changed_at)
+        SELECT OLD.tag_id, 'delete', OLD.name, OLD.category, datetime('now', 'localtime')
+        WHERE OLD.tag_id <> NEW.tag_id;
+        INSERT INTO tag_changes (tag_id, op, name, category, changed_at)
+        VALUES (NEW.tag_id, 'upsert', NEW.name, NEW.category, datetime('now', 'localtime'));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_tags_delete AFTER DELETE ON tags
+    BEGIN
+        INSERT INTO tag_changes (tag_id, op, name, category, changed_at)
+        VALUES (OLD.tag_id, 'delete', OLD.name, OLD.category, datetime('now', 'localtime'));
+    END
+    """,
+)
+
+
+def create_change_log(conn):
+    for ddl in CHANGE_LOG_DDL:
+        conn.execute(ddl)
+    # 変更ログ導入前から登録済みのタグを1度だけ記録し、バージョンを0より進めておく
+    if conn.execute("SELECT 1 FROM tag_changes LIMIT 1").fetchone() is None:
+        conn.execute(
+            "INSERT INTO tag_changes (tag_id, op, name, category, changed_at) "
+            "SELECT tag_id, 'upsert', name, category, datetime('now', 'localtime') FROM tags ORDER BY created_at"
+        )
+
+
+def compact_change_log(conn):
+    """
+    同じタグについては最新の1行だけ残す（古い行は新しい行で必ず上書きされるので、
+    どの since から問い合わせても結果は変わらない）。墓石は残る。
+    """
+    cur = conn.execute(
+        "DELETE FROM tag_changes WHERE seq NOT IN (SELECT MAX(seq) FROM tag_changes GROUP BY tag_id)"
+    )
+    return cur.rowcount
+
+
+def changes_since(conn, since: int):
+    """
+    since より後の変更を返す: (version, full, changes)
+    since=0（初回）や、DBが作り直されて since が現在より新しい場合は
+    full=True で台帳全体を upsert として返す（受け手は一覧に無いタグを消す）。
+    """
+    version = conn.execute(SQL_CHANGE_LOG_VERSION).fetchone()[0]
+    if since <= 0 or since > version:
+        rows = conn.execute(SQL_SELECT_ALL_TAGS).fetchall()
+        changes = [{"tag_id": r[0], "op": "upsert", "name": r[1], "category": r[2]} for r in rows]
+        return version, True, changes
+    if since == version:
+        return version, False, []
+    rows = conn.execute(SQL_CHANGES_SINCE, (since, version)).fetchall()
+    changes = []
+    for _, tag_id, op, name, category in rows:
+        if op == "delete":
+            changes.append({"tag_id": tag_id, "op": "delete"})
+        else:
+            changes.append({"tag_id": tag_id, "op": "upsert", "name": name, "category": category})
+    return version, False, changes
+
+
+class TagRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = 0
+        self._loaded_version = None     # (変更ログの seq, self.version)
+        self._rows = []
+        self._body = b"[]"
+        self._etag = ""
+
+    def invalidate(self):
+        """台帳を書き換えた後（commit後）に呼ぶ"""
+        with self._lock:
+            self.version += 1
+
+    def _load(self, conn, version):
+        rows = conn.execute(SQL_SELECT_ALL_TAGS).fetchall()
+        self._rows = rows
+        self._body = json.dumps(
+            [{"tag_id": r[0], "name": r[1], "category": r[2]} for r in rows],
+            ensure_ascii=False,
+        ).encode("utf-8")
+        self._etag = f"tags-{hashlib.sha1(self._body).hexdigest()[:16]}"
+        self._loaded_version = version
+
+    def snapshot(self, pool):
+        """
+        (rows, body, etag) を返す。
+        rows は (tag_id, name, category, created_at) のタプル列（created_at降順）。
+        """
+        with self._lock, pool.connection() as conn:
+            version = (conn.execute(SQL_CHANGE_LOG_VERSION).fetchone()[0], self.version)
+            if self._loaded_version != version:
+                self._load(conn, version)
+            return self._rows, self._body, self._etag
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+タグIDの正規化と検証（サーバ・リーダー・登録ツールで共通）。
+
+- 正規化: 前後の空白を除いて大文字にし、英数字以外を取り除く。
+  ASCII の入力は、英数字だけなら upper() 1回、区切り文字などを含むときは
+  bytes.translate 1回（削除と大文字化を同時に行う表）で済ませる。
+  ASCII 以外を含むときだけ従来どおり1文字ずつ isalnum() で判定する
+- 検証: prefix と長さと16進数字を1つの正規表現（fullmatch）で判定する
+- canonical_tag(): 正規化 + 検証をまとめ、結果を LRU で覚える
+  （リーダーは同じタグを何度も読むので、2回目以降は辞書を引くだけ）
+
+prefix と長さは環境変数 RFID_TAG_PREFIXES="E218,E280" / RFID_TAG_LENGTHS="22,23" か、
+TagRules(prefixes, lengths) で変えられる。
+"""
+import os
+import re
+import string
+from functools import lru_cache
+
+DEFAULT_PREFIXES = ("E218", "E280")
+DEFAULT_LENGTHS = (22, 23)
+MEMO_SIZE = 4096
+
+# ASCII: 英小文字 -> 大文字、英数字以外は削除
+_ASCII_TABLE = bytes.maketrans(string.ascii_lowercase.encode(), string.ascii_uppercase.encode())
+_ASCII_DELETE = bytes(c for c in range(128) if not chr(c).isalnum())
+
+
+def _env_list(name, default, cast=str):
+    raw = os.environ.get(name, "")
+    items = [item.strip() for item in raw.split(",") if item.strip()]
+    return tuple(cast(item) for item in items) if items else default
+
+
+class TagRules:
+    def __init__(self, prefixes=DEFAULT_PREFIXES, lengths=DEFAULT_LENGTHS, memo_size=MEMO_SIZE):
+        self.prefixes = tuple(p.upper() for p in prefixes)
+        self.lengths = frozenset(lengths)
+        # prefix ごとに残りの桁数を並べる: (?:E218[0-9A-F]{18}|E218[0-9A-F]{19}|...)
+        alternatives = [
+            f"{re.escape(p)}[0-9A-F]{{{n - len(p)}}}"
+            for p in self.prefixes
+            for n in sorted(self.lengths)
+            if n >= len(p)
+        ]
+        self.pattern = re.compile("|".join(alternatives) or "(?!)")
+        self._fullmatch = self.pattern.fullmatch
+        self.canonical = lru_cache(maxsize=memo_size)(self._canonical) if memo_size else self._canonical
+
+    def normalize(self, tag):
+        if not tag:
+            return ""
+        if tag.isascii():
+            if tag.isalnum():
+                return tag.upper()
+            return tag.encode("ascii").translate(_ASCII_TABLE, _ASCII_DELETE).decode("ascii")
+        t = tag.strip().upper()
+        return "".join(ch for ch in t if ch.isalnum()).upper()
+
+    def is_valid(self, tag):
+        return bool(tag) and self._fullmatch(tag) is not None
+
+    def _canonical(self, raw):
+        """正規化して有効ならそのタグID、無効なら None"""
+        tag = self.normalize(raw)
+        return tag if self._fullmatch(tag) is not None else None
+
+    def describe(self):
+        return f"prefix={self.prefixes}, len={sorted(self.lengths)}"
+
+
+rules = TagRules(
+    _env_list("RFID_TAG_PREFIXES", DEFAULT_PREFIXES),
+    _env_list("RFID_TAG_LENGTHS", DEFAULT_LENGTHS, int),
+)
+
+TAG_PREFIXES = rules.prefixes
+VALID_TAG_LENGTHS = rules.lengths
+normalize_tag = rules.normalize
+is_valid_tag = rules.is_valid
+canonical_tag = rules.canonical
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+登録画面（/register-ui）用のタグ検索とページ送り。
+
+- 並びは登録の新しい順（created_at DESC, tag_id DESC）。ページ送りはキーセット方式で、
+  前のページの最後の行の (created_at, tag_id) をカーソルにして続きを読む
+  （OFFSET と違い、何ページ目でもインデックスをその位置から読むだけ）
+- 検索は tag_id / name / category の部分一致。語を空白で区切ると全部を含む行だけ
+- FTS5 の trigram 索引（tags_fts）があればそれを引く。trigram は3文字単位なので、
+  2文字以下の語を含む検索と、FTS5 の無い SQLite では LIKE で全件を見る
+
+tags_fts は tags を外部コンテンツとする索引で、tags への書き込みはトリガで反映する。
+"""
+import sqlite3
+
+PAGE_SIZE = 50
+PAGE_SIZE_MAX = 200
+FTS_TABLE = "tags_fts"
+TRIGRAM = 3     # trigram 索引で引ける語の最小の長さ
+
+# created_at が NULL の古い行も並べられるように、並びのキーは IFNULL で揃える
+_ORDER_KEY = "IFNULL(created_at, '')"
+
+CREATED_AT_INDEX_DDL = f"CREATE INDEX IF NOT EXISTS idx_tags_created ON tags({_ORDER_KEY}, tag_id)"
+
+FTS_DDL = (
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        tag_id, name, category, content='tags', content_rowid='rowid', tokenize='trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_tags_fts_insert AFTER INSERT ON tags
+    BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, tag_id, name, category)
+        VALUES (NEW.rowid, NEW.tag_id, NEW.name, NEW.category);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_tags_fts_update AFTER UPDATE ON tags
+    BEGIN
+        INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, tag_id, name, category)
+        VALUES ('delete', OLD.rowid, OLD.tag_id, OLD.name, OLD.category);
+        INSERT INTO {FTS_TABLE} (rowid, tag_id, name, category)
+        VALUES (NEW.rowid, NEW.tag_id, NEW.name, NEW.category);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_tags_fts_delete AFTER DELETE ON tags
+    BEGIN
+        INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, tag_id, name, category)
+        VALUES ('delete', OLD.rowid, OLD.tag_id, OLD.name, OLD.category);
+    END
+    """,
+    # 既存の行を索引に入れる
+    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')",
+)
+
+SQL_HAS_FTS = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+SQL_PAGE = (
+    f"SELECT tag_id, name, category, created_at FROM tags WHERE {{where}} "
+    f"ORDER BY {_ORDER_KEY} DESC, tag_id DESC LIMIT ?"
+)
+# (key, tag_id) < (?, ?) を展開した形（行値の比較だと式の索引で範囲検索にならない）
+SQL_AFTER_CURSOR = f"{_ORDER_KEY} <= ? AND ({_ORDER_KEY} < ? OR tag_id < ?)"
+SQL_FTS_FILTER = f"rowid IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?)"
+SQL_LIKE_FILTER = "(tag_id LIKE ? ESCAPE '\\' OR name LIKE ? ESCAPE '\\' OR category LIKE ? ESCAPE '\\')"
+
+
+def create_search_index(conn):
+    """v5 のマイグレーション。FTS5（trigram）が使えない SQLite では created_at の索引だけ作る"""
+    conn.execute(CREATED_AT_INDEX_DDL)
+    conn.execute("SAVEPOINT tags_fts")
+    try:
+        for ddl in FTS_DDL:
+            conn.execute(ddl)
+    except sqlite3.OperationalError:    # no such module: fts5 / no such tokenizer: trigram
+        conn.execute("ROLLBACK TO tags_fts")
+    conn.execute("RELEASE tags_fts")
+
+
+def has_fts(conn):
+    return conn.execute(SQL_HAS_FTS, (FTS_TABLE,)).fetchone() is not None
+
+
+def encode_cursor(row):
+    """行 (tag_id, name, category, created_at) -> 次のページのカーソル文字列"""
+    return f"{row[3] or ''}|{row[0]}"
+
+
+def decode_cursor(cursor):
+    """カーソル文字列 -> (created_at, tag_id)。壊れていれば ValueError"""
+    created_at, sep, tag_id = cursor.rpartition("|")
+    if not sep or not tag_id:
+        raise ValueError(f"invalid cursor: {cursor!r}")
+    return created_at, tag_id
+
+
+def _like_pattern(term):
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _filters(terms, fts):
+    """検索語 -> (WHERE の句のリスト, パラメータ)"""
+    if not terms:
+        return [], []
+    if fts and all(len(t) >= TRIGRAM for t in terms):
+        # 各語をフレーズとして引用し、AND でつなぐ（" は "" にエスケープ）
+        match = " AND ".join('"' + t.replace('"', '""') + '"' for t in terms)
+        return [SQL_FTS_FILTER], [match]
+    params = []
+    for t in terms:
+        params.extend([_like_pattern(t)] * 3)
+    return [SQL_LIKE_FILTER] * len(terms), params
+
+
+def search_tags(conn, query="", cursor=None, limit=PAGE_SIZE, fts=None):
+    """
+    1ページ分のタグを返す: (rows, next_cursor)。rows は (tag_id, name, category, created_at)。
+    next_cursor は続きが無ければ None。fts は has_fts(conn) の結果（呼び出し側でキャッシュできる）。
+    """
+    limit = max(1, min(int(limit), PAGE_SIZE_MAX))
+    if fts is None:
+        fts = has_fts(conn)
+    where, params = _filters(query.split(), fts)
+    if cursor:
+        created_at, tag_id = decode_cursor(cursor)
+        where.insert(0, SQL_AFTER_CURSOR)
+        params[:0] = (created_at, created_at, tag_id)
+    # 1行多く読んで続きがあるかを見る
+    sql = SQL_PAGE.format(where=" AND ".join(where) or "1")
+    rows = conn.execute(sql, (*params, limit + 1)).fetchall()
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1])
+    return rows, None
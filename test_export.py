@@ -0,0 +1,64 @@
+"""
+export.py --server の確認（一時DBのサーバを立てて usage_event と tags を書き出す）。
+
+    python -m pytest test_export.py
+"""
+import csv
+import json
+import threading
+
+import pytest
+
+import export
+
+N_TAGS = 3
+N_EVENTS = 12
+
+
+def tag_id(i):
+    return f"E218{i:019X}"
+
+
+@pytest.fixture
+def base_url(server):
+    from werkzeug.serving import make_server
+
+    client = server.app.test_client()
+    for i in range(N_TAGS):
+        client.post("/register", json={"tag_id": tag_id(i), "name": f"item{i}", "category": "リップ"})
+    events = [{"tag_id": tag_id(i % N_TAGS), "name": "x", "category": "リップ", "event_type": "absent_start",
+               "ts_ms": 1_700_000_000_000 + i, "duration_sec": i, "event_key": f"k{i}"} for i in range(N_EVENTS)]
+    assert client.post("/usage-events/batch", json={"events": events}).json["accepted"] == N_EVENTS
+
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+
+
+@pytest.mark.parametrize("fmt", ["csv", "ndjson", "rfcol"])
+def test_export_usage_event(base_url, tmp_path, fmt):
+    out = tmp_path / f"usage.{export.EXTENSIONS[fmt]}"
+    export.main(["-o", str(out), "--format", fmt, "--server", base_url])
+    ids = [int(r["id"]) for r in _read(out, fmt)]
+    assert ids == list(range(1, N_EVENTS + 1))
+
+    # 再開: 書き終えた最後の id より後だけを追記する（何も増えていなければそのまま）
+    export.main(["-o", str(out), "--format", fmt, "--server", base_url, "--resume"])
+    assert [int(r["id"]) for r in _read(out, fmt)] == ids
+
+
+@pytest.mark.parametrize("fmt", ["csv", "ndjson", "rfcol"])
+def test_export_tags(base_url, tmp_path, fmt):
+    out = tmp_path / f"tags.{export.EXTENSIONS[fmt]}"
+    export.main(["-o", str(out), "--format", fmt, "--table", "tags", "--server", base_url])
+    assert sorted(r["tag_id"] for r in _read(out, fmt)) == [tag_id(i) for i in range(N_TAGS)]
+
+
+def _read(path, fmt):
+    if fmt == "rfcol":
+        return list(export.read_rfcol(path))
+    with open(path, encoding="utf-8") as f:
+        if fmt == "csv":
+            return list(csv.DictReader(f))
+        return [json.loads(line) for line in f]
@@ -0,0 +1,95 @@
+"""
+ReaderHub をパイプで確かめる（hidraw の代わりに add_fd でパイプを登録し、HIDレポートを書き込む）。
+
+    python -m pytest test_hid_devices.py
+"""
+import os
+
+import pytest
+
+from hid_decoder import KEY_ENTER, KEYMAP, REPORT_SIZE
+from hid_devices import ReaderHub
+
+TAG = "E2180000000000000000A1"
+CODES = {ch: code for code, ch in KEYMAP.items()}
+KEY_UP = bytes(REPORT_SIZE)
+
+
+def report(*keys):
+    return bytes([0, 0, *keys]) + bytes(REPORT_SIZE - 2 - len(keys))
+
+
+def keys(text, keyup=True):
+    """text を1文字ずつ押すレポート列（keyup=False は離しレポートを送らない機種）"""
+    out = b""
+    for ch in text:
+        out += report(CODES[ch])
+        if keyup:
+            out += KEY_UP
+    return out
+
+
+def typed(text, keyup=True):
+    """text + Enter"""
+    return keys(text, keyup) + report(KEY_ENTER) + (KEY_UP if keyup else b"")
+
+
+@pytest.fixture
+def hub(tmp_path):
+    hub = ReaderHub(dev_dir=str(tmp_path), watch=False)
+    pipes = []
+
+    def add(path):
+        r, w = os.pipe()
+        hub.add_fd(path, r)
+        pipes.append(w)
+        return w
+
+    hub.add_pipe = add
+    yield hub
+    hub.close()
+    for w in pipes:
+        os.close(w)
+
+
+def poll_all(hub, polls=3):
+    found = []
+    for _ in range(polls):
+        found.extend(hub.poll(0.05))
+    return found
+
+
+def test_tags_from_two_readers(hub):
+    a = hub.add_pipe("pipe-a")
+    b = hub.add_pipe("pipe-b")
+    os.write(a, typed(TAG))
+    os.write(b, typed("E280" + "F" * 19) + typed(TAG))
+    assert sorted(poll_all(hub)) == sorted([
+        ("pipe-a", TAG), ("pipe-b", "E280" + "F" * 19), ("pipe-b", TAG),
+    ])
+    assert hub.devices["pipe-b"].tags_read == 2
+
+
+def test_report_split_across_writes(hub):
+    w = hub.add_pipe("pipe")
+    data = typed(TAG)
+    os.write(w, data[:13])      # レポートの途中で切れる
+    assert poll_all(hub, 1) == []
+    os.write(w, data[13:])
+    assert poll_all(hub) == [("pipe", TAG)]
+
+
+def test_repeated_key_with_keyup(hub):
+    # 同じキーが続く（0 0）: 離しレポートを挟めば2回、押しっぱなしのレポートは1回
+    w = hub.add_pipe("pipe")
+    zero = CODES["0"]
+    held = report(zero) + report(zero) + report(zero) + KEY_UP
+    os.write(w, keys("E218") + held + report(zero) + KEY_UP + report(KEY_ENTER) + KEY_UP)
+    assert poll_all(hub) == [("pipe", "E21800")]
+
+
+def test_reader_without_keyup_reports(hub):
+    # 離しレポートを送らない機種は各レポートを1回の入力とみなす（同じキーの連続も2回）
+    w = hub.add_pipe("pipe")
+    os.write(w, typed("E2100", keyup=False))
+    assert poll_all(hub) == [("pipe", "E2100")]
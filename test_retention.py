@@ -0,0 +1,94 @@
+"""
+retention.run の確認（古い生イベントを退避ファイルに移して消し、時間別ロールアップを刈り込む）。
+
+    python -m pytest test_retention.py
+"""
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+import export
+import retention
+import rollups
+import schema
+
+TAG = "E2180000000000000000A1"
+NOW = datetime(2025, 6, 30, 12, 0, 0)
+N_OLD = 10
+N_NEW = 5
+
+
+def ms(dt):
+    return int(dt.timestamp() * 1000)
+
+
+@pytest.fixture
+def pool(tmp_path):
+    conn = sqlite3.connect(tmp_path / "rfid.db")
+    schema.migrate(conn)
+    # 古い分は1日ずつ 40〜49日前、新しい分は直近の数時間
+    rows = [(TAG, "absent_start", ms(NOW - timedelta(days=40 + i)), None) for i in range(N_OLD)]
+    rows += [(TAG, "present_return", ms(NOW - timedelta(hours=i + 1)), 10) for i in range(N_NEW)]
+    conn.executemany("INSERT INTO usage_event (tag_id, event_type, ts_ms, duration_sec) VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    pool = db.ConnectionPool(tmp_path / "rfid.db")
+    yield pool
+    pool.close_all()
+
+
+def policy(tmp_path, **kw):
+    return retention.RetentionPolicy(**{"days": 30, "hourly_days": 7, "archive_dir": tmp_path / "archive", **kw})
+
+
+def count(pool, sql):
+    with pool.connection() as conn:
+        return conn.execute(sql).fetchone()[0]
+
+
+def test_dry_run_writes_nothing(pool, tmp_path):
+    report = retention.run(pool, policy(tmp_path), now=NOW, dry_run=True)
+    steps = {step["step"]: step for step in report["steps"]}
+    assert steps["rollup"]["rows"] == N_OLD + N_NEW
+    assert steps["archive"]["rows"] == N_OLD
+    assert count(pool, "SELECT COUNT(*) FROM usage_event") == N_OLD + N_NEW
+    assert not (tmp_path / "archive").exists()
+
+
+def test_prune_and_archive(pool, tmp_path, monkeypatch):
+    monkeypatch.setattr(retention, "BATCH_ROWS", 3)     # 退避ファイルを複数の行グループに分ける
+    with pool.connection() as conn:
+        old_ids = [r[0] for r in conn.execute("SELECT id FROM usage_event WHERE ts_ms < ? ORDER BY id",
+                                              (ms(NOW - timedelta(days=30)),))]
+    assert len(old_ids) == N_OLD
+
+    report = retention.run(pool, policy(tmp_path), now=NOW)
+    done = report["done"]
+    assert done["rollup"] == N_OLD + N_NEW
+    assert done["archive"] == N_OLD
+    assert done["hourly"] == N_OLD      # 古い日の時間別は1日1行ずつ
+
+    archived = list(export.read_rfcol(done["archive_file"]))
+    assert [row["id"] for row in archived] == old_ids
+    assert {row["event_type"] for row in archived} == {"absent_start"}
+    assert count(pool, "SELECT COUNT(*) FROM usage_event") == N_NEW
+    assert count(pool, f"SELECT COUNT(*) FROM usage_event WHERE id IN ({','.join(map(str, old_ids))})") == 0
+
+    # 日別ロールアップは生イベントを消しても残る
+    with pool.connection() as conn:
+        daily = rollups.stats_daily(conn, "2000-01-01", "2100-01-01")
+    assert sum(r["absences"] for r in daily) == N_OLD
+    assert sum(r["uses"] for r in daily) == N_NEW
+
+    # もう一度実行しても消すものは無い
+    again = retention.run(pool, policy(tmp_path), now=NOW)["done"]
+    assert (again["rollup"], again["archive"], again["hourly"]) == (0, 0, 0)
+    assert again["archive_file"] is None
+
+
+def test_days_zero_keeps_raw_events(pool, tmp_path):
+    done = retention.run(pool, policy(tmp_path, days=0), now=NOW)["done"]
+    assert "archive" not in done
+    assert count(pool, "SELECT COUNT(*) FROM usage_event") == N_OLD + N_NEW
@@ -0,0 +1,92 @@
+"""
+schema.migrate の確認（同梱の rfid.db と同じ v0 のスキーマに行を入れて移行する）。
+
+    python -m pytest test_schema.py
+"""
+import sqlite3
+
+import pytest
+
+import schema
+
+KEPT = "E2180000000000000000A1"
+DELETED = "E2180000000000000000B2"      # 変更ログ導入前に削除されたタグ
+
+V0_DDL = (
+    "CREATE TABLE tags (tag_id TEXT PRIMARY KEY, name TEXT, category TEXT, created_at TEXT)",
+    "CREATE TABLE usage_log (id INTEGER PRIMARY KEY AUTOINCREMENT, tag_id TEXT, timestamp TEXT)",
+    """CREATE TABLE usage_event (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tag_id TEXT NOT NULL, name TEXT NOT NULL, category TEXT NOT NULL,
+        event_type TEXT NOT NULL, timestamp TEXT NOT NULL, duration_sec INTEGER
+    )""",
+)
+
+
+def ts_ms(conn, text):
+    """旧スキーマのローカル時刻 -> エポックミリ秒（移行と同じ解釈）"""
+    return conn.execute("SELECT CAST(strftime('%s', ?, 'utc') AS INTEGER) * 1000", (text,)).fetchone()[0]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / "rfid.db")
+    for ddl in V0_DDL:
+        conn.execute(ddl)
+    conn.execute("INSERT INTO tags VALUES (?, 'lip', 'リップ', '2025-06-01 10:00:00')", (KEPT,))
+    conn.executemany("INSERT INTO usage_log (tag_id, timestamp) VALUES (?, ?)", [
+        (KEPT, "2025-06-04 04:31:05"),
+        (DELETED, "2025-06-04 04:32:00"),
+        (None, "2025-06-04 04:33:00"),          # tag_id の無い行は移さない
+        (KEPT, "壊れた時刻"),                     # 解釈できない時刻は 0
+    ])
+    conn.executemany(
+        "INSERT INTO usage_event (tag_id, name, category, event_type, timestamp, duration_sec) "
+        "VALUES (?, ?, ?, ?, ?, ?)", [
+            (KEPT, "lip", "リップ", "absent_start", "2025-06-05 12:00:00", None),
+            (KEPT, "lip", "リップ", "present_return", "2025-06-05 12:00:30", 30),
+            (DELETED, "old", "チーク", "absent_start", "2025-06-05 13:00:00", None),
+            (DELETED, "older", "チーク", "present_return", "2025-06-05 13:00:10", 10),
+        ])
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_migrate_v0_with_usage_log(conn):
+    assert schema.migrate(conn) == (0, schema.SCHEMA_VERSION)
+    assert schema.schema_version(conn) == schema.SCHEMA_VERSION
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert "usage_log" not in tables and "usage_event_v1" not in tables
+
+    # 旧 usage_event は id をそのまま、usage_log はその後ろに legacy_log として並ぶ
+    rows = conn.execute("SELECT id, tag_id, event_type, ts_ms, duration_sec, event_key "
+                        "FROM usage_event ORDER BY id").fetchall()
+    assert [r[:3] for r in rows] == [
+        (1, KEPT, "absent_start"),
+        (2, KEPT, "present_return"),
+        (3, DELETED, "absent_start"),
+        (4, DELETED, "present_return"),
+        (5, KEPT, "legacy_log"),
+        (6, DELETED, "legacy_log"),
+        (7, KEPT, "legacy_log"),
+    ]
+    assert [r[5] for r in rows] == [None] * 4 + ["usage_log:1", "usage_log:2", "usage_log:4"]
+    assert rows[1][3:5] == (ts_ms(conn, "2025-06-05 12:00:30"), 30)
+    assert rows[4][3] == ts_ms(conn, "2025-06-04 04:31:05")
+    assert rows[6][3] == 0
+
+    # 削除済みタグはイベントに残っていた最後の名前・カテゴリで引ける
+    named = conn.execute(f"SELECT id, name, category, timestamp FROM {schema.USAGE_EVENT_VIEW} "
+                         "ORDER BY id").fetchall()
+    assert [r[1:3] for r in named] == [("lip", "リップ")] * 2 + [("older", "チーク")] * 2 + [
+        ("lip", "リップ"), ("older", "チーク"), ("lip", "リップ")]
+    assert named[0][3] == "2025-06-05 12:00:00"
+
+
+def test_migrate_twice(conn):
+    schema.migrate(conn)
+    before = conn.execute("SELECT * FROM usage_event ORDER BY id").fetchall()
+    assert schema.migrate(conn) == (schema.SCHEMA_VERSION, schema.SCHEMA_VERSION)
+    assert conn.execute("SELECT * FROM usage_event ORDER BY id").fetchall() == before
+    assert conn.execute("SELECT COUNT(*) FROM tag_changes WHERE tag_id = ?", (DELETED,)).fetchone()[0] == 1
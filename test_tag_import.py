@@ -0,0 +1,72 @@
+"""
+tag_import.import_tags の確認（行ごとの created / updated / unchanged / error と dry_run）。
+
+    python -m pytest test_tag_import.py
+"""
+import sqlite3
+
+import pytest
+
+import schema
+import tag_import
+
+A = "E2180000000000000000A1"
+B = "E2180000000000000000B2"
+C = "E2180000000000000000C3"
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / "rfid.db")
+    schema.migrate(conn)
+    tag_import.import_tags(conn, [{"tag_id": A, "name": "lip", "category": "リップ"},
+                                  {"tag_id": B, "name": "cheek", "category": "チーク"}])
+    yield conn
+    conn.close()
+
+
+def tags(conn):
+    return conn.execute("SELECT tag_id, name, category FROM tags ORDER BY tag_id").fetchall()
+
+
+ITEMS = [
+    {"tag_id": A, "name": "lip", "category": "リップ"},            # そのまま
+    {"tag_id": B.lower(), "name": "blush", "category": "チーク"},   # 名前が変わった（小文字でも同じタグ）
+    {"tag_id": C, "name": "eye", "category": "アイ"},               # 新しい
+    {"tag_id": "e218-0000-0000-0000-0000-c3", "name": "x", "category": "アイ"},    # C と重複
+    {"tag_id": "E219" + "0" * 18, "name": "bad", "category": "アイ"},
+    {"tag_id": C, "name": "", "category": "アイ"},
+    {"_error": "JSONとして読めません"},
+]
+
+
+def test_statuses(conn):
+    results = tag_import.import_tags(conn, ITEMS)
+    assert [(r["tag_id"], r["status"]) for r in results] == [
+        (A, "unchanged"), (B, "updated"), (C, "created"),
+        ("e218-0000-0000-0000-0000-c3", "error"),
+        ("E219" + "0" * 18, "error"), (C, "error"), (None, "error"),
+    ]
+    assert results[3]["error"] == "同じtag_idが入力の中で重複しています"
+    assert results[6]["error"] == "JSONとして読めません"
+    assert tag_import.summarize(results) == {"created": 1, "updated": 1, "unchanged": 1, "error": 4}
+    assert tags(conn) == [(A, "lip", "リップ"), (B, "blush", "チーク"), (C, "eye", "アイ")]
+
+
+def test_dry_run_writes_nothing(conn):
+    before = tags(conn)
+    results = tag_import.import_tags(conn, ITEMS, dry_run=True)
+    assert [r["status"] for r in results[:3]] == ["unchanged", "updated", "created"]
+    assert tags(conn) == before
+    assert not conn.in_transaction
+
+
+def test_line_numbers():
+    text = f"tag_id,name,category\n{A},lip,リップ\n\n{B},\"two\nlines\",チーク\n{C},eye,アイ\n"
+    items, lines = tag_import.read_items_with_lines(text)
+    assert [item["tag_id"] for item in items] == [A, B, C]
+    assert lines == [2, 4, 6]
+
+    items, lines = tag_import.read_items_with_lines(f'\n{{"tag_id": "{A}"}}\n{{broken\n', "ndjson")
+    assert lines == [2, 3]
+    assert "_error" in items[1]
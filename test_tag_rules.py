@@ -0,0 +1,146 @@
+"""
+tag_rules の性質テスト。
+
+- normalize_tag が共通化する前の実装（1文字ずつ isalnum）と同じ結果になること
+- 受理されるタグが共通化する前のサーバの判定（prefix・長さ・16進）と同じであること
+- サーバ（server.py）・リーダー（client_input_server.py）・登録ツール（read_single_tag.py）の
+  3つの入口が同じ文字列を受理すること
+
+境界の例と、固定シードで作ったランダムな文字列で確かめる。
+
+    python -m pytest test_tag_rules.py
+"""
+import random
+import re
+
+import pytest
+
+import client_input_server
+import read_single_tag
+import tag_rules
+
+SEED = 20240601
+RANDOM_CASES = 20000
+
+# ---- 共通化する前のサーバの実装 ----
+LEGACY_PREFIXES = ("E218", "E280")
+LEGACY_LENGTHS = {22, 23}
+LEGACY_ALLOWED_RE = re.compile(r"^[0-9A-F]+$")
+
+
+def legacy_normalize(tag):
+    if tag is None:
+        return ""
+    t = tag.strip().upper()
+    return "".join(ch for ch in t if ch.isalnum()).upper()
+
+
+def legacy_is_valid(tag):
+    return (bool(tag) and tag.startswith(LEGACY_PREFIXES) and len(tag) in LEGACY_LENGTHS
+            and LEGACY_ALLOWED_RE.match(tag) is not None)
+
+
+# ---- 入口ごとの「受理したタグ」（受理しなければ None） ----
+def via_reader(raw):
+    return client_input_server.canonical_tag(raw)
+
+
+def via_register_tool(raw):
+    tag = read_single_tag.normalize_tag(raw)
+    return tag if tag and read_single_tag.is_valid_tag(tag) else None
+
+
+@pytest.fixture
+def entry_points(server):
+    def via_server(raw):
+        tag = server.normalize_tag(raw)
+        return tag if server.is_valid_tag(tag) else None
+
+    return {"server": via_server, "reader": via_reader, "read_single_tag": via_register_tool}
+
+
+HEX = "0123456789ABCDEF"
+NOISE = "abcdefxyzGHIJ -:\t\n_./"
+NON_ASCII = "ＥＡ０１２８アイßı٣²Ⅻ 　é"
+
+EDGE_CASES = [
+    "",
+    " ",
+    "\t\n",
+    "E218" + "0" * 18,                      # 22桁
+    "E280" + "F" * 19,                      # 23桁
+    "e218" + "0" * 18,                      # 小文字
+    "e280" + "abcdef0123456789abc",
+    " E218" + "0" * 18 + "\n",              # 前後の空白
+    "E218-0000:0000 0000\t0000_00",         # 区切り文字
+    "E218" + "0" * 17,                      # 短い
+    "E218" + "0" * 20,                      # 長い
+    "E2190" + "0" * 17,                     # prefix違い
+    "E218" + "G" * 18,                      # 16進以外
+    "Ｅ218" + "0" * 18,                      # 全角
+    "E218" + "０" * 18,
+    "E218" + "0" * 17 + "٣",                # ASCII以外の数字
+    "E218" + "0" * 17 + "²",
+    "E218" + "0" * 17 + "ß",                # upper() で2文字になる
+    "E218" + "0" * 17 + "ı",                # upper() で I になる
+    "E218" + "0" * 18 + "é",
+    "E218" + "0" * 18 + "　",                # 全角空白
+]
+
+
+def random_case(rng):
+    kind = rng.randrange(6)
+    if kind == 0:       # 正しいタグ（小文字・区切り混じり）
+        tag = rng.choice(LEGACY_PREFIXES) + "".join(rng.choice(HEX) for _ in range(rng.choice((18, 19))))
+        chars = list(tag.lower() if rng.random() < 0.3 else tag)
+        for _ in range(rng.randrange(3)):
+            chars.insert(rng.randrange(len(chars) + 1), rng.choice(" -:\t"))
+        return "".join(chars)
+    if kind == 1:       # 長さ違い
+        return rng.choice(LEGACY_PREFIXES) + "".join(rng.choice(HEX) for _ in range(rng.randrange(10, 25)))
+    if kind == 2:       # prefix違い
+        return "".join(rng.choice(HEX) for _ in range(rng.choice((22, 23))))
+    if kind == 3:       # 16進以外の英字
+        return rng.choice(LEGACY_PREFIXES) + "".join(rng.choice(HEX + "GHXYZ") for _ in range(rng.choice((18, 19))))
+    if kind == 4:       # 非ASCII混じり
+        tag = rng.choice(LEGACY_PREFIXES) + "".join(rng.choice(HEX) for _ in range(rng.choice((18, 19))))
+        chars = list(tag)
+        for _ in range(rng.randrange(1, 3)):
+            chars.insert(rng.randrange(len(chars) + 1), rng.choice(NON_ASCII))
+        return "".join(chars)
+    return "".join(rng.choice(HEX + NOISE + NON_ASCII) for _ in range(rng.randrange(0, 30)))
+
+
+def mismatches(raw, entry_points):
+    """raw について従来の実装と違う結果を返した箇所のリスト"""
+    expected = legacy_normalize(raw)
+    expected_tag = expected if legacy_is_valid(expected) else None
+    found = []
+    if tag_rules.normalize_tag(raw) != expected:
+        found.append(("normalize", raw, expected, tag_rules.normalize_tag(raw)))
+    for name, entry in entry_points.items():
+        got = entry(raw)
+        if got != expected_tag:
+            found.append((name, raw, expected_tag, got))
+    return found
+
+
+@pytest.mark.parametrize("raw", EDGE_CASES)
+def test_edge_cases(raw, entry_points):
+    assert mismatches(raw, entry_points) == []
+
+
+def test_random_cases(entry_points):
+    rng = random.Random(SEED)
+    inputs = [random_case(rng) for _ in range(RANDOM_CASES)]
+    found = [m for raw in inputs for m in mismatches(raw, entry_points)]
+    assert found[:10] == []
+    # 受理される例と拒否される例が両方とも十分に含まれていること
+    accepted = sum(entry_points["server"](raw) is not None for raw in inputs)
+    assert RANDOM_CASES // 10 < accepted < RANDOM_CASES * 9 // 10
+
+
+def test_valid_edge_cases_are_accepted(entry_points):
+    # 比べる相手が両方とも拒否するだけのテストになっていないこと
+    assert entry_points["server"]("e218" + "0" * 18) == "E218" + "0" * 18
+    assert via_reader(" E280-" + "f" * 19) == "E280" + "F" * 19
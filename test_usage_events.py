@@ -0,0 +1,64 @@
+"""
+/usage-events/batch の検証（1件ずつの結果と、再送の重複排除）。
+
+    python -m pytest test_usage_events.py
+"""
+import pytest
+
+TAG = "E218" + "0" * 17 + "1"
+
+
+def event(**kw):
+    ev = {"tag_id": TAG, "name": "a", "category": "リップ", "event_type": "absent_start",
+          "ts_ms": 1_700_000_000_000, "duration_sec": 3}
+    ev.update(kw)
+    return ev
+
+
+def count_events(server):
+    with server.pool.connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM usage_event").fetchone()[0]
+
+
+@pytest.mark.parametrize("bad", [
+    {"duration_sec": 10 ** 30},
+    {"duration_sec": 1e400},
+    {"duration_sec": True},
+    {"duration_sec": -1},
+    {"ts_ms": 10 ** 30},
+    {"ts_ms": False},
+    {"ts_ms": 1.5},
+    {"tag_id": 123},
+    {"event_key": 5},
+])
+def test_bad_event_in_the_middle_of_a_batch(server, bad):
+    client = server.app.test_client()
+    r = client.post("/usage-events/batch", json={"events": [event(), event(**bad), event()]})
+    assert r.status_code == 200
+    statuses = [res["status"] for res in r.json["results"]]
+    assert statuses == ["ok", "error", "ok"]
+    assert r.json["accepted"] == 2 and r.json["rejected"] == 1
+    assert count_events(server) == 2
+
+
+def test_largest_values_are_stored(server):
+    client = server.app.test_client()
+    big = server.SQLITE_INT_MAX
+    r = client.post("/usage-events/batch", json={"events": [event(ts_ms=big, duration_sec=big)]})
+    assert r.json["accepted"] == 1
+
+
+def test_resent_event_keys_are_ignored(server):
+    client = server.app.test_client()
+    events = [event(event_key=f"k{i}", ts_ms=1_700_000_000_000 + i) for i in range(3)]
+    first = client.post("/usage-events/batch", json={"events": events}).json
+    assert (first["accepted"], first["duplicates"]) == (3, 0)
+
+    # 同じバッチを再送（応答が届かなかったとき）+ 同じバッチ内の重複
+    again = client.post("/usage-events/batch", json={"events": events + [event(event_key="k9"), event(event_key="k9")]}).json
+    assert [res["status"] for res in again["results"]] == ["duplicate"] * 3 + ["ok", "duplicate"]
+    assert (again["accepted"], again["duplicates"]) == (1, 4)
+
+    # 1件ずつの /usage-event でも同じキーは1回だけ
+    assert client.post("/usage-event", json=event(event_key="k0")).json["status"] == "duplicate"
+    assert count_events(server) == 4
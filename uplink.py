@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+リーダーからサーバへの通信をすべてバックグラウンドスレッドで行う。
+
+HIDの読み取りループ（select）がネットワーク待ちで止まると、hidrawのバッファが
+溢れてタグの途中の文字を落とすことがある。そこでループ側はキューに積むだけにして、
+送信・リトライ・台帳の取得は別スレッドに任せる。
+
+- Outbox   : usage_event の送信待ち（ディスク上。サーバ停止中も失わない）
+- Uplink   : Outbox の中身のバッチ送信と褒めメッセージの送信
+- TagSync  : /tags/changes の定期取得。結果はキュー経由でループ側が反映する。
+             最後に取れた台帳はスナップショットに保存し、起動直後はそれで照合を始める
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import Counter, Gauge, Histogram
+
+HTTP_TIMEOUT = 3
+OUTBOX_MAX_ROWS = 500000    # Outboxの上限（溢れたら新しいものを捨てて数える）
+FEEDBACK_QUEUE_MAX = 20
+BATCH_WINDOW = 0.5          # usage_eventをまとめて送るまでの待ち時間（秒）
+BATCH_MAX_EVENTS = 100      # これだけ溜まったら待たずに送る
+RETRY_BASE = 0.5            # リトライ間隔の初期値（秒、失敗ごとに倍）
+RETRY_MAX = 30.0
+FEEDBACK_MAX_TRIES = 3      # 褒めメッセージは古くなると意味がないので数回で諦める
+TAG_RETRY_MAX = 60.0        # 台帳の取得に失敗し続けたときの取得間隔の上限（秒）
+NOT_MODIFIED = object()     # fetch_tags: 台帳が変わっていない（304）
+
+log = logging.getLogger("rfid.uplink")
+
+REQUEST_SECONDS = Histogram("rfid_uplink_request_seconds", "outbound request latency", ["path"])
+REQUEST_ERRORS = Counter("rfid_uplink_request_errors_total", "outbound requests that failed", ["path"])
+EVENTS = Counter("rfid_uplink_events_total", "usage_event results reported by the server", ["result"])
+QUEUE_DEPTH = Gauge("rfid_uplink_queue_depth", "events and feedback waiting to be sent", ["queue"])
+
+
+def make_session() -> requests.Session:
+    """keep-aliveで接続を使い回すセッション（リトライは自前で行う）"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class Outbox:
+    """
+    usage_event の送信待ちを貯めるローカルのSQLite（追記のみ）。
+    サーバが落ちていても捨てずに残し、再起動後も id 順に再送する。
+    各イベントには event_key（UUID）を付け、サーバ側で重複登録を防ぐ。
+    """
+
+    def __init__(self, path, max_rows=OUTBOX_MAX_ROWS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        """)
+        self._conn.commit()
+        self.depth = self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def append(self, payload):
+        """payload に event_key を付けて保存する。上限超過時は False"""
+        with self._lock:
+            if self.depth >= self.max_rows:
+                return False
+            payload = dict(payload)
+            payload.setdefault("event_key", uuid.uuid4().hex)
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO outbox (event_key, payload, created_at) VALUES (?, ?, datetime('now', 'localtime'))",
+                (payload["event_key"], json.dumps(payload, ensure_ascii=False)),
+            )
+            self._conn.commit()
+            self.depth += cur.rowcount
+            return True
+
+    def peek(self, limit):
+        """古い順に最大 limit 件: [(id, payload)]"""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, payload FROM outbox ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def ack(self, last_id):
+        """last_id まで送信済みとして消す"""
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM outbox WHERE id <= ?", (last_id,))
+            self._conn.commit()
+            self.depth = max(0, self.depth - cur.rowcount)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Uplink:
+    """
+    usage_event と褒めメッセージの送信。
+    usage_event はまず Outbox に書き、送信スレッドが古い順に /usage-events/batch へ流す。
+    褒めメッセージはメモリ上のキューのみ（古くなったものを後から出しても意味がないため）。
+    submit_* はネットワークを待たない。
+    """
+
+    def __init__(self, server, outbox_path, window=BATCH_WINDOW, max_events=BATCH_MAX_EVENTS):
+        self.server = server
+        self.window = window
+        self.max_events = max_events
+        self.outbox = Outbox(outbox_path)
+        self._feedback = deque(maxlen=FEEDBACK_QUEUE_MAX)
+        self._feedback_tries = 0        # 先頭の褒めメッセージの送信試行回数
+        self._session = make_session()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="uplink", daemon=True)
+
+        # メトリクス
+        self.sent_events = 0
+        self.duplicate_events = 0
+        self.rejected_events = 0
+        self.sent_feedback = 0
+        self.dropped = 0
+        self.failures = 0
+        self.last_latency = None
+        QUEUE_DEPTH.labels("outbox").set_function(lambda: self.outbox.depth)
+        QUEUE_DEPTH.labels("feedback").set_function(lambda: len(self._feedback))
+
+    # ---- ループ側から呼ぶ ----
+    def start(self):
+        if self.outbox.depth:
+            log.info("📦 未送信のusage_event %s件を再送します", self.outbox.depth)
+        self._thread.start()
+        return self
+
+    def submit_usage(self, payload):
+        if not self.outbox.append(payload):
+            self.dropped += 1
+            return
+        self._wake.set()
+
+    def submit_feedback(self, message, image=None):
+        if len(self._feedback) == self._feedback.maxlen:
+            self.dropped += 1
+        self._feedback.append({"message": message, "image": image})
+        self._wake.set()
+
+    def stats(self):
+        return {
+            "queue_depth": self.outbox.depth + len(self._feedback),
+            "outbox": self.outbox.depth,
+            "sent_events": self.sent_events,
+            "duplicate_events": self.duplicate_events,
+            "rejected_events": self.rejected_events,
+            "sent_feedback": self.sent_feedback,
+            "dropped": self.dropped,
+            "failures": self.failures,
+            "last_latency_ms": None if self.last_latency is None else round(self.last_latency * 1000, 1),
+        }
+
+    def stop(self, timeout=5.0):
+        """送れる分を送ってから止める（送れなかったものはOutboxに残り、次回起動時に再送）"""
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+    # ---- 送信スレッド ----
+    def _post(self, path, payload):
+        t0 = time.monotonic()
+        try:
+            r = self._session.post(f"{self.server}{path}", json=payload, timeout=HTTP_TIMEOUT)
+        except Exception:
+            REQUEST_ERRORS.labels(path).inc()
+            raise
+        self.last_latency = time.monotonic() - t0
+        REQUEST_SECONDS.labels(path).observe(self.last_latency)
+        if r.status_code >= 500:
+            REQUEST_ERRORS.labels(path).inc()
+        return r
+
+    def _send_events(self, events):
+        """送れたら True（サーバが個別に拒否したものは送信済み扱い）"""
+        try:
+            r = self._post("/usage-events/batch", {"events": events})
+        except Exception as e:
+            log.warning("⚠ /usage-events/batch 送信失敗（%s件）: %s", len(events), e)
+            return False
+        if r.status_code >= 500:
+            log.warning("⚠ /usage-events/batch 失敗: HTTP %s", r.status_code)
+            return False
+        if r.status_code != 200:
+            log.error("⚠ /usage-events/batch 拒否: HTTP %s（%s件破棄）", r.status_code, len(events))
+            self.rejected_events += len(events)
+            EVENTS.labels("rejected").inc(len(events))
+            return True
+        for ev, res in zip(events, r.json().get("results", [])):
+            status = res.get("status")
+            if status == "ok":
+                self.sent_events += 1
+                EVENTS.labels("ok").inc()
+            elif status == "duplicate":
+                self.duplicate_events += 1
+                EVENTS.labels("duplicate").inc()
+            else:
+                self.rejected_events += 1
+                EVENTS.labels("rejected").inc()
+                log.error("⚠ usage_event 拒否: %s %s (%s)", ev.get("tag_id"), ev.get("event_type"), res.get("error"))
+        return True
+
+    def _drain_outbox(self):
+        """Outboxを古い順に送る。途中で失敗したら False（残りは次回）"""
+        while True:
+            rows = self.outbox.peek(self.max_events)
+            if not rows:
+                return True
+            if not self._send_events([payload for _, payload in rows]):
+                return False
+            self.outbox.ack(rows[-1][0])
+
+    def _drain_feedback(self):
+        while self._feedback:
+            payload = self._feedback[0]
+            try:
+                self._post("/feedback", payload)
+            except Exception as e:
+                log.warning("⚠ フィードバック送信失敗: %s", e)
+                self._feedback_tries += 1
+                if self._feedback_tries >= FEEDBACK_MAX_TRIES:
+                    self._feedback.popleft()
+                    self._feedback_tries = 0
+                    self.dropped += 1
+                return False
+            self._feedback.popleft()
+            self._feedback_tries = 0
+            self.sent_feedback += 1
+            log.info("💬 褒め送信: %s", payload["message"])
+        return True
+
+    def _run(self):
+        backoff = 0.0
+        while True:
+            stopping = self._stop.is_set()
+            if not stopping:
+                if backoff:
+                    self._stop.wait(backoff)
+                elif self._wake.wait(0.5) and self.window > 0 and not self._feedback:
+                    # 同時に発生したイベントをまとめるため少し待つ
+                    self._stop.wait(self.window)
+                self._wake.clear()
+
+            ok = self._drain_feedback()
+            ok = self._drain_outbox() and ok
+
+            if ok:
+                backoff = 0.0
+            else:
+                self.failures += 1
+                backoff = min(RETRY_MAX, backoff * 2 if backoff else RETRY_BASE)
+
+            if stopping:
+                if self.outbox.depth:
+                    log.warning("📦 未送信のusage_event %s件はOutboxに残します", self.outbox.depth)
+                self.outbox.close()
+                return
+
+
+class TagSync:
+    """
+    /tags/changes を CHECK_INTERVAL ごとに取りに行くスレッド。
+    取得結果 (version, full, changes) は results キューに入れ、ループ側が反映する。
+
+    snapshot_path を渡すと、台帳が変わるたびに全件をそこへ保存し（書き換えは rename で一度に）、
+    start() で読み込んで全件として results に入れる。サーバが起動していなくても
+    リーダーは前回の台帳ですぐに照合を始められる。
+    スナップショットの版は使わず、起動後の最初の取得は全件（止まっている間に
+    サーバのDBが作り直されていても差分がずれない）。
+    取得に失敗したら RETRY_BASE から倍々に TAG_RETRY_MAX まで間隔を空ける。
+    """
+
+    def __init__(self, server, interval, snapshot_path=None):
+        self.server = server
+        self.interval = interval
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self.version = None
+        self.tags = {}          # tag_id -> {"name", "category"}（スナップショットに書く写し）
+        self.failures = 0
+        self.results = queue.SimpleQueue()
+        self._etag = None
+        self._session = make_session()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="tag-sync", daemon=True)
+
+    def start(self):
+        self.load_snapshot()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def load_snapshot(self):
+        """保存済みの台帳を読み、全件として results に入れる。戻り値は読めたタグ数（無ければNone）"""
+        if self.snapshot_path is None or not self.snapshot_path.exists():
+            return None
+        try:
+            data = json.loads(self.snapshot_path.read_text(encoding="utf-8"))
+            if data.get("server") != self.server:
+                log.info("台帳スナップショットは別のサーバ（%s）のものなので使いません", data.get("server"))
+                return None
+            tags = {tid: {"name": t["name"], "category": t.get("category", "")}
+                    for tid, t in data["tags"].items()}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            log.warning("⚠ 台帳スナップショットを読めません（無視します）: %s", e)
+            return None
+        self.tags = tags
+        self.results.put((True, [{"tag_id": tid, "op": "upsert", **meta} for tid, meta in tags.items()]))
+        log.info("📂 台帳スナップショットから%s件（version %s, %s保存）", len(tags), data.get("version"),
+                 data.get("saved_at"))
+        return len(tags)
+
+    def save_snapshot(self):
+        tmp = self.snapshot_path.with_name(self.snapshot_path.name + ".tmp")
+        data = {
+            "server": self.server,
+            "version": self.version,
+            "saved_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "tags": self.tags,
+        }
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())    # 電源断で中身の無いファイルに置き換わらないように
+            os.replace(tmp, self.snapshot_path)
+        except OSError as e:
+            log.warning("⚠ 台帳スナップショットを保存できません: %s", e)
+
+    def _apply(self, full, changes):
+        """写しに反映し、中身が変わったかを返す（同じ全件が毎回返る古いサーバで書き直さない）"""
+        tags = {} if full else dict(self.tags)
+        for ch in changes:
+            if ch["op"] == "delete":
+                tags.pop(ch["tag_id"], None)
+            else:
+                tags[ch["tag_id"]] = {"name": ch["name"], "category": ch.get("category") or ""}
+        changed = tags != self.tags
+        self.tags = tags
+        return changed
+
+    def fetch_tags(self):
+        """
+        /tags を取得する。ETagを付けて問い合わせ、台帳が変わっていなければ(304)
+        NOT_MODIFIED を返す。取得に失敗したときは None。
+        """
+        headers = {"If-None-Match": self._etag} if self._etag else {}
+        try:
+            with REQUEST_SECONDS.labels("/tags").time():
+                r = self._session.get(f"{self.server}/tags", headers=headers, timeout=HTTP_TIMEOUT)
+            if r.status_code == 304:
+                return NOT_MODIFIED
+            if r.status_code == 200:
+                data = r.json()
+                self._etag = r.headers.get("ETag")
+                return {t["tag_id"]: {"name": t["name"], "category": t.get("category", "")} for t in data}
+        except Exception as e:
+            REQUEST_ERRORS.labels("/tags").inc()
+            log.warning("⚠ /tags取得エラー: %s", e)
+        return None
+
+    def fetch_changes(self, since):
+        """
+        /tags/changes?since= から差分を取得する。
+        戻り値: (version, full, changes)。取得失敗時はNone。
+        差分APIの無い古いサーバには /tags の全件で代用する。
+        """
+        try:
+            with REQUEST_SECONDS.labels("/tags/changes").time():
+                r = self._session.get(f"{self.server}/tags/changes", params={"since": since or 0},
+                                      timeout=HTTP_TIMEOUT)
+            if r.status_code == 404:
+                fresh = self.fetch_tags()
+                if fresh is None:
+                    return None
+                if fresh is NOT_MODIFIED:
+                    return since, False, []
+                changes = [{"tag_id": tid, "op": "upsert", **meta} for tid, meta in fresh.items()]
+                return 0, True, changes
+            if r.status_code == 200:
+                data = r.json()
+                return data["version"], data["full"], data["changes"]
+        except Exception as e:
+            REQUEST_ERRORS.labels("/tags/changes").inc()
+            log.warning("⚠ /tags/changes取得エラー: %s", e)
+        return None
+
+    def _run(self):
+        while not self._stop.is_set():
+            result = self.fetch_changes(self.version)
+            if result is None:
+                self.failures += 1
+                self._stop.wait(min(TAG_RETRY_MAX, RETRY_BASE * 2 ** min(self.failures - 1, 16)))
+                continue
+            if self.failures:
+                log.info("✅ 台帳の取得が復旧しました（%s回失敗）", self.failures)
+                self.failures = 0
+            version, full, changes = result
+            self.version = version
+            if full or changes:
+                self.results.put((full, changes))
+                if self.snapshot_path is not None and self._apply(full, changes):
+                    self.save_snapshot()
+            self._stop.wait(self.interval)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+本番用のエントリポイント（Flaskの開発サーバの代わり）。
+
+    gunicorn -w 4 -k gthread --threads 8 --preload -b 0.0.0.0:8000 wsgi:app
+    uvicorn wsgi:asgi --workers 4 --host 0.0.0.0 --port 8000     # asgiref が必要
+
+- --preload なら init_db（マイグレーション）は親プロセスで1回だけ走る
+- /feedback/stream（SSE）は接続ごとにスレッドを1本使うので、gunicorn は gthread ワーカーで
+  ディスプレイの台数より多めの --threads にする
+- 褒めメッセージと台帳はDB経由でワーカー間で共有される（どのワーカーに当たっても同じ結果）
+- /metrics はワーカーごとの値（スクレイプのたびに当たったワーカーの分が返る）
+- retention と RFID_EMBEDDED_READER=1 のリーダーのループ（embedded.py）は、ジョブのロックを
+  取れた1ワーカーだけで動く。gunicorn は gunicorn.conf.py の post_worker_init で起動直後に、
+  それ以外（uvicorn など）は各ワーカーの最初のリクエストで始まる
+
+環境変数 RFID_DB_PATH / RFID_RETENTION_DAYS などは server.py と同じ。
+"""
+import logsetup
+from server import create_app
+
+logsetup.setup()
+app = create_app()
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:     # uvicorn を使わないなら不要
+    asgi = None
+else:
+    asgi = WsgiToAsgi(app)